@@ -159,6 +159,117 @@ def __write_chunk_data(active_channels, base_sample_count, frequency_factor, chu
     return data
 
 
+class AcquisitionEngine:
+    """
+    Streaming acquisition into one preallocated output array
+
+    The engine owns a float output array sized from block_size and the int32 extraction buffers for the velocity and
+    data validity channels. Each chunk read from the ring buffer is extracted in place, validated and written scaled
+    (np.multiply(..., out=)) at its offset in the output array, so no chunk list and no np.concatenate are needed.
+    The same engine (and the same memory) is reused for every measurement.
+    """
+
+    def __init__(self, data_acquisition, block_size, limited_active_channels, base_samples_chunk_size,
+                 dtype=np.float64):
+        """
+        Args:
+            data_acquisition:           The DataAcquisition instance
+            block_size:                 The amount of base samples to acquire per measurement
+            limited_active_channels:    The velocity / data validity entries of the active channels list
+            base_samples_chunk_size:    The amount of base samples to read at once from a device
+            dtype:                      The output dtype (np.float64 or np.float32)
+        """
+        self.data_acquisition = data_acquisition
+        self.block_size = block_size
+        self.base_samples_chunk_size = base_samples_chunk_size
+        self.dtype = np.dtype(dtype)
+
+        self.velocity_channel = None
+        self.validity_channel = None
+        for channel in limited_active_channels:
+            if channel["Type"] == ChannelType.Velocity:
+                self.velocity_channel = channel
+            elif channel["Type"] == ChannelType.DataValidity:
+                self.validity_channel = channel
+        if self.velocity_channel is None:
+            raise ConfigurationError("The velocity channel is not active.")
+
+        self.scale_factor = self.velocity_channel["ScaleFactor"]
+        self.output = None      # 出力配列、最初のチャンクで周波数係数が分かった時点で確保する
+        # (samples written, time.perf_counter_ns() when read_data returned) per chunk of the last acquire()
+        self.chunk_times = []
+        self.__raw = None
+        self.__validity = None
+
+    def __extract(self, channel, buffer):
+        """Extract the samples of one channel into buffer (grown if the chunk needs more space)"""
+        sample_count = self.data_acquisition.extracted_sample_count(channel["Type"], channel["ID"])
+        if buffer is None or buffer.size < sample_count:
+            buffer = np.empty(max(sample_count, self.base_samples_chunk_size), dtype=np.int32)
+        return buffer, self.data_acquisition.get_int32_data_into(channel["Type"], channel["ID"], buffer, sample_count)
+
+    def acquire(self, timeout_ms=2000, out=None):
+        """
+        Start the ring buffer, acquire block_size base samples and stop it again
+
+        Args:
+            timeout_ms: The acquisition timeout of each chunk
+            out:        Optional array to write into instead of the engine's own output array
+        Returns:
+            The scaled velocity samples (a view of out / of the engine's output array, overwritten by the next call)
+        Raises:
+            RuntimeError: A data packet was lost (data validity == 0) or out is too small
+        """
+        self.chunk_times = []
+        self.data_acquisition.start_data_acquisition()#計測機器からリングバッファにデータ転送を開始する指示
+        try:
+            base_samples_written = 0
+            offset = 0
+            while base_samples_written < self.block_size:
+                base_sample_count = min(self.base_samples_chunk_size, self.block_size - base_samples_written)
+                # Blocks until the specified amount of samples is available to be extracted
+                self.data_acquisition.read_data(base_sample_count, timeout_ms)
+                t_read_ns = time.perf_counter_ns()
+                offset = self.store_chunk(base_sample_count, offset, out)
+                self.chunk_times.append((offset, t_read_ns))
+                base_samples_written += base_sample_count
+        finally:
+            self.data_acquisition.stop_data_acquisition()
+
+        target = self.output if out is None else out
+        return target[:offset]
+
+    def store_chunk(self, base_sample_count, offset, out=None):
+        """
+        Extract the chunk read last by read_data() and write it scaled at offset
+
+        Args:
+            base_sample_count:  The amount of base samples read by read_data()
+            offset:             The index in the output array the chunk starts at
+            out:                Optional array to write into instead of the engine's own output array
+        Returns:
+            The offset after the chunk
+        """
+        # 1. Validityチェック (ベクトル化: ループなしで一括判定)
+        if self.validity_channel is not None:
+            self.__validity, validity_samples = self.__extract(self.validity_channel, self.__validity)
+            if not np.all(validity_samples):
+                raise RuntimeError("Data packet lost")
+
+        # 2. 事前確保した配列の該当位置にスケーリングしながら直接書き込む
+        self.__raw, raw_samples = self.__extract(self.velocity_channel, self.__raw)
+        sample_count = raw_samples.size
+        if out is None:
+            if self.output is None:
+                frequency_factor = max(1, sample_count // base_sample_count)
+                self.output = np.empty(self.block_size * frequency_factor, dtype=self.dtype)
+            out = self.output
+        if offset + sample_count > out.size:
+            raise RuntimeError(f"Output array too small: {out.size} samples, {offset + sample_count} needed.")
+        np.multiply(raw_samples, self.scale_factor, out=out[offset:offset + sample_count])
+        return offset + sample_count
+
+
 # [acquire_data_to_csv]
 def __acquire_data(communication, data_acquisition, daq_config, sample_count, base_samples_chunk_size,
                           timeout_ms):
@@ -241,9 +352,6 @@ def __acquire_data_ver2(communication, data_acquisition, daq_config, sample_coun
         timeout_ms:                 The acquisition timeout
         base_file_name:             The base file name format string used for all CSV files created
     """
-    #print("__acquire_data is doing")
-    #data = ""
-    chunks = []
     # Gather DAQ configuration and other necessary information
     is_block_mode = daq_config.daq_mode == "Block"
     block_count = daq_config.block_count if is_block_mode else 1
@@ -258,60 +366,9 @@ def __acquire_data_ver2(communication, data_acquisition, daq_config, sample_coun
         raise RuntimeError("Endless block mode (blockCount=0) is not supported by this example. "
                            "Configure a block count > 0.")
 
-    data_acquisition.start_data_acquisition()#計測機器からリングバッファにデータ転送を開始する指示
-    
-    base_samples_written = 0
-    #start = time.time()
-    while base_samples_written < block_size:
-        base_sample_count = min(base_samples_chunk_size, block_size - base_samples_written)
-        # Blocks until the specified amount of samples is available to be extracted
-        data_acquisition.read_data(base_sample_count, timeout_ms)#リングバッファから計測データバッファにデータを切り出し転送する指示
-
-        validity_samples = None
-        velocity_channel = None
-
-        # Copy the data for each active channel to its respective buffer in the active channels list
-        for channel in limited_active_channels:
-            sample_count = data_acquisition.extracted_sample_count(channel["Type"], channel["ID"])
-            raw_data = np.array(data_acquisition.get_int32_data(channel["Type"], channel["ID"], sample_count))#計測データバッファからデータを受け取る部分
-            channel["Samples"] = raw_data
-            #print(f"channel is {channel}\n")
-
-        if channel["Type"] == ChannelType.DataValidity:
-            validity_samples = raw_data
-        elif channel["Type"] == ChannelType.Velocity:
-            velocity_channel = channel
-
-        # 1. Validityチェック (ベクトル化: ループなしで一括判定)
-        if validity_samples is not None:
-            # 0が含まれていればFalse、すべて非0ならTrue
-            if not np.all(validity_samples):
-                 raise RuntimeError("Data packet lost")
-
-        # 2. データのスケーリングと格納 (ベクトル化)
-        if velocity_channel is not None:
-            # 全要素に対して一括で掛け算を行う
-            scaled_chunk = velocity_channel["Samples"] * velocity_channel['ScaleFactor']
-            chunks.append(scaled_chunk)
-        
-        """
-        # Write the acquired data to the CSV file csvファイルではなく、直接データの受け渡しに変更
-        chunk_timestamp = ((base_samples_written * frequency_factor) - pre_post_trigger) * sample_interval
-        chunks.append(__write_chunk_data(limited_active_channels, base_sample_count, frequency_factor,
-                                          chunk_timestamp, sample_interval))
-        """
-            
-        base_samples_written += base_sample_count
-    #end = time.time()
-    #print(f"time is {end - start}")
-
+    engine = AcquisitionEngine(data_acquisition, block_size, limited_active_channels, base_samples_chunk_size)
+    data = engine.acquire(timeout_ms)#リングバッファから事前確保した配列へ直接書き込む
     logging.info("Acquisition complete")
-    data_acquisition.stop_data_acquisition()
-    #print("__acquire_data was done")
-    if len(chunks) > 0:
-        data = np.concatenate(chunks)#chunks内にリストが複数あるため、それを一つのリストに結合
-    else:
-        data = np.array([])#データがなければ空のリスト
     return data
     # [acquire_data]
 
@@ -335,64 +392,9 @@ def _acquire_data_ver3(data_acquisition, sample_count, block_size,limited_active
         timeout_ms:                 The acquisition timeout
         base_file_name:             The base file name format string used for all CSV files created
     """
-    #print("__acquire_data is doing")
-    #data = ""
-    chunks = []
-    
-    data_acquisition.start_data_acquisition()#計測機器からリングバッファにデータ転送を開始する指示,ここより上を一回だけ読み込んで、これ以下をupdateに持ってくる
-    
-    base_samples_written = 0
-    #start = time.time()
-    while base_samples_written < block_size:
-        base_sample_count = min(base_samples_chunk_size, block_size - base_samples_written)
-        # Blocks until the specified amount of samples is available to be extracted
-        data_acquisition.read_data(base_sample_count, timeout_ms)#リングバッファから計測データバッファにデータを切り出し転送する指示
-
-        validity_samples = None
-        velocity_channel = None
-
-        # Copy the data for each active channel to its respective buffer in the active channels list
-        for channel in limited_active_channels:
-            sample_count = data_acquisition.extracted_sample_count(channel["Type"], channel["ID"])
-            raw_data = np.array(data_acquisition.get_int32_data(channel["Type"], channel["ID"], sample_count))#計測データバッファからデータを受け取る部分
-            channel["Samples"] = raw_data
-            #print(f"channel is {channel}\n")
-
-        if channel["Type"] == ChannelType.DataValidity:
-            validity_samples = raw_data
-        elif channel["Type"] == ChannelType.Velocity:
-            velocity_channel = channel
-
-        # 1. Validityチェック (ベクトル化: ループなしで一括判定)
-        if validity_samples is not None:
-            # 0が含まれていればFalse、すべて非0ならTrue
-            if not np.all(validity_samples):
-                 raise RuntimeError("Data packet lost")
-
-        # 2. データのスケーリングと格納 (ベクトル化)
-        if velocity_channel is not None:
-            # 全要素に対して一括で掛け算を行う
-            scaled_chunk = velocity_channel["Samples"] * velocity_channel['ScaleFactor']
-            chunks.append(scaled_chunk)
-        
-        """
-        # Write the acquired data to the CSV file csvファイルではなく、直接データの受け渡しに変更
-        chunk_timestamp = ((base_samples_written * frequency_factor) - pre_post_trigger) * sample_interval
-        chunks.append(__write_chunk_data(limited_active_channels, base_sample_count, frequency_factor,
-                                          chunk_timestamp, sample_interval))
-        """
-            
-        base_samples_written += base_sample_count
-    #end = time.time()
-    #print(f"time is {end - start}")
-
+    engine = AcquisitionEngine(data_acquisition, block_size, limited_active_channels, base_samples_chunk_size)
+    data = engine.acquire(timeout_ms)
     logging.info("Acquisition complete")
-    data_acquisition.stop_data_acquisition()
-    #print("__acquire_data was done")
-    if len(chunks) > 0:
-        data = np.concatenate(chunks)#chunks内にリストが複数あるため、それを一つのリストに結合
-    else:
-        data = np.array([])#データがなければ空のリスト
     return data
     # [acquire_data]
 
@@ -0,0 +1,220 @@
+# Copyright (c) 2021 Polytec GmbH, Waldbronn
+# Released under the terms of the GNU Lesser General Public License version 3.
+import collections
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .acquireData import AcquisitionEngine
+
+
+class OverrunError(RuntimeError):
+    """Exception raised when a consumer requests samples that have already been overwritten in the ring"""
+    pass
+
+
+class SampleRing:
+    """
+    Single-producer ring buffer of scaled samples
+
+    The producer copies each chunk into the ring and only then advances write_count (the total amount of samples ever
+    written), so consumers never see half-written data and the producer never waits for a consumer. Consumers
+    address samples by their absolute index; a read that has been lapped by the producer raises OverrunError.
+
+    Before copying, the producer publishes write_end (write_count plus the chunk being written). Slots up to write_end
+    may already be overwritten, so a read checks against write_end (seqlock style) and a chunk that is still being
+    copied over the window is detected as an overrun instead of returning torn samples.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        """
+        Args:
+            capacity:   The amount of samples the ring holds
+            dtype:      The sample dtype
+        """
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=dtype)
+        self.write_count = 0
+        self.write_end = 0      # write_count + the chunk currently being copied
+        self.__new_data = threading.Condition()
+
+    def write(self, samples):
+        """
+        Append samples to the ring (producer side)
+
+        Args:
+            samples:    The samples to append (at most capacity samples)
+        """
+        count = samples.size
+        self.write_end = self.write_count + count   # 上書きを始める前に公開する
+        start = self.write_count % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:count - first] = samples[first:]
+        self.write_count += count   # 書き込み完了後に公開する
+        with self.__new_data:
+            self.__new_data.notify_all()
+
+    def read(self, start, count, out=None):
+        """
+        Copy the samples [start, start + count) out of the ring
+
+        Args:
+            start:  The absolute index of the first sample
+            count:  The amount of samples
+            out:    Optional array to copy into (at least count samples long)
+        Returns:
+            The samples
+        Raises:
+            OverrunError, ValueError
+        """
+        if start + count > self.write_count:
+            raise ValueError(f"Samples up to {start + count} requested, only {self.write_count} written.")
+        if out is None:
+            out = np.empty(count, dtype=self.buffer.dtype)
+        if start < self.write_end - self.capacity:
+            raise OverrunError(f"Samples from {start} have already been overwritten.")
+        index = start % self.capacity
+        first = min(count, self.capacity - index)
+        out[:first] = self.buffer[index:index + first]
+        out[first:count] = self.buffer[:count - first]
+        # コピー中に書き込み（書き込み途中のチャンクを含む）が一周して上書きされていないか確認する
+        if start < self.write_end - self.capacity:
+            raise OverrunError(f"Samples from {start} were overwritten while being read.")
+        return out[:count]
+
+    def latest(self, count, out=None):
+        """
+        Copy the newest count samples out of the ring
+
+        Returns:
+            (absolute index of the first sample, samples)
+        """
+        write_count = self.write_count
+        start = max(0, write_count - count, self.write_end - self.capacity)  # 書き込み途中のチャンクが上書きする分は除く
+        return start, self.read(start, write_count - start, out)
+
+    def wait_for(self, end, timeout=None):
+        """
+        Block until at least end samples have been written
+
+        Returns:
+            True if the samples are available, False on timeout
+        """
+        with self.__new_data:
+            return self.__new_data.wait_for(lambda: self.write_count >= end, timeout)
+
+
+class RingReader:
+    """Consumer cursor on a SampleRing returning consecutive, gap-free windows"""
+
+    def __init__(self, ring, start=None):
+        """
+        Args:
+            ring:   The SampleRing to read from
+            start:  The absolute index of the first sample to read (None: the next sample written)
+        """
+        self.ring = ring
+        self.cursor = ring.write_count if start is None else start
+
+    def next_window(self, count, timeout=None, out=None):
+        """
+        Wait for and return the next count samples following the previous window
+
+        Args:
+            count:      The window length in samples
+            timeout:    Timeout in seconds (None: wait forever)
+            out:        Optional array to copy into
+        Returns:
+            The window, or None on timeout
+        Raises:
+            OverrunError: The consumer fell more than the ring capacity behind the producer
+        """
+        if not self.ring.wait_for(self.cursor + count, timeout):
+            return None
+        window = self.ring.read(self.cursor, count, out)
+        self.cursor += count
+        return window
+
+    def skip_to_latest(self):
+        """Drop everything not read yet (e.g. after an OverrunError)"""
+        self.cursor = self.ring.write_count
+
+
+class ContinuousAcquisition:
+    """
+    Gap-free streaming: the device ring buffer keeps running and a reader thread drains it into a SampleRing
+
+    The acquisition is started once and never stopped between measurements. Any number of consumers (plot, recorder,
+    analysis) pull windows through their own RingReader without influencing the acquisition.
+    """
+
+    def __init__(self, data_acquisition, limited_active_channels, base_samples_chunk_size, ring_capacity,
+                 dtype=np.float64, timeout_ms=2000, clock_pairs=1024):
+        """
+        Args:
+            data_acquisition:           The DataAcquisition instance
+            limited_active_channels:    The velocity / data validity entries of the active channels list
+            base_samples_chunk_size:    The amount of base samples to read at once from a device
+            ring_capacity:              The capacity of the sample ring (in signal samples)
+            dtype:                      The sample dtype
+            timeout_ms:                 The timeout of each read_data() call
+            clock_pairs:                The amount of recent chunk_times entries kept
+        """
+        self.data_acquisition = data_acquisition
+        self.base_samples_chunk_size = base_samples_chunk_size
+        self.timeout_ms = timeout_ms
+        self.engine = AcquisitionEngine(data_acquisition, base_samples_chunk_size, limited_active_channels,
+                                        base_samples_chunk_size, dtype)
+        self.ring = SampleRing(ring_capacity, dtype)
+        # (ring.write_count after the chunk, time.perf_counter_ns() when read_data returned) of the recent chunks,
+        # maps absolute sample indices to host time
+        self.chunk_times = collections.deque(maxlen=clock_pairs)
+        self.error = None
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Start the device acquisition and the reader thread"""
+        self.error = None
+        self.__stop.clear()
+        self.data_acquisition.start_data_acquisition()
+        self.__thread = threading.Thread(target=self.__run, name="ldv-reader", daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            while not self.__stop.is_set():
+                # Blocks until the specified amount of samples is available to be extracted
+                self.data_acquisition.read_data(self.base_samples_chunk_size, self.timeout_ms)
+                t_read_ns = time.perf_counter_ns()
+                sample_count = self.engine.store_chunk(self.base_samples_chunk_size, 0)
+                self.ring.write(self.engine.output[:sample_count])
+                self.chunk_times.append((self.ring.write_count, t_read_ns))
+        except Exception as e:
+            logging.error(f"Continuous acquisition stopped: {e}")
+            self.error = e
+
+    def stop(self):
+        """Stop the reader thread and the device acquisition"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.data_acquisition.stop_data_acquisition()
+        if self.error is not None:
+            raise self.error
+
+    def is_running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def reader(self, start=None):
+        """
+        Create a consumer cursor
+
+        Args:
+            start:  The absolute sample index to start at (None: the next sample acquired)
+        """
+        return RingReader(self.ring, start)
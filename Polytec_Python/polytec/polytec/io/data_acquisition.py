@@ -135,6 +135,61 @@ class DataAcquisition:
         # convert ctype to python type
         return [c_data_buffer[i] for i in range(c_buffer_size.value)]
 
+    def __get_data_into(self, channel_type, channel_id, out, sample_count, poly_dll_get_data_function, return_type):
+        """
+        Gets the samples from the given channel directly into the memory of a caller-supplied NumPy array.
+
+        The DLL writes into the array's buffer through a ctypes pointer, so no intermediate ctypes array or Python
+        list is created. The array can be reused for every call.
+
+        Args:
+            channel_type:               The channel type.
+            channel_id:                 The channel identifier.
+            out:                        A C-contiguous, writeable NumPy array whose item size matches return_type
+            sample_count:               The amount of samples to get (None: out.size)
+            poly_dll_get_data_function: The DLL get data function to be used
+            return_type:                The type of the data to be fetched copied from the internal buffers
+
+        Returns:
+            A view of out holding the sample_count samples copied.
+
+        Raises:
+             DataAcquisitionNotOpenError, LibraryFunctionCallError, ValueError
+        """
+        assert DeviceCommunication.device_communication_dll is not None
+
+        if self.__acquisition_handle is None:
+            raise DataAcquisitionNotOpenError("No data acquisition opened.")
+
+        if sample_count is None:
+            sample_count = out.size
+        if not out.flags.c_contiguous or not out.flags.writeable:
+            raise ValueError("The output buffer must be a C-contiguous, writeable array.")
+        if out.itemsize != sizeof(return_type):
+            raise ValueError(f"The output buffer item size ({out.itemsize}) does not match "
+                             f"{return_type.__name__} ({sizeof(return_type)}).")
+        if sample_count > out.size:
+            raise ValueError(f"The output buffer holds {out.size} samples, {sample_count} requested.")
+
+        # int PolyGetInt32Data(int acquisitionHandle, int channelType, int channelId, int32_t* dataBuffer,
+        #                      size_t bufferSize)
+        poly_dll_get_data_function.restype = c_int
+        poly_dll_get_data_function.argtypes = [c_int, c_int, c_int, POINTER(return_type), c_long]
+
+        # ctypes function parameter initialization
+        c_channel_type = c_int(channel_type)
+        c_channel_id = c_int(channel_id)
+        c_data_pointer = out.ctypes.data_as(POINTER(return_type))
+        c_buffer_size = c_long(sample_count)
+
+        logging.debug(f"Library call: PolyGet[{return_type.__name__}]Data({self.__acquisition_handle}, "
+                      f"{c_channel_type}, {c_channel_id}, {c_data_pointer}, {c_buffer_size})")
+        status_code = poly_dll_get_data_function(self.__acquisition_handle, c_channel_type, c_channel_id,
+                                                 c_data_pointer, c_buffer_size)
+        check_success(f"PolyGet[{return_type.__name__}]Data", status_code)
+
+        return out[:sample_count]
+
     def start_data_acquisition(self):
         """
         Starts acquiring data to the internal ring buffer.
@@ -404,6 +459,44 @@ class DataAcquisition:
         return self.__get_data(channel_type, channel_id, sample_count,
                                DeviceCommunication.device_communication_dll.PolyGetInt32Data, c_int32)
 
+    def get_int32_data_into(self, channel_type, channel_id, out, sample_count=None):
+        """
+        Gets the samples from the given channel as Int32 data into a caller-supplied NumPy array (dtype int32).
+
+        Args:
+            channel_type:   The channel type.
+            channel_id:     The channel identifier.
+            out:            The reusable output array, at least sample_count samples long
+            sample_count:   The amount of samples to get (None: out.size)
+
+        Returns:
+            A view of out holding the samples.
+
+        Raises:
+             DataAcquisitionNotOpenError, LibraryFunctionCallError, ValueError
+        """
+        return self.__get_data_into(channel_type, channel_id, out, sample_count,
+                                    DeviceCommunication.device_communication_dll.PolyGetInt32Data, c_int32)
+
+    def get_int32_data_np(self, channel_type, channel_id, sample_count):
+        """
+        Gets the samples from the given channel as Int32 data in a newly allocated NumPy array.
+
+        Args:
+            channel_type:   The channel type.
+            channel_id:     The channel identifier.
+            sample_count:   The amount of samples to get
+
+        Returns:
+            The data as a NumPy int32 array.
+
+        Raises:
+             DataAcquisitionNotOpenError, LibraryFunctionCallError
+        """
+        import numpy as np
+
+        return self.get_int32_data_into(channel_type, channel_id, np.empty(sample_count, dtype=np.int32))
+
     def get_overrange(self, channel_type, channel_id, sample_count):
         """
         Gets the samples from the given channel as UInt16 data.
@@ -422,6 +515,25 @@ class DataAcquisition:
         return self.__get_data(channel_type, channel_id, sample_count,
                                DeviceCommunication.device_communication_dll.PolyGetOverrange, c_uint8)
 
+    def get_overrange_into(self, channel_type, channel_id, out, sample_count=None):
+        """
+        Gets the overrange flags of the given channel into a caller-supplied NumPy array (dtype uint8).
+
+        Args:
+            channel_type:   The channel type.
+            channel_id:     The channel identifier.
+            out:            The reusable output array, at least sample_count samples long
+            sample_count:   The amount of samples to get (None: out.size)
+
+        Returns:
+            A view of out holding the samples.
+
+        Raises:
+             DataAcquisitionNotOpenError, LibraryFunctionCallError, ValueError
+        """
+        return self.__get_data_into(channel_type, channel_id, out, sample_count,
+                                    DeviceCommunication.device_communication_dll.PolyGetOverrange, c_uint8)
+
     def channel_min_value(self, channel_type):
         """
         Evaluates the regular minimum value for the channel type.
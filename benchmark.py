@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import argparse
+import importlib.util
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import imageProcessing
+import frameStore
+import videoRecorder
+import trackingPipeline
+import mirrorChannel
+import controlCamera
+import controlMirror
+import simulation
+import instrumentation
+import sessionClock
+
+#追従（撮影→縮小→テンプレートマッチング→制御則→ミラーへの指令→ミラーへの反映）とLDVの計測の性能を測定し、JSONに保存する
+#実機がなくても測れるように、SYSTEM_SIMULATEが未設定ならすべての機器をシミュレーション(simulation.py)にする
+#--baselineで以前の結果を指定すると、各段の時間やフレームレートがtolerance以上悪化した場合に終了コード1で終わる
+#
+#  python benchmark.py                                  : 追従10秒とLDV5秒を測定
+#  （LDVはシミュレーションでもpolytecのパッケージ(acquireData、ChannelType)を使うため、先に Polytec_Python/polytec で pip install . しておく）
+#  python benchmark.py tracking --duration 30 --matcher pyramid
+#  python benchmark.py replay                           : 録画の再解析(replayFrameStore)が撮影時と同じ距離になるかを確認
+#  python benchmark.py --baseline benchmark_results/before.json
+#
+#追従の各段（時間の単位はms）
+#  grab     : 1フレームの取得（露光の待ち時間を含む）
+#  scale    : changeScale
+#  template : テンプレートマッチング（calculateCentor2FingerDistance）
+#  control  : 制御則（TrackingController.update）
+#  enqueue  : MirrorCommandChannel.put
+#  latency  : 取得してから指令をputし終わるまで
+#  mirror_apply : putしてからミラーのプロセスが反映し終わるまで（MirrorCommandChannelが記録）
+#replay
+#  撮影時と同じ処理(processFrame)で求めた距離と、縮小して録画したもの・撮影したままのものをreplayFrameStoreで再解析した距離の差[pixel]
+#LDV
+#  read     : read_data（サンプルが揃うまでの待ち時間を含む）
+#  extract  : AcquisitionEngine.store_chunk（取り出し、検査、スケーリング）
+
+RESULT_DIR = 'benchmark_results'
+HISTOGRAM_EDGES_MS = np.logspace(-3, 3, 61)   #1 us ~ 1 s
+
+
+def stageStatistics(samples_s):
+    #{count, mean, p50, p95, p99, max, histogram}、時間の単位はms
+    samples = np.asarray(samples_s, dtype=np.float64) * 1000
+    if samples.size == 0:
+        return {"count": 0}
+    counts, _ = np.histogram(samples, HISTOGRAM_EDGES_MS)
+    return {"count": int(samples.size),
+            "mean": float(samples.mean()),
+            "p50": float(np.percentile(samples, 50)),
+            "p95": float(np.percentile(samples, 95)),
+            "p99": float(np.percentile(samples, 99)),
+            "max": float(samples.max()),
+            "histogram": {"edges_ms": HISTOGRAM_EDGES_MS.tolist(), "counts": counts.tolist()}}
+
+
+def benchmarkTracking(duration_s=10.0, exposuretime_ms=1.5, matcher="pyramid_tracker", motion="circle", radius=100,
+                      timeout_ms=1000):
+    intervalX = 0.01/126
+    intervalY = 0.01/126
+    laser_point = simulation.laserPoint()
+
+    #ミラーは実際と同じく別プロセスのmirror_serverでMirrorCommandChannelから受け取る
+    channel = mirrorChannel.MirrorCommandChannel()
+    prepareMirror = multiprocessing.Event()
+    mirror_process = multiprocessing.Process(target=controlMirror.mirror_server, args=(channel, prepareMirror), daemon=True)
+    mirror_process.start()
+    if not prepareMirror.wait(30):
+        raise RuntimeError("mirror process did not start")
+
+    controller = controlCamera.createController(0, 0, intervalX, intervalY, laser_point)
+    #画像上の指先はミラーのプロセスが反映した角度で動かす（ミラー側の遅延もtracking_error_pxに現れる）
+    camera = controlCamera.openCamera(exposuretime_ms, 18.0, angle_source=channel.appliedAngle,
+                                      pixels_per_angle=(1/(intervalX*0.5), 1/(intervalY*0.5)))
+    if isinstance(camera, simulation.SimulatedCamera):
+        camera.source = simulation.SyntheticFrameSource(radius=radius, motion=motion)
+    image_template = imageProcessing.getTemplate(radius)
+    tracker = imageProcessing.createMatcher(matcher, image_template)
+    timer = trackingPipeline.StageTimer(max_samples=10**6)
+    #追従はgetCameraImage_endlessと同じパイプライン(controlCamera.createTrackingPipeline)で行い、録画も同じ設定でrawとして一時ディレクトリに書く
+    record_dir = tempfile.TemporaryDirectory()
+    recorder = controlCamera.createRecorder("benchmark", exposuretime_ms, directory=record_dir.name, mode="raw")
+    pipeline = controlCamera.createTrackingPipeline(camera, channel, controller, laser_point, image_template, tracker,
+                                                    timeout_ms, recorder, timer=timer)
+    session = sessionClock.sessionIndex("camera")
+    first_frame = session.count("frames")
+    camera.StartGrabbing(controlCamera.grabLatestImageOnly)
+    t1 = time.perf_counter()
+    pipeline.start()
+    try:
+        while time.perf_counter() - t1 < duration_s and pipeline.is_running():
+            time.sleep(0.05)
+    finally:
+        t2 = time.perf_counter()
+        try:
+            pipeline.stop()
+        finally:
+            camera.StopGrabbing()
+            camera.Close()
+            recorder.close()
+            record_dir.cleanup()
+            channel.put((0, 0))
+            time.sleep(0.05)
+            channel.close()
+            mirror_process.join(5)
+            if mirror_process.is_alive():
+                mirror_process.terminate()
+    elapsed = t2 - t1
+
+    stages = {stage: stageStatistics(timer.samples(stage))
+              for stage in ("grab", "scale", "template", "control", "match", "enqueue", "actuate", "latency")}
+    mirror = channel.summary()
+    if session.count("frames") > first_frame:
+        frames = session.arrays("frames")
+        errors = np.hypot(frames["distance_x"], frames["distance_y"])[first_frame:]
+    else:
+        errors = []
+    result = {"duration_s": elapsed,
+              "grabbed": pipeline.grabbed, "matched": pipeline.matched, "actuated": pipeline.actuated,
+              "grab_fps": pipeline.grabbed/elapsed, "match_fps": pipeline.matched/elapsed,
+              "dropped_frames": pipeline.frames.overwritten, "coalesced_commands": pipeline.commands.overwritten,
+              "local_searches": getattr(tracker, "local_searches", None),
+              "full_searches": getattr(tracker, "full_searches", None),
+              "tracking_error_px": {"p50": float(np.percentile(errors, 50)), "p95": float(np.percentile(errors, 95))} if len(errors) else {},
+              "recorder": {"written": recorder.written, "dropped": recorder.dropped, "decimated": recorder.decimated},
+              "stages": stages,
+              "mirror": mirror}
+    if stages["latency"].get("count") and mirror.get("applied"):
+        result["end_to_end_mean_ms"] = stages["latency"]["mean"] + mirror["latency_mean"]
+    return result
+
+
+def checkReplay(frame_count=200, matcher="pyramid_tracker", motion="circle", radius=100, fps=500.0, tolerance_px=0.5):
+    laser_point = simulation.laserPoint()
+    image_template = imageProcessing.getTemplate(radius)
+    source = simulation.SyntheticFrameSource(radius=radius, motion=motion)
+    tracker = imageProcessing.createMatcher(matcher, image_template)
+    live = np.full((frame_count, 2), np.nan)
+    result = {"frame_count": frame_count, "tolerance_px": tolerance_px}
+    with tempfile.TemporaryDirectory() as directory:
+        #撮影時と同じく縮小した画像を録画したもの(createRecorderと同じ)と、撮影したままの画像を保存したもの
+        scaled_name = os.path.join(directory, "scaled")
+        raw_name = os.path.join(directory, "raw")
+        recorder = videoRecorder.VideoRecorder(scaled_name, fps, mode="raw", policy="block", scale=controlCamera.frameScale)
+        raw_store = frameStore.FrameStoreWriter(raw_name, fps)
+        try:
+            for n in range(frame_count):
+                frame = source.render(n/fps)
+                raw_store.write(frame, n/fps)
+                image, _, live[n] = controlCamera.processFrame(frame, image_template, laser_point, matcher=tracker)
+                recorder.write(image, n/fps)
+        finally:
+            raw_store.close()
+            recorder.close()
+        for name, path in (("scaled", scaled_name), ("raw", raw_name)):
+            _, replayed = controlCamera.replayFrameStore(path, laser_point, image_template, matcher=matcher, isPlotMatchpoint=False)
+            result[name] = {"max_difference_px": float(np.nanmax(np.abs(replayed - live))) if len(replayed) == frame_count else float("inf")}
+    result["passed"] = all(result[name]["max_difference_px"] <= tolerance_px for name in ("scaled", "raw"))
+    return result
+
+
+def benchmarkLDV(duration_s=5.0, sample_count=2**17, velocity_range="200 mm/s", ip_address="192.168.137.1"):
+    from Polytec_Python.acquisition_examples.acquisition_control import acquireData
+    if simulation.isSimulated("ldv"):
+        connection = simulation.connectDevice(sample_count, simulation.parseVelocityRange(velocity_range))
+    else:
+        from Polytec_Python.acquisition_examples import acquire_streaming
+        connection = acquire_streaming.connect_device(ip_address, sample_count)
+    device_communication, data_acquisition, block_size, limited_active_channels, base_samples_chunk_size = connection
+    engine = acquireData.AcquisitionEngine(data_acquisition, block_size, limited_active_channels, base_samples_chunk_size)
+    read_times = []
+    extract_times = []
+    samples = 0
+    offset = 0
+    chunk_samples = 0
+    data_acquisition.start_data_acquisition()
+    t1 = time.perf_counter()
+    try:
+        while time.perf_counter() - t1 < duration_s:
+            start = time.perf_counter()
+            data_acquisition.read_data(base_samples_chunk_size, 2000)
+            middle = time.perf_counter()
+            if engine.output is not None and offset + chunk_samples > engine.output.size:
+                offset = 0#1回の計測分(block_size)の出力配列を繰り返し使う
+            end_offset = engine.store_chunk(base_samples_chunk_size, offset)
+            end = time.perf_counter()
+            chunk_samples = end_offset - offset
+            samples += chunk_samples
+            offset = end_offset
+            read_times.append(middle - start)
+            extract_times.append(end - middle)
+    finally:
+        t2 = time.perf_counter()
+        data_acquisition.stop_data_acquisition()
+    elapsed = t2 - t1
+    extract_total = float(np.sum(extract_times))
+    return {"duration_s": elapsed,
+            "samples": samples,
+            "samples_per_s": samples/elapsed,
+            "nominal_sample_rate": data_acquisition.base_sample_rate_in_hz(),
+            "chunk_size": base_samples_chunk_size,
+            "extract_ns_per_sample": extract_total/max(samples, 1)*1e9,
+            "extract_fraction": extract_total/elapsed,#計測時間のうちデータの取り出しに使った割合
+            "stages": {"read": stageStatistics(read_times), "extract": stageStatistics(extract_times)}}
+
+
+#悪化を判定する値: (結果の中の場所, 大きいほど良いならTrue)
+REGRESSION_KEYS = [(("tracking", "grab_fps"), True),
+                   (("tracking", "match_fps"), True),
+                   (("tracking", "stages", "scale", "p50"), False),
+                   (("tracking", "stages", "template", "p50"), False),
+                   (("tracking", "stages", "template", "p95"), False),
+                   (("tracking", "stages", "control", "p50"), False),
+                   (("tracking", "stages", "enqueue", "p50"), False),
+                   (("tracking", "stages", "latency", "p50"), False),
+                   (("tracking", "stages", "latency", "p95"), False),
+                   (("tracking", "mirror", "latency_mean"), False),
+                   (("ldv", "samples_per_s"), True),
+                   (("ldv", "extract_ns_per_sample"), False)]
+
+def _lookup(result, keys):
+    for key in keys:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compareResults(result, baseline, tolerance=0.2):
+    #baselineよりtolerance(割合)以上悪化した値の一覧 [(名前, baseline, 今回)]
+    regressions = []
+    for keys, higher_is_better in REGRESSION_KEYS:
+        current, previous = _lookup(result, keys), _lookup(baseline, keys)
+        if current is None or previous is None or previous == 0:
+            continue
+        if (higher_is_better and current < previous*(1 - tolerance)) or \
+           (not higher_is_better and current > previous*(1 + tolerance)):
+            regressions.append((".".join(keys), previous, current))
+    return regressions
+
+
+def printResults(result):
+    tracking = result.get("tracking")
+    if tracking:
+        print(f"tracking: {tracking['grab_fps']:.1f} fps grabbed, {tracking['match_fps']:.1f} fps matched "
+              f"({tracking['dropped_frames']} dropped frames, {tracking['coalesced_commands']} coalesced commands)")
+        for stage, stats in tracking["stages"].items():
+            if stats.get("count"):
+                print(f"  {stage:<10} n={stats['count']:<7} mean {stats['mean']:7.3f} ms  p50 {stats['p50']:7.3f} ms  "
+                      f"p95 {stats['p95']:7.3f} ms  p99 {stats['p99']:7.3f} ms  max {stats['max']:7.3f} ms")
+        mirror = tracking["mirror"]
+        if mirror.get("applied"):
+            print(f"  mirror_apply n={mirror['applied']:<7} mean {mirror['latency_mean']:7.3f} ms  "
+                  f"p95 <{mirror['latency_p95']:.1f} ms  ({mirror['coalesced']} coalesced)")
+    replay = result.get("replay")
+    if replay:
+        print(f"replay: {'ok' if replay['passed'] else 'MISMATCH'} ({replay['frame_count']} frames, "
+              f"max difference scaled {replay['scaled']['max_difference_px']:.3f} px, raw {replay['raw']['max_difference_px']:.3f} px)")
+    ldv = result.get("ldv")
+    if ldv:
+        print(f"ldv: {ldv['samples_per_s']:.0f} samples/s (nominal {ldv['nominal_sample_rate']:.0f}), "
+              f"extract {ldv['extract_ns_per_sample']:.1f} ns/sample ({100*ldv['extract_fraction']:.2f} % of the time)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="tracking / LDV benchmark")
+    parser.add_argument("sections", nargs="*", help="tracking, replay and/or ldv (default: tracking and ldv)")
+    parser.add_argument("--duration", type=float, default=None, help="seconds per section (tracking 10, ldv 5)")
+    parser.add_argument("--exposure-ms", type=float, default=1.5)
+    parser.add_argument("--matcher", default="pyramid_tracker", help="imageProcessing.createMatcher method")
+    parser.add_argument("--motion", default="circle", choices=["circle", "linear"])
+    parser.add_argument("--sample-count", type=int, default=2**17)
+    parser.add_argument("--output", default=None, help="result json (default: benchmark_results/benchmark_<time>.json)")
+    parser.add_argument("--baseline", default=None, help="previous result json to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    sections = args.sections or ["tracking", "ldv"]
+    for section in sections:
+        if section not in ("tracking", "replay", "ldv"):
+            parser.error(f"unknown section: {section}")
+    if "ldv" in sections and importlib.util.find_spec("polytec") is None:
+        parser.error("the ldv section needs the polytec package (pip install . in Polytec_Python/polytec)")
+
+    if not simulation.simulatedDevices():
+        simulation.enableSimulation()
+    instrumentation.configure("benchmark")#SYSTEM_TRACEを設定した場合は各段の区間をトレースにも記録する
+
+    result = {"meta": {"time": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "platform": platform.platform(),
+                       "python": platform.python_version(),
+                       "simulated": sorted(simulation.simulatedDevices()),
+                       "args": vars(args)}}
+    if "tracking" in sections:
+        result["tracking"] = benchmarkTracking(args.duration or 10.0, args.exposure_ms, args.matcher, args.motion)
+    if "replay" in sections:
+        result["replay"] = checkReplay(matcher=args.matcher, motion=args.motion)
+    if "ldv" in sections:
+        result["ldv"] = benchmarkLDV(args.duration or 5.0, args.sample_count)
+    printResults(result)
+    instrumentation.collect()
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULT_DIR, exist_ok=True)
+        output = os.path.join(RESULT_DIR, datetime.datetime.now().strftime("benchmark_%Y%m%d_%H%M%S.json"))
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1)
+    print(f"saved {output}")
+
+    if "replay" in result and not result["replay"]["passed"]:
+        return 1
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compareResults(result, baseline, args.tolerance)
+        for name, previous, current in regressions:
+            print(f"regression: {name} {previous:.4g} -> {current:.4g}")
+        if regressions:
+            return 1
+        print(f"no regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+import numpy as np
+
+#LDVの計測データを保存するバイナリ形式(.ldv)
+#savetxt/loadtxtのテキスト形式より読み書きが速く、サイズも約1/3になる
+#
+#ファイル構成:
+#  MAGIC(8byte) + ヘッダ長(uint32, little endian) + JSONヘッダ(空白で64byte境界まで埋める) + 生データ(little endian)
+#JSONヘッダにはdtype, sample_count, dt, bandwidth, range, scale_factor, 計測時刻, chunk番号などを保存する
+#読み込みはnp.memmapで行うため、ファイル全体を読み込まずに必要な部分だけアクセスできる
+
+MAGIC = b"LDVCAP01"
+EXTENSION = ".ldv"
+ALIGNMENT = 64
+
+
+def capture_path(file_name):
+    #拡張子なしのファイル名(signalProcessingの各関数と同じ指定方法)から.ldvのパスを作る
+    return file_name if file_name.endswith(EXTENSION) else file_name + EXTENSION
+
+
+def write_capture(file_name, data, dt, dtype=np.float64, **metadata):
+    """
+    file_name: 拡張子なしのファイル名（.ldvが付く）
+    data     : 1次元の計測データ
+    dt       : サンプリング間隔[s]
+    dtype    : 保存するdtype(np.float64 or np.float32)
+    metadata : bandwidth, range, scale_factor, unit, t_start, t_end, chunk_indexなど、JSONにできる任意の値
+    """
+    payload = np.ascontiguousarray(data, dtype=np.dtype(dtype).newbyteorder("<"))
+    header = {"version": 1,
+              "dtype": payload.dtype.str,
+              "sample_count": int(payload.size),
+              "dt": dt}
+    header.update(metadata)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix_len = len(MAGIC) + 4
+    padding = -(prefix_len + len(header_bytes)) % ALIGNMENT
+    header_bytes += b" " * padding
+
+    path = capture_path(file_name)
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        payload.tofile(f)
+    return path
+
+
+def read_header(file_name):
+    #ヘッダとデータの開始位置(byte)を返す
+    path = capture_path(file_name)
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an LDV capture file")
+        header_len = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+    return header, len(MAGIC) + 4 + header_len
+
+
+def read_capture(file_name):
+    #(読み込み専用のnp.memmap, ヘッダ)を返す、データはアクセスした部分だけディスクから読まれる
+    header, offset = read_header(file_name)
+    if header["sample_count"] == 0:
+        return np.empty(0, dtype=header["dtype"]), header
+    data = np.memmap(capture_path(file_name), dtype=np.dtype(header["dtype"]), mode="r",
+                     offset=offset, shape=(header["sample_count"],))
+    return data, header
+
+
+def export_text(file_name, text_file_name=None):
+    #.ldvを従来のテキスト形式(savetxt, fmt='%s')に変換する
+    data, _ = read_capture(file_name)
+    if text_file_name is None:
+        text_file_name = capture_path(file_name)[:-len(EXTENSION)] + ".txt"
+    np.savetxt(text_file_name, data, fmt='%s')
+    return text_file_name
+
+
+if __name__ == "__main__":
+    #使い方: python captureFile.py file1.ldv file2.ldv ...  → 同じ名前の.txtに変換する
+    if len(sys.argv) < 2:
+        print(f"usage: {os.path.basename(sys.argv[0])} capture.ldv [capture.ldv ...]")
+        sys.exit(1)
+    for name in sys.argv[1:]:
+        print(f"{name} -> {export_text(name)}")
@@ -0,0 +1,138 @@
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+#LDVの計測データ(1回の計測=1スロット)をプロセス間で共有するためのshared_memory上のリング
+#Queueでpickleして送る代わりに、計測プロセスが書き込んだスロットをメインプロセスがコピーなしで読む
+#
+#メモリ配置:
+#  header   int64[HEADER_LEN]          : magic, slot_count, slot_size, write_count, writing
+#  writingはbegin_writeからcommitまで1、書き込み中のスロット（リングが一周した後は最も古い計測のスロット）は読み込み側に見せない
+#  meta     float64[slot_count, 4]     : sequence, sample数, 計測開始時刻, 計測終了時刻
+#  data     float64[slot_count, slot_size]
+
+MAGIC = 0x4C44564341505455 #"LDVCAPTU"
+HEADER_LEN = 8
+META_LEN = 4
+_WRITE_COUNT = 3
+_WRITING = 4
+
+
+def _attach(name):
+    #子プロセスでattachした共有メモリが、子プロセス終了時にresource_trackerによって削除されないようにする
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)#Python 3.13以降
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedCaptureStore:
+    def __init__(self, slot_count, slot_size, name=None):
+        """
+        slot_count: スロット数（保持できる計測回数、超えると古いものから上書きされる）
+        slot_size : 1スロットのサンプル数（1回の計測のサンプル数N）
+        name      : Noneなら新しく共有メモリを作成する、名前を指定した場合は既存の共有メモリにattachする
+        """
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.is_owner = name is None
+        nbytes = 8*HEADER_LEN + 8*META_LEN*slot_count + 8*slot_count*slot_size
+        if self.is_owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = _attach(name)
+        self.__map()
+        if self.is_owner:
+            self.header[:] = 0
+            self.header[0] = MAGIC
+            self.header[1] = slot_count
+            self.header[2] = slot_size
+            self.meta[:] = 0
+        elif self.header[0] != MAGIC:
+            raise ValueError(f"{name} is not a capture store")
+
+    def __map(self):
+        buf = self.shm.buf
+        meta_offset = 8*HEADER_LEN
+        data_offset = meta_offset + 8*META_LEN*self.slot_count
+        self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf)
+        self.meta = np.ndarray((self.slot_count, META_LEN), dtype=np.float64, buffer=buf, offset=meta_offset)
+        self.data = np.ndarray((self.slot_count, self.slot_size), dtype=np.float64, buffer=buf, offset=data_offset)
+
+    #multiprocessing.Processの引数として渡す時は名前だけを送り、子プロセス側でattachし直す
+    def __getstate__(self):
+        return {"name": self.shm.name, "slot_count": self.slot_count, "slot_size": self.slot_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["slot_count"], state["slot_size"], name=state["name"])
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def count(self):
+        #これまでに書き込みが完了した計測回数
+        return int(self.header[_WRITE_COUNT])
+
+    def begin_write(self):
+        #次に書き込むスロットを返す（書き込み側）、書き込み後にcommitを呼ぶまで読み込み側には見えない
+        #書き込みを始める前にwritingを立て、そのスロットにあった最も古い計測をavailableから外す
+        self.header[_WRITING] = 1
+        return self.data[self.count() % self.slot_count]
+
+    def commit(self, sample_count=None, t_start=0.0, t_end=None):
+        #begin_writeで得たスロットへの書き込みを確定する
+        sequence = self.count()
+        meta = self.meta[sequence % self.slot_count]
+        meta[0] = sequence
+        meta[1] = self.slot_size if sample_count is None else sample_count
+        meta[2] = t_start
+        meta[3] = time.time() if t_end is None else t_end
+        self.header[_WRITE_COUNT] = sequence + 1   #メタデータまで書き終えてから公開する
+        self.header[_WRITING] = 0
+
+    def write(self, samples, t_start=0.0, t_end=None):
+        slot = self.begin_write()
+        slot[:samples.size] = samples
+        self.commit(samples.size, t_start, t_end)
+
+    def available(self):
+        #まだ上書きされていない計測のsequence番号の範囲（書き込み中のスロットの計測は含まない）
+        #writingを先に読む（commitの途中でもwrite_countが進む前のスロットを含めない）
+        writing = int(self.header[_WRITING])
+        count = self.count()
+        return range(max(0, count - self.slot_count + writing), count)
+
+    def read(self, sequence):
+        #sequence番目の計測を(コピーせずに)返す
+        if sequence not in self.available():
+            raise IndexError(f"capture {sequence} is not available ({self.available()})")
+        index = sequence % self.slot_count
+        return self.data[index, :int(self.meta[index, 1])]
+
+    def read_meta(self, sequence):
+        index = sequence % self.slot_count
+        return {"sequence": int(self.meta[index, 0]), "sample_count": int(self.meta[index, 1]),
+                "t_start": float(self.meta[index, 2]), "t_end": float(self.meta[index, 3])}
+
+    def captures(self):
+        #保持している全計測を(計測数, slot_size)で返す、上書きが起きていなければコピーなしのview
+        available = self.available()
+        start = available.start % self.slot_count
+        if start == 0:
+            return self.data[:len(available)]
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+    def close(self):
+        #このプロセスのviewを破棄してから共有メモリを閉じる（呼び出し側のviewも先に破棄しておくこと）
+        self.header = self.meta = self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.is_owner:
+            self.shm.unlink()
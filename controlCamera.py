@@ -1,4 +1,7 @@
-from pypylon import pylon
+try:
+    from pypylon import pylon
+except ImportError:#pypylonがない環境ではシミュレーションのカメラ(SYSTEM_SIMULATE=camera)のみ使える
+    pylon = None
 
 import datetime
 import time
@@ -8,43 +11,165 @@ import math
 count =0
 
 import os
+import collections
+import contextlib
+import queue
+import concurrent.futures
 import multiprocessing
 #import threading
 
 import cv2
+import numpy as np
 
 import imageProcessing
+import videoRecorder
+import frameStore
+import trackingPipeline
+import trackingFilter
+import mirrorCalibration
 import controlMirror
 import controlGUI
 import sharedFlag
+import simulation
+import instrumentation
+import sessionClock
+
+videoDir = 'C:/Users/yuto/Documents/system_python/data/' #録画の保存先
+videoMode = "mp4"        #録画の形式、"mp4" または "raw"（videoRecorderを参照）
+videoPolicy = "decimate" #録画の書き込みが追いつかない時の方針、"drop"、"decimate"、"block"
+frameScale = 0.5         #追従で撮影画像に掛けるchangeScaleの倍率（テンプレートとlaser_pointはこの倍率の座標）
+trackingFilterMethod = "kalman" #指先の位置の推定・予測、"none"（従来の比例制御）、"alphabeta"、"kalman"
+useMirrorCalibration = False #Trueなら画素→ミラー角度の較正表(mirrorCalibrationFile)で追従する、Falseなら従来通り比例制御
+                             #較正表はカメラがミラー越しに撮影しない配置でのみ使える（mirrorCalibrationを参照）
+mirrorCalibrationFile = mirrorCalibration.DEFAULT_FILE #画素→ミラー角度の較正表
+
+def createController(X, Y, intervalX, intervalY, laser_point):
+    #useMirrorCalibrationなら較正表から目標角度を求めて1回で移動する(gain=1)、そうでなければ従来通り比例制御(gain=0.5)
+    tracking_filter = trackingFilter.createFilter(trackingFilterMethod)
+    if useMirrorCalibration:#較正表がない場合はloadが例外を送出する（黙って比例制御に戻さない）
+        pixel_map = mirrorCalibration.PixelMirrorMap.load(mirrorCalibrationFile)
+        print(f"mirror calibration: {mirrorCalibrationFile} ({pixel_map.method}, rms error {pixel_map.rms_error:.3e})")
+        return trackingFilter.TrackingController(X, Y, intervalX, intervalY, tracking_filter, gain=1.0,
+                                                 pixel_map=pixel_map, laser_point=laser_point)
+    return trackingFilter.TrackingController(X, Y, intervalX, intervalY, tracking_filter)
+
+#StartGrabbing、RetrieveResultに渡すpylonの定数（シミュレーションのカメラは使わないためNone）
+grabLatestImageOnly = pylon.GrabStrategy_LatestImageOnly if pylon is not None else None
+timeoutHandlingReturn = pylon.TimeoutHandling_Return if pylon is not None else None
+timeoutHandlingThrow = pylon.TimeoutHandling_ThrowException if pylon is not None else None
+
+def timestampTickNs(camera):
+    #カメラのタイムスタンプ1あたりの時間[ns]（GigEのカメラはGevTimestampTickFrequencyから、USBのカメラとシミュレーションは1 ns）
+    try:
+        return 1e9/camera.GevTimestampTickFrequency.GetValue()
+    except Exception:
+        return 1.0
+
+def openCamera(exposuretime_ms, gain, angle_source=None, pixels_per_angle=(0.0, 0.0)):
+    #カメラを開き、露光時間[ms]とゲインを設定する
+    #SYSTEM_SIMULATEにcameraを含む場合はsimulation.SimulatedCamera（angle_source, pixels_per_angleはシミュレーションのみで使う）
+    if simulation.isSimulated("camera"):
+        camera = simulation.SimulatedCamera(angle_source=angle_source, pixels_per_angle=pixels_per_angle)
+    else:
+        # トランスポートレイヤーインスタンスを取得
+        tl_factory = pylon.TlFactory.GetInstance()
+        # InstantCameraオブジェクトの作成
+        camera = pylon.InstantCamera()
+        # 最初に見つかったデバイスをアタッチ
+        camera.Attach(tl_factory.CreateFirstDevice())
+    # カメラを開く
+    camera.Open()
+    # 露光時間を設定（単位はマイクロ秒）
+    camera.ExposureTime.SetValue(exposuretime_ms*1000)
+    camera.Gain.SetValue(gain)
+    return camera
+
+def nominalFps(exposuretime_ms, alpha_ms=0.4):
+    #露光時間から決まる撮影のフレームレート
+    #alpha_ms: pylon Viewerから推定した読み取り時間＋その他の内部処理時間
+    return int(min(525, 1000/(exposuretime_ms+alpha_ms)))
+
+def createRecorder(videoname, exposuretime_ms, directory=None, mode=None):
+    #録画するのはmatchで縮小した画像なので、rawのヘッダに縮小率を残す（replayFrameStoreで縮小し直さないため）
+    #directory, mode: Noneなら videoDir, videoMode
+    directory = videoDir if directory is None else directory
+    mode = videoMode if mode is None else mode
+    return videoRecorder.VideoRecorder(os.path.join(directory, videoname), nominalFps(exposuretime_ms), mode=mode, policy=videoPolicy, scale=frameScale)
+
+def processFrame(image, image_template, laser_point, isPlotMatchpoint=False, matcher=None, timer=None):
+    #撮影した画像(changeScale前)を追従と同じように縮小してマッチングする
+    #isPlotMatchpointならマッチ位置は縮小した画像のコピーに描画する（縮小した画像そのものには描かない）
+    #timer: trackingPipeline.StageTimer、指定した場合は縮小(scale)とマッチング(template)の時間を記録する
+    #戻り値: (縮小した画像, 描画した画像(isPlotMatchpointでなければ縮小した画像と同じ), レーザ位置から指先までの距離(x,y))
+    with (timer.measure("scale") if timer is not None else contextlib.nullcontext()):
+        image = imageProcessing.changeScale(image, frameScale)
+    plotted = image.copy() if isPlotMatchpoint else image
+    with (timer.measure("template") if timer is not None else contextlib.nullcontext()):
+        plotted,distance = imageProcessing.calculateCentor2FingerDistance(plotted, image_template, laser_point, isPlotMatchpoint, matcher=matcher)
+    return image, plotted, distance
+
+def frameToRecord(image, plotted):
+    #rawは再解析(replayFrameStore)に使うため描画前の縮小した画像、mp4は確認用に描画した画像を録画する
+    return image if videoMode == "raw" else plotted
 
 #videoDirで指定した動画を分割しrootDirに複数枚の画像として保存する
-def divisionVideo2Image(timeout_ms,timelimit_s,videoDir,rootDir):
+#動画は先頭(start_frame)から順にデコードし（フレームごとのシークはしない）、step_frameで飛ばすフレームはgrabのみでデコードしない
+#output="png" : rootDir/image_番号.pngとして保存、書き込みはworkers個のスレッドで並列に行う
+#output="frames" : rootDir/frames.frames(frameStore)に保存、replayFrameStoreでそのまま再解析できる
+def divisionVideo2Image(timeout_ms,timelimit_s,videoDir,rootDir,start_frame=0,stop_frame=None,step_frame=1,output="png",workers=4):
     #ビデオの読み込み
     cap = cv2.VideoCapture(videoDir)
     if not cap.isOpened():
         print("video can't open")
         return
-    os.makedirs(os.path.dirname(rootDir),exist_ok=True)        #分割するビデオの保存ディレクトリの作成
-    digit = len(str(int(cap.get(cv2.CAP_PROP_FRAME_COUNT))))   #画像名をゼロパディングするように総フレーム数の桁数を取得
+    os.makedirs(rootDir,exist_ok=True)        #分割するビデオの保存ディレクトリの作成
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    digit = len(str(frame_count))   #画像名をゼロパディングするように総フレーム数の桁数を取得
 
     fps = cap.get(cv2.CAP_PROP_FPS)
-    start_frame = 0
-    step_frame = 1
-    stop_frame = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if stop_frame is None or stop_frame > frame_count:
+        stop_frame = frame_count
 
     print("fps = "+str(fps))
+    print("start_frame = "+str(start_frame))
     print("step_frame = "+str(step_frame))
     print("stop_frame = "+str(stop_frame))
 
-    #0フレームから1フレームステップで全フレーム分の画像を保存
-    for n in range(start_frame,stop_frame,step_frame):
-        cap.set(cv2.CAP_PROP_POS_FRAMES,n)
-        ret, frame = cap.read()
-        if ret:
-            cv2.imwrite('{}_{}.{}'.format(rootDir+'/image', str(n).zfill(digit), 'png'), frame)
-        else:
-            break
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES,start_frame)#シークは最初の1回だけ
+
+    #endlessの録画はmatchで縮小した画像なので、縮小率をヘッダに残す
+    store = frameStore.FrameStoreWriter(rootDir+'/frames', fps, scale=frameScale) if output == "frames" else None
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers) if output == "png" else None
+    pending = collections.deque()#書き込み中のPNG、デコードが書き込みより先に進みすぎてメモリを使わないように上限を設ける
+    saved = 0
+    t1 = time.perf_counter()
+    try:
+        for n in range(start_frame,stop_frame):
+            if (n - start_frame) % step_frame != 0:
+                if not cap.grab():#デコードせずに読み飛ばす
+                    break
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if store is not None:
+                store.write(frame, n/fps if fps else float(n))
+            else:
+                pending.append(executor.submit(cv2.imwrite, '{}_{}.{}'.format(rootDir+'/image', str(n).zfill(digit), 'png'), frame))
+                if len(pending) > 4*workers:
+                    pending.popleft().result()
+            saved += 1
+        while pending:
+            pending.popleft().result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if store is not None:
+            store.close()
+        cap.release()
+    t2 = time.perf_counter()
+    print(f"saved {saved} frames in {t2-t1:.2f} s ({saved/max(t2-t1, 1e-9):.1f} frames/s)")
     return fps
 
 #画像のリストimage_list内の画像をtimeout_ms間隔で繋ぎ合わせ動画を作成する
@@ -59,7 +184,7 @@ def createVideo(image_list,fps,videoName):#fpsはフレームレート
     size = (width, height)
     name = videoName+'.mp4'
 
-    out = cv2.VideoWriter('C:/Users/yuto/Documents/system_python/data/'+name, cv2.VideoWriter_fourcc(*'mp4v'), fps, size,isColor=True)
+    out = cv2.VideoWriter(videoDir+name, cv2.VideoWriter_fourcc(*'mp4v'), fps, size,isColor=True)
 
     for image in image_list:
         if isConvert2Color:
@@ -71,26 +196,9 @@ def createVideo(image_list,fps,videoName):#fpsはフレームレート
 #Baslerのカメラからtimelimit_s間timeout_ms間隔で画像を取得し続ける
 def getCameraImage(event, laser_point, timeout_ms,timelimit_s=10,isPlotMatchpoint=False):
 
-    # トランスポートレイヤーインスタンスを取得
-    tl_factory = pylon.TlFactory.GetInstance()
-
-    # InstantCameraオブジェクトの作成
-    camera = pylon.InstantCamera()
-
-    # 最初に見つかったデバイスをアタッチ
-    camera.Attach(tl_factory.CreateFirstDevice())
-
-    # カメラを開く
-    camera.Open()
-
-    # 露光時間を設定（単位はマイクロ秒）
     exposuretime_ms = 1.5
-    camera.ExposureTime.SetValue(exposuretime_ms*1000)
-
     #camera.Gain.SetValue(10.0)
-    camera.Gain.SetValue(18.0)
-
-    image_list = []
+    camera = openCamera(exposuretime_ms, 18.0)
 
     X=0
     Y=0
@@ -103,25 +211,26 @@ def getCameraImage(event, laser_point, timeout_ms,timelimit_s=10,isPlotMatchpoin
     videoname = now.strftime("%Y%m%d_%H%M%S")
 
     radius = 120    
-    image_template = imageProcessing.createTemplateCircleImage(radius)
+    image_template = imageProcessing.getTemplate(radius)#生成済みならキャッシュを使う
+    tracker = imageProcessing.createMatcher("pyramid_tracker", image_template)#前回のマッチ位置の周りだけを探索し、見失ったらピラミッドで探索する
+    recorder = createRecorder(videoname, exposuretime_ms)#撮影しながら別スレッドで録画する
 
     #撮影を開始---
     event.set()
     #sharedFlag.set_CameraGrabbing_flag(True)
-    camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+    camera.StartGrabbing(grabLatestImageOnly)
     t1 = time.time()
     while camera.IsGrabbing():                                                                 #カメラの起動
-        grab = camera.RetrieveResult(timeout_ms, pylon.TimeoutHandling_ThrowException) #timeout_msミリ秒のタイムアウト #起動しているカメラから画像を撮影
+        grab = camera.RetrieveResult(timeout_ms, timeoutHandlingThrow) #timeout_msミリ秒のタイムアウト #起動しているカメラから画像を撮影
         if grab and grab.GrabSucceeded():
             image = grab.GetArray()     #撮影した画像を配列に格納
             
             #print(timelimit_s -(time.time()-t1))
 
             #取得した画像の処理を実行
-            image = imageProcessing.changeScale(image)
-            image,distance = imageProcessing.calculateCentor2FingerDistance(image,  image_template, laser_point, isPlotMatchpoint)
+            image,plotted,distance = processFrame(image, image_template, laser_point, isPlotMatchpoint, matcher=tracker)
 
-            image_list.append(image)
+            recorder.write(frameToRecord(image, plotted))
             
             #X += distance[0]*intervalX/10*7
             #Y -= distance[1]*intervalY/10*7
@@ -159,13 +268,8 @@ def getCameraImage(event, laser_point, timeout_ms,timelimit_s=10,isPlotMatchpoin
     print(f"cameragrab start time is {t1}")
     print(f"cameragrab end time is {t2}")
     controlMirror.changeAngle(0,0,mre2)
-    alpha_ms = 0.4  #pylon Viewerから推定した読み取り時間＋その他の内部処理時間
-    fps = int(min(525, 1000/(exposuretime_ms+alpha_ms)))
-    fps = int(len(image_list)/(t2-t1))
-    #fps = int(fps/10)
-    print("start creating video")
-    createVideo(image_list,fps,videoname)
-    print("created video")
+    recorder.close()#書き込み待ちのフレームを書き終えるまで待つ
+    print(f"camera fps: {recorder.received/(t2-t1):.1f}")
     print("videoname : "+videoname)
 
     #カメラにおける全ての処理が終了したのでカメラを閉じる
@@ -173,38 +277,80 @@ def getCameraImage(event, laser_point, timeout_ms,timelimit_s=10,isPlotMatchpoin
     cv2.destroyAllWindows()
     return
 
+#撮影(grab)、マッチングと制御則(match)、ミラーへの送信(actuate)、録画(record)を別スレッドで並行に行う追従のパイプライン
+#getCameraImage_endlessの追従の本体、benchmark.pyも同じものを測る
+#撮影したフレーム(grabs: 全て、frames: マッチングしたもの)とミラーへの指令(commands)に共通の時計の時刻を付けてsessionIndex("camera")に記録する
+#撮影時刻はカメラのタイムスタンプを共通の時計に換算した時刻（受け取るまでの遅れのばらつきを含まない）
+def createTrackingPipeline(camera, MirrorAngle_channel, controller, laser_point, image_template, tracker, timeout_ms,
+                           recorder=None, isPlotMatchpoint=False, timer=None):
+    session = sessionClock.sessionIndex("camera")
+    camera_clock = sessionClock.ClockMapping(timestampTickNs(camera))
+    def grab():
+        grab = camera.RetrieveResult(timeout_ms, timeoutHandlingReturn) #timeout_msミリ秒のタイムアウト #起動しているカメラから画像を撮影
+        try:
+            if grab and grab.IsValid() and grab.GrabSucceeded():
+                t_retrieve_ns = sessionClock.now_ns()
+                camera_clock.add(grab.TimeStamp, t_retrieve_ns)
+                t_capture_ns = camera_clock.toHost(grab.TimeStamp)
+                session.append("grabs", t_capture_ns, device_timestamp=grab.TimeStamp, t_retrieve_ns=t_retrieve_ns)
+                return grab.GetArray(), t_capture_ns/1e9     #撮影した画像を配列に格納（コピー）
+            return None
+        finally:
+            if grab:
+                grab.Release()
+
+    def match(image, t_grab):
+        #取得した画像の処理を実行
+        image,plotted,distance = processFrame(image, image_template, laser_point, isPlotMatchpoint, matcher=tracker, timer=pipeline.timer)
+        """
+        #ラグ確認用、円起動
+        global count
+        X = 0.1*math.cos(count/100*math.pi)
+        Y = 0.1*math.sin(count/100*math.pi)
+        count +=1
+        """
+        #X -= distance[0]*intervalX/10*5 (filter="none"の場合と同じ)
+        with pipeline.timer.measure("control"):
+            command = controller.update(distance, t_grab, pipeline.timer.recentMean("latency"))
+        session.append("frames", int(t_grab*1e9), distance_x=distance[0], distance_y=distance[1],
+                       X=command[0], Y=command[1])
+        return command, frameToRecord(image, plotted)   #録画するのは縮小した画像（mp4ならマッチ位置を描画したもの）
+
+    def actuate(angle):
+        #controlMirror.changeAngle(X,Y,mre2)
+        with pipeline.timer.measure("enqueue"):
+            MirrorAngle_channel.put(angle)#前の角度がまだ反映されていなければ上書きする（待たない）
+        session.append("commands", sessionClock.now_ns(), X=angle[0], Y=angle[1])
+
+    pipeline = trackingPipeline.TrackingPipeline(grab, match, actuate, record=None if recorder is None else recorder.write, timer=timer)
+    return pipeline
+
 #現状：ボタンのclassでmain.loop()によって処理がストップするため、次に進まない
 # よってthreadでカメラとGUIを分離して処理する、gemini曰くGUIをメインスレッド、カメラをサブスレッドにするのがおすすめ
 # もっとおすすめはミラー専用のプロセスでミラー制御をそのプロセスへのデータ送信の形で実装する
-def getCameraImage_endless(MirrorAngle_queue,prepareLaserPosition,startLDVFlag,cameraGrabingFinish, laser_point, timeout_ms,timelimit_s=30,isPlotMatchpoint=False):
-    # トランスポートレイヤーインスタンスを取得
-    tl_factory = pylon.TlFactory.GetInstance()
-
-    # InstantCameraオブジェクトの作成
-    camera = pylon.InstantCamera()
-
-    # 最初に見つかったデバイスをアタッチ
-    camera.Attach(tl_factory.CreateFirstDevice())
-
-    # カメラを開く
-    camera.Open()
-
-    # 露光時間を設定（単位はマイクロ秒）
-    exposuretime_ms = 1.5
-    camera.ExposureTime.SetValue(exposuretime_ms*1000)
-
-    camera.Gain.SetValue(18.0)
-
-    image_list = []
-
-    
+def getCameraImage_endless(MirrorAngle_channel,prepareLaserPosition,startLDVFlag,cameraGrabingFinish, laser_point, timeout_ms,timelimit_s=30,isPlotMatchpoint=False):
+    instrumentation.configure("camera")
     intervalX = 0.01/126
     intervalY = 0.01/126
 
+    exposuretime_ms = 1.5
+    #シミュレーションのカメラでは、ミラーのプロセスが反映し終えた角度だけ画像上の指先を動かす（changeScale前の画素に換算）
+    #（指令した角度controller.X, Yではなく反映した角度を使うため、ミラーの遅延や上書きが追従に現れる）
+    camera = openCamera(exposuretime_ms, 18.0, angle_source=MirrorAngle_channel.appliedAngle,
+                        pixels_per_angle=(1/(intervalX*0.5), 1/(intervalY*0.5)))
+
 
     #mre2 = controlMirror.setMirror()
-    X, Y = prepareLaserPosition.get()#GUIで設定したミラーの初期角度を受信するまで待機
-    MirrorAngle_queue.put((X,Y))
+    #GUIで設定したミラーの初期角度を受信するまで待機、その前にセッションが終了した場合（GUIを閉じた時など）は撮影せずに終わる
+    while True:
+        try:
+            X, Y = prepareLaserPosition.get(timeout=0.1)
+            break
+        except queue.Empty:
+            if cameraGrabingFinish.is_set():
+                camera.Close()
+                return
+    MirrorAngle_channel.put((X,Y))
     
     #print(f"prepareMirror is set")
     #controlMirror.changeAngle(X,Y,mre2)
@@ -213,69 +359,91 @@ def getCameraImage_endless(MirrorAngle_queue,prepareLaserPosition,startLDVFlag,c
     videoname = now.strftime("%Y%m%d_%H%M%S")
 
     radius = 100    
-    image_template = imageProcessing.createTemplateCircleImage(radius)
+    image_template = imageProcessing.getTemplate(radius)#生成済みならキャッシュを使う
+    tracker = imageProcessing.createMatcher("pyramid_tracker", image_template)#前回のマッチ位置の周りだけを探索し、見失ったらピラミッドで探索する
+
+
+    #制御則: 指先の目標角度をフィルタで推定し、撮影から指令が届くまでの遅延の分だけ先の位置を予測して追従する
+    controller = createController(X, Y, intervalX, intervalY, laser_point)
 
+    recorder = createRecorder(videoname, exposuretime_ms)#撮影しながら別スレッドで録画する
+    pipeline = createTrackingPipeline(camera, MirrorAngle_channel, controller, laser_point, image_template, tracker,
+                                      timeout_ms, recorder, isPlotMatchpoint)
+    session = sessionClock.sessionIndex("camera")
 
     #撮影を開始---
     startLDVFlag.set()
-    camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+    camera.StartGrabbing(grabLatestImageOnly)
+    instrumentation.instant("start_grabbing")
     t1 = time.time()
-    while (not cameraGrabingFinish.is_set()):                                                  #カメラの起動
-        grab = camera.RetrieveResult(timeout_ms, pylon.TimeoutHandling_ThrowException) #timeout_msミリ秒のタイムアウト #起動しているカメラから画像を撮影
-        if grab and grab.GrabSucceeded():
-            image = grab.GetArray()     #撮影した画像を配列に格納
-            
-
-            #取得した画像の処理を実行
-            image = imageProcessing.changeScale(image)
-            image,distance = imageProcessing.calculateCentor2FingerDistance(image,  image_template, laser_point, isPlotMatchpoint)
-
-            image_list.append(image)
-            
-            
-            """
-            #ラグ確認用、円起動
-            global count
-            X = 0.1*math.cos(count/100*math.pi)
-            Y = 0.1*math.sin(count/100*math.pi)
-            count +=1
-            """
-            X -= distance[0]*intervalX/10*5
-            Y -= distance[1]*intervalY/10*5
-            
-            #controlMirror.changeAngle(X,Y,mre2)
-            MirrorAngle_queue.put((X,Y))
-
-
-            grab.Release()
+    pipeline.start()
+    try:
+        while not cameraGrabingFinish.wait(0.05):
+            if (time.time()-t1) > timelimit_s or not pipeline.is_running():#timelimit秒後、またはパイプラインが異常終了した時
+                break
+    finally:
         t2 = time.time()
-
-        #cv2.imwrite('C:/Users/yuto/Documents/system_python/data/'+str(datetime.datetime.now())+'.png', img)    #取得した配列を名前を付けてコンピュータに保存
-        if((t2-t1)>timelimit_s):#timelimit秒後
+        try:
+            pipeline.stop()
+        finally:
             camera.StopGrabbing()
             cameraGrabingFinish.set()
+            instrumentation.instant("stop_grabbing")
             print("camera stop grabbing")
 
     #---撮影の終了
     #print(f"cameragrab start time is {t1}")
     #print(f"cameragrab end time is {t2}")
     print(f"camera grabing time: {t2-t1}[s]")
+    print(f"template matching: {tracker.local_searches} local / {tracker.full_searches} full-frame searches")
+    pipeline.report(t2-t1)
     #controlMirror.changeAngle(0,0,mre2)
-    MirrorAngle_queue.put((0,0))
-    alpha_ms = 0.4  #pylon Viewerから推定した読み取り時間＋その他の内部処理時間
-    fps = int(min(525, 1000/(exposuretime_ms+alpha_ms)))
-    fps = int(len(image_list)/(t2-t1))
-    #fps = int(fps/10)
-    print("create video")
-    createVideo(image_list,fps,videoname)
-    print("created video")
+    MirrorAngle_channel.put((0,0))
+    with instrumentation.span("recorder_close"):
+        recorder.close()#書き込み待ちのフレームを書き終えるまで待つ
     print("videoname is "+videoname)
+    index_file = sessionClock.saveIndex()#セッションのディレクトリ(main.run_endlessで指定)がある場合のみ
+    if index_file is not None:
+        print(f"session index: {session.count('frames')} frames / {session.count('commands')} commands -> {index_file}")
 
     #カメラにおける全ての処理が終了したのでカメラを閉じる
     camera.Close()
     cv2.destroyAllWindows()
     return
 
+#frameStore(録画のmode="raw")に保存した撮影画像を順に読み、撮影時と同じようにマッチングし直す
+#動画のデコードやPNGの書き出し・読み込みがないため、マッチングの速度で再解析できる
+#ヘッダにscaleがない録画は撮影したままの画像とみなし、撮影時と同じくprocessFrameで縮小してからマッチングする
+#（テンプレートとlaser_pointは縮小後の座標のため）
+#戻り値: (各フレームの撮影時刻, 各フレームのレーザ位置から指先までの距離(x,y))
+def replayFrameStore(name, laser_point, image_template, matcher="pyramid_tracker", isPlotMatchpoint=True, result_videoName=None):
+    reader = frameStore.FrameStoreReader(name)
+    tracker = imageProcessing.createMatcher(matcher, image_template)
+    recorder = None
+    if result_videoName is not None:
+        recorder = videoRecorder.VideoRecorder(videoDir+result_videoName, reader.fps or 30, mode="mp4", policy="block")
+    distances = np.full((len(reader), 2), np.nan)
+    isScaled = reader.header.get("scale") is not None
+    if isScaled and reader.header["scale"] != frameScale:
+        raise ValueError(f"frames were recorded at scale {reader.header['scale']}, tracking uses {frameScale}")
+
+    t1 = time.perf_counter()
+    for n, timestamp, frame in reader.iterFrames():
+        #読み込み専用のmemmapなので、描画する場合はカラーに変換したコピーに描く
+        image = cv2.cvtColor(frame,cv2.COLOR_GRAY2BGR) if isPlotMatchpoint else frame
+        if isScaled:
+            image,distance = imageProcessing.calculateCentor2FingerDistance(image,image_template,laser_point,isPlotMatchpoint,matcher=tracker)
+        else:
+            _,image,distance = processFrame(image, image_template, laser_point, isPlotMatchpoint, matcher=tracker)
+        distances[n] = distance
+        if recorder is not None:
+            recorder.write(image, timestamp)
+    t2 = time.perf_counter()
+    print(f"replayed {len(reader)} frames in {t2-t1:.2f} s ({len(reader)/max(t2-t1, 1e-9):.1f} frames/s)")
+    if recorder is not None:
+        recorder.close()
+    return reader.timestamps, distances
+
 #取得した録画を画像に分割し、fpsやマッチングの特徴点を描画するか否かを変更して再度動画にまとめる
 #分割した画像も保存する
 if __name__ == "__main__":
@@ -283,31 +451,36 @@ if __name__ == "__main__":
     timelimit_s = 10
     #getCameraImage(timelimit_s,timeout_ms)
     videoname = "20260427_144730"
-    videoDir = 'C:/Users/yuto/Documents/system_python/data/'+videoname+'.mp4'
-    rootDir = 'C:/Users/yuto/Documents/system_python/data/'+videoname+'_list'
-    try:
-        os.makedirs(rootDir)
-    except FileExistsError:
-        pass
+    videoPath = videoDir+videoname+'.mp4'
+    rootDir = videoDir+videoname+'_list'
 
     
     laserImage = 'Image__2026-04-27__14-10-10.png'
 
     laser_point = imageProcessing.calculateLaserPoint('C:/Users/yuto/Documents/system_python/'+laserImage)
 
-    fps = divisionVideo2Image(timeout_ms,timelimit_s,videoDir,rootDir)
-    print(f"fps is {fps}")
-    image_list = []
     result_videoName = videoname+'_slow'
     
     radius = 120    
-    image_template = imageProcessing.createTemplateCircleImage(radius)
+    image_template = imageProcessing.getTemplate(radius)#生成済みならキャッシュを使う
 
-    files = glob.glob(rootDir+"/*.png")
-    for file in files:
-        image = cv2.imread(file, cv2.IMREAD_COLOR)
-        #image = imageProcessing.changeScale(image)
-        image,_ = imageProcessing.calculateCentor2FingerDistance(image,image_template,laser_point,isPlotMatchpoint=True)
-        image_list.append(image)
+    if os.path.exists(frameStore.framesPath(videoDir+videoname)):
+        #raw形式で録画した場合はframeStoreから直接再解析する
+        replayFrameStore(videoDir+videoname, laser_point, image_template, result_videoName=result_videoName)
+    else:
+        try:
+            os.makedirs(rootDir)
+        except FileExistsError:
+            pass
+        fps = divisionVideo2Image(timeout_ms,timelimit_s,videoPath,rootDir)
+        print(f"fps is {fps}")
+        image_list = []
+
+        files = sorted(glob.glob(rootDir+"/*.png"))#ファイル名はゼロ埋めした番号なので、並べ替えればフレーム順になる
+        for file in files:
+            image = cv2.imread(file, cv2.IMREAD_COLOR)
+            #image = imageProcessing.changeScale(image)#録画はmatchで縮小した画像なので、縮小し直さない
+            image,_ = imageProcessing.calculateCentor2FingerDistance(image,image_template,laser_point,isPlotMatchpoint=True)
+            image_list.append(image)
 
-    createVideo(image_list,fps,result_videoName)
+        createVideo(image_list,fps,result_videoName)
@@ -1,8 +1,9 @@
 import controlMirror
+import instrumentation
 class ButtonWindow:
-    def __init__(self,MirrorAngle_queue,prepareLaserPosition,cameraGrabingFinish):
+    def __init__(self,MirrorAngle_channel,prepareLaserPosition,cameraGrabingFinish):
         self.root = None
-        self.MirrorAngle_queue = MirrorAngle_queue
+        self.MirrorAngle_channel = MirrorAngle_channel
         self.X = 0
         self.Y = 0
         self.prepareLaserPosition = prepareLaserPosition
@@ -10,39 +11,42 @@ class ButtonWindow:
 
     def on_button_start_click(self):
         print("開始")
+        instrumentation.instant("start")
         self.prepareLaserPosition.put((self.X,self.Y))
 
     def on_button_end_click(self):
         print("終了")
+        instrumentation.instant("finish")
         self.cameraFinishFlag.set()
 
     def on_button_up_click(self):
         #print("上クリック")
         self.Y += 0.015
         #controlMirror.changeAngle(self.X,self.Y,self.mre2)
-        self.MirrorAngle_queue.put((self.X,self.Y))
+        self.MirrorAngle_channel.put((self.X,self.Y))
 
     def on_button_left_click(self):
         #print("左クリック")
         self.X -= 0.015
         #controlMirror.changeAngle(self.X,self.Y,self.mre2)
-        self.MirrorAngle_queue.put((self.X,self.Y))
+        self.MirrorAngle_channel.put((self.X,self.Y))
 
     def on_button_right_click(self):
         #print("右クリック")
         self.X += 0.015
         #controlMirror.changeAngle(self.X,self.Y,self.mre2)
-        self.MirrorAngle_queue.put((self.X,self.Y))
+        self.MirrorAngle_channel.put((self.X,self.Y))
 
     def on_button_down_click(self):
         #print("下クリック")
         self.Y -= 0.015
         #controlMirror.changeAngle(self.X,self.Y,self.mre2)
-        self.MirrorAngle_queue.put((self.X,self.Y))
+        self.MirrorAngle_channel.put((self.X,self.Y))
 
 
     def run(self):
         import tkinter as tk
+        instrumentation.configure("gui")
         self.root = tk.Tk()
         self.root.title("test")
 
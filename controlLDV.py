@@ -2,9 +2,11 @@ import numpy as np
 import os
 import datetime
 import time
-import winsound
 import itertools
-import queue
+try:
+    import winsound
+except ImportError:#Windows以外では音を鳴らさない
+    winsound = None
 from scipy import integrate
 
 import matplotlib
@@ -14,15 +16,24 @@ import matplotlib.pyplot as plt
 from matplotlib import animation
 
 import signalProcessing
+import captureFile
+import simulation
+import instrumentation
+import sessionClock
+import processSupervisor
 
 
 from Polytec_Python.acquisition_examples import acquire_streaming
 from Polytec_Python.acquisition_examples.acquisition_control import acquireData
+from Polytec_Python.acquisition_examples.acquisition_control import streaming
 from Polytec_Python.acquisition_examples import changeBandwidthandRange
 
 import multiprocessing
 
 
+def beep(frequency, duration_ms):
+    if winsound is not None:
+        winsound.Beep(frequency, duration_ms)
 
 
 def run(sample_count=2**17, new_bandwidth="1 kHz", new_range="10 mm/s"):
@@ -30,7 +41,7 @@ def run(sample_count=2**17, new_bandwidth="1 kHz", new_range="10 mm/s"):
     rootDir = 'C:/Users/yuto/Documents/system_python/data/LDVdata'
     now = datetime.datetime.now()
     name = now.strftime("%Y%m%d_%H%M%S")
-    file_name = rootDir + '/' + name + '.txt'
+    file_name = rootDir + '/' + name    #拡張子なし、signalProcessingの各関数もこの形で受け取る
     try:
         os.makedirs(rootDir)
     except FileExistsError:
@@ -38,20 +49,18 @@ def run(sample_count=2**17, new_bandwidth="1 kHz", new_range="10 mm/s"):
     
     changeBandwidthandRange.run(ip_address, new_bandwidth,new_range)
 
-    velocity = ""
-    
     #sample_count = 2**17 # 2^17 = 131,072
     data_time_interval = 1/218750
         
     #sharedFlag.set_DataAcquiring_flag(True)
-    winsound.Beep(400,500)#400Hzを500ms
+    beep(400,500)#400Hzを500ms
     time.sleep(0.5)
 
     start = time.time()
-    velocity += acquire_streaming.run(ip_address,sample_count)
+    velocity = acquire_streaming.run(ip_address,sample_count)#acquire_dataは数値の配列を返す
     end = time.time()
 
-    winsound.Beep(400,500)#400Hzを500ms
+    beep(400,500)#400Hzを500ms
     #sharedFlag.set_DataAcquiring_flag(False)
     #print(f"set DataAcquiringFlag:{sharedFlag.isDataAcquiring}")
   
@@ -60,12 +69,9 @@ def run(sample_count=2**17, new_bandwidth="1 kHz", new_range="10 mm/s"):
     print(f"acquired end time is {end}")
     print(f"expected time is {data_time_interval*(sample_count-1)}")
 
-    text = velocity.split('\n')
-    text = text[0:sample_count]
-    #print(text)
-    #velocity = [float(x) for x in text[0:sample_count]]
-
-    np.savetxt(file_name, text,fmt='%s')
+    velocity = np.asarray(velocity)[0:sample_count]
+    captureFile.write_capture(file_name, velocity, data_time_interval, quantity="velocity", unit="m/s",
+                              bandwidth=new_bandwidth, range=new_range, t_start=start, t_end=end)
     
     signalProcessing.fftplt_indiv(file_name, sample_count,data_time_interval)
     signalProcessing.STFT(sample_count,data_time_interval,file_name,2**15)
@@ -73,10 +79,11 @@ def run(sample_count=2**17, new_bandwidth="1 kHz", new_range="10 mm/s"):
     return file_name
 
 class UseLDV:
-    def __init__(self,cameraGrabingFinish,sample_count, new_bandwidth,new_range,lastdata_queue,isArmMoving):
+    def __init__(self,cameraGrabingFinish,sample_count, new_bandwidth,new_range,capture_store,isArmMoving,continuous=False,startFlag=None):
         self.ip_address = "192.168.137.1"
 
         self.cameraFinishFlag = cameraGrabingFinish
+        self.startFlag = startFlag  #setされたら計測を始めるEvent（Noneなら接続後すぐに始める）、接続と設定はその前に済ませておく
         self.isArmMoving = isArmMoving
 
         self.new_bandwidth = new_bandwidth
@@ -90,20 +97,35 @@ class UseLDV:
 
         self.anime = None
         self.velocity = ""
-        self.lastdata = lastdata_queue
-        self.buffer_list=[]
+        self.capture_store = capture_store  #計測ごとのデータを書き込む共有メモリ(captureStore.SharedCaptureStore)、メインプロセスがコピーなしで読む
 
         self.device_communication = None
         self.data_acquisition = None
         self.block_size = None
         self.limited_active_channels = None
         self.base_samples_chunk_size = None
-
+        self.acquisition_engine = None   #計測ごとに同じ出力配列を再利用するエンジン
+
+        #continuous=Trueの時、計測ごとにstart/stopせずリングバッファを動かし続け、読み出しスレッドから隙間なくN点ずつ取り出す
+        self.continuous = continuous
+        self.stream = None
+        self.stream_reader = None
+        self.stream_timeout_s = 5
+        self.skipped_samples = 0    #読み出しが遅れてリングバッファに上書きされ、読み飛ばしたサンプル数（連続計測のみ）
+        self.session = None #計測ごとの最初のサンプルの時刻を記録するSessionIndex（animateを実行するプロセスで作る）
         
 
     def cleanup(self):
         print("終了処理を開始します...")
         
+        # 0. 連続計測中なら読み出しスレッドとリングバッファを止める
+        if self.stream is not None:
+            try:
+                self.stream.stop()
+            except Exception as e:
+                print(f"continuous acquisition error: {e}")
+            self.stream = None
+
         # 1. まずデータ取得オブジェクトを消す（これで __del__ が走る）
         # 通信(device_communication)はまだ生きているので、エラーにならない
         if self.data_acquisition is not None:
@@ -131,16 +153,54 @@ class UseLDV:
         #velocity_list = acquire_streaming.run(self.ip_address,self.N)
         
         #ここにロボットアームを動かす処理、ロボットアームの動き終わりまで待機する必要がある？
-        while(self.isArmMoving.is_set()):#前回の指令によるロボットアームの動きが終わるまで待機
-            print("RobotArm is moving")
+        with instrumentation.span("wait_arm"):
+            while(self.isArmMoving.is_set()):#前回の指令によるロボットアームの動きが終わるまで待機
+                print("RobotArm is moving")
         self.isArmMoving.set()#ロボットアームを動かす指令を送信
         
-        velocity_list = acquireData._acquire_data_ver3(self.data_acquisition, self.N, self.block_size,self.limited_active_channels, self.base_samples_chunk_size)
-        
+        with instrumentation.span("acquire"):
+            if self.continuous:
+                velocity_list = self._nextWindow()
+                first_sample = self.stream_reader.cursor - velocity_list.size
+                chunk_times = list(self.stream.chunk_times)
+            else:
+                slot = self.capture_store.begin_write()#共有メモリの次のスロットに直接書き込む
+                velocity_list = self.acquisition_engine.acquire(out=slot)
+                first_sample = 0
+                chunk_times = self.acquisition_engine.chunk_times
+
+        #サンプル番号とチャンクを受け取った時刻の組から、最初のサンプルの時刻を共通の時計で求める
+        sample_clock = sessionClock.ClockMapping.fromPairs(chunk_times, self.dt*1e9)
+        t_first_ns = sample_clock.toHost(first_sample)
+        t_end_ns = sample_clock.toHost(first_sample + velocity_list.size)
+        sequence = self.capture_store.count()
+        self.session.append("ldv", t_first_ns, sequence=sequence, sample_count=velocity_list.size,
+                            ns_per_sample=sample_clock.ns_per_tick_fitted)
+        #メインプロセスから読めるようにする（ヘッダに書く時刻はtime.time()の時刻）
+        self.capture_store.commit(velocity_list.size, sessionClock.wallTime(t_first_ns), sessionClock.wallTime(t_end_ns))
+        instrumentation.counter("captures", self.capture_store.count())
         
 
         return velocity_list
 
+    def _nextWindow(self):
+        #前回のウィンドウの直後からN点を共有メモリの次のスロットに取り出す（計測の隙間なし）
+        #グラフの描画などで読み出しがリングバッファ1周分以上遅れた場合は、上書きされた分を読み飛ばして最新の位置から読む
+        reader = self.stream_reader
+        while True:
+            if not reader.ring.wait_for(reader.cursor + self.N, self.stream_timeout_s):
+                raise RuntimeError(f"no LDV data for {self.stream_timeout_s} s: {self.stream.error}")
+            slot = self.capture_store.begin_write()#データが揃ってからスロットを取る
+            try:
+                return reader.next_window(self.N, timeout=0, out=slot)
+            except streaming.OverrunError as e:
+                cursor = reader.cursor
+                reader.skip_to_latest()
+                skipped = reader.cursor - cursor
+                self.skipped_samples += skipped
+                print(f"LDV overrun, skipped {skipped} samples ({self.skipped_samples} in total): {e}")
+                instrumentation.counter("ldv_skipped_samples", self.skipped_samples)
+
     def __update(self,frame,t,line):
         #if frame == self.last_frame:
         #    return line,
@@ -148,55 +208,58 @@ class UseLDV:
         #カメラ追従を終了した時、グラフの更新も停止する
         if self.cameraFinishFlag.is_set() == True:
             print("アニメーションの終了")
-            try:
-                """
-                # 現在のデータを取得
-                x = line.get_xdata()
-                y = line.get_ydata()
-                """
-                send_data = np.array(self.buffer_list)
-                # 古いデータが残っていれば捨てて（念の為）、新しいデータを入れる
-                # ※ maxsize=1設定なら、putの前にget_nowaitする
-                try:
-                    while not self.lastdata.empty():
-                        self.lastdata.get_nowait()
-                except queue.Empty:
-                    pass
-                #self.lastdata.put((x,y))#Queueにデータを送信し、メインプロセスでこれを取得する
-                self.lastdata.put(send_data)
-                print("Queueにデータを送信しました")
-
-            except Exception as e:
-                print(f"データ送信エラー：{e}")
+            #計測データは計測ごとにcapture_storeへ書き込み済みなので、ここで送信する必要はない
+            print(f"共有メモリに{self.capture_store.count()}回分の計測データがあります")
             
             self.anime.event_source.stop()#アニメーションの停止
             self.cleanup()
+            sessionClock.saveIndex()#セッションのディレクトリ(main.run_endlessで指定)がある場合のみ
             plt.close(self.fig)#pltの終了、plt.closeでplt.showを終わらせる
             return line,
   
         print(f'frame: {frame}')#現在のフレームを確認
 
-        winsound.Beep(440,250)#400Hzを250ms鳴らす
-        winsound.Beep(493,250)
+        beep(440,250)#400Hzを250ms鳴らす
+        beep(493,250)
         now_1 = time.perf_counter()
         new_y_data = self._dataAquisition()#LDVからデータ取得
         now_2 = time.perf_counter()
-        winsound.Beep(523,250)
+        beep(523,250)
         print(f"Time: {now_2 - now_1:.6f}秒")
 
         line.set_ydata(new_y_data)#lineに取得した変位データをset
-        self.buffer_list.append(new_y_data)#バッファに変位データを蓄積（あとでメインプロセスにn計測回分まとめて送信）
         #self.last_frame = frame
         return line,
 
+    def _connect(self):
+        #SYSTEM_SIMULATEにldvを含む場合は実機の代わりにsimulation.SimulatedDataAcquisitionから同じ形式でデータを受け取る
+        if simulation.isSimulated("ldv"):
+            return simulation.connectDevice(self.N, simulation.parseVelocityRange(self.new_range))
+        return acquire_streaming.connect_device(self.ip_address,self.N)
+
     def animate(self):
-        try:
-            changeBandwidthandRange.run(self.ip_address, self.new_bandwidth,self.new_range)
-        except:
-            print("change bandwidth and range error")
-            return
+        instrumentation.configure("ldv")
+        self.session = sessionClock.sessionIndex("ldv")
+        if not simulation.isSimulated("ldv"):
+            try:
+                changeBandwidthandRange.run(self.ip_address, self.new_bandwidth,self.new_range)
+            except:
+                print("change bandwidth and range error")
+                return
         
-        self.device_communication, self.data_acquisition, self.block_size,self.limited_active_channels, self.base_samples_chunk_size = acquire_streaming.connect_device(self.ip_address,self.N)
+        self.device_communication, self.data_acquisition, self.block_size,self.limited_active_channels, self.base_samples_chunk_size = self._connect()
+        self.acquisition_engine = acquireData.AcquisitionEngine(self.data_acquisition, self.block_size, self.limited_active_channels, self.base_samples_chunk_size)
+        processSupervisor.notifyReady()#設定と接続が終わったら準備完了（カメラの撮影開始を待たずに、他のプロセスと並行に準備する）
+        if self.startFlag is not None:
+            #カメラの撮影開始まで待つ、その前にセッションが終了した場合は計測せずに終わる
+            while not self.startFlag.wait(0.1):
+                if self.cameraFinishFlag.is_set():
+                    self.cleanup()
+                    return
+        if self.continuous:
+            self.stream = streaming.ContinuousAcquisition(self.data_acquisition, self.limited_active_channels, self.base_samples_chunk_size, ring_capacity=8*self.N)
+            self.stream.start()
+            self.stream_reader = self.stream.reader()
         
         self.fig= plt.figure()
         plt.xlabel('time [s]')
@@ -219,6 +282,8 @@ class UseLDV:
         interval_margin_ms = 1000
         data_time_interval = self.dt
         interval_ms = self.N * self.dt * 1000 + interval_margin_ms
+        if self.continuous:
+            interval_ms = 10 #next_windowがデータが揃うまで待つため、タイマーで間隔を空ける必要はない
         #interval_ms = 100
         frames = itertools.count(1,1) #フレーム番号を無限に生成itertools.count(start=1, step=1)
         #frames = range(5)               #5回だけ実行、テスト用
@@ -255,24 +320,18 @@ if __name__ == "__main__":
     changeBandwidthandRange.run(ip_address, "100 kHz")
     print("changeBandwidthandRange was Done\n")
 
-    velocity = ""
-    
     sample_count = 2**17 # 2^17 = 131,072
     data_time_interval = 1/218750
     
     #start = time.time()
-    velocity += acquire_streaming.run(ip_address,sample_count)
+    velocity = acquire_streaming.run(ip_address,sample_count)
     #end = time.time()
     print("acquisition was Done\n")
     #print(f"time is {end - start}")
     print(f"expected time is {data_time_interval*(sample_count-1)}")
 
-    text = velocity.split('\n')
-    text = text[0:sample_count]
-    #print(text)
-    #velocity = [float(x) for x in text[0:sample_count]]
-
-    np.savetxt(rootDir + "/" + name + ".txt", text,fmt='%s')
-    print("savetxt was Done\n")
+    velocity = np.asarray(velocity)[0:sample_count]
+    captureFile.write_capture(rootDir + "/" + name, velocity, data_time_interval, quantity="velocity", unit="m/s", bandwidth="100 kHz")
+    print("write_capture was Done\n")
     
-    signalProcessing.fftplt_indiv(rootDir+"/"+name + ".txt", sample_count,data_time_interval)
\ No newline at end of file
+    signalProcessing.fftplt_indiv(rootDir+"/"+name, sample_count,data_time_interval)
\ No newline at end of file
@@ -1,11 +1,19 @@
-import optoMDC
+try:
+    import optoMDC
+except ImportError:#optoMDCがない環境ではシミュレーションのミラー(SYSTEM_SIMULATE=mirror)のみ使える
+    optoMDC = None
 import time
+import math
+
+import simulation
+import instrumentation
+import processSupervisor
 
 class mirrorServer:
-    def __init__(self,MirrorAngle_Queue, prepareMirror):
+    def __init__(self,MirrorAngle_channel, prepareMirror):
         self.X = 0
         self.Y = 0
-        self.MirrorAngle_Queue = MirrorAngle_Queue
+        self.MirrorAngle_channel = MirrorAngle_channel
         self.prepareMirror = prepareMirror
     
     def setMirror(self):
@@ -29,8 +37,7 @@ class mirrorServer:
         return mre2
 
     def changeAngle(self,X, Y,mre2):
-        mre2.Mirror.Channel_0.StaticInput.SetXY(X) 
-        mre2.Mirror.Channel_1.StaticInput.SetXY(Y) 
+        getDriver(mre2).setXY(X, Y)
         return
     
     def currentXY(self):
@@ -43,14 +50,21 @@ class mirrorServer:
             self.prepareMirror.set()
         except Exception as e:
             print(f"Mirror Process Error:{e}")
-        while True:
-            angle_data = self.MirrorAngle_Queue.get()
+        while not self.MirrorAngle_channel.closed:
+            angle_data = self.MirrorAngle_channel.get(timeout=0.5)#最新の角度だけを受け取る
+            if angle_data is None:
+                continue
             try:
                 changeAngle(angle_data[0],angle_data[1],mre2)
+                self.X, self.Y = angle_data
             except:
                 print("mirror angle error")
+                angle_data = None
+            self.MirrorAngle_channel.applied(angle_data)
 
 def setMirror():
+    if simulation.isSimulated("mirror"):
+        return simulation.SimulatedMirror()#setXY、playWaveformなどMirrorDriverと同じメソッドを持つ
     mre2 = optoMDC.connectmre2()
     ch_0 = mre2.Mirror.Channel_0                         #channel_0がX,channel_1がY
     ch_0.StaticInput.SetAsInput()                        # (1) here we tell the Manager that we will use a static input
@@ -71,26 +85,136 @@ def setMirror():
     return mre2
 
 
+#ミラーへの送信
+#SetXYをチャンネルごとに呼ぶと1回の角度変更で2回通信し、XとYが反映される時刻もずれる
+#MirrorDriverはX, Yのレジスタをboard.set_valueで1回の通信にまとめて書き込む（失敗した場合は以降SetXYを2回呼ぶ）
+#
+#波形モード(playWaveform):
+#  あらかじめ計算した軌跡(X, Yの点列)をコントローラのVectorPatternMemoryに書き込み、VectorPatternUnitで一定の周期で再生する
+#  Pythonから1点ずつ送らないため、通信の遅延やばらつきに関係なく軌跡どおりに動く（格子状の走査、遅延確認用の円軌道など）
+#  メモリには X の点列、Y の点列 の順に並べ、チャンネル0がX、チャンネル1がYの範囲を再生する
+
+class MirrorDriver:
+    def __init__(self, mre2, paired=True):
+        """
+        mre2  : setMirror()で接続したボード
+        paired: Trueなら X, Y を1回の通信で書き込む
+        """
+        self.mre2 = mre2
+        self.paired = paired
+        self.channels = [mre2.Mirror.Channel_0, mre2.Mirror.Channel_1]
+        self.__xy_registers = [ch.StaticInput.xy for ch in self.channels]
+        self.__run_registers = [ch.VectorPatternUnit.run for ch in self.channels]
+        self.waveform_running = False
+
+    def setXY(self, X, Y):
+        if self.paired:
+            try:
+                self.mre2.set_value(self.__xy_registers, [X, Y])
+                return
+            except Exception as e:
+                print(f"paired mirror write failed, fall back to SetXY per channel: {e}")
+                self.paired = False
+        self.channels[0].StaticInput.SetXY(X)
+        self.channels[1].StaticInput.SetXY(Y)
+
+    def playWaveform(self, X_points, Y_points, sample_rate, cycles=-1):
+        """
+        X_points, Y_points: 軌跡の角度の点列（同じ長さ）
+        sample_rate       : 1秒あたりに再生する点数[Hz]（最大はVectorPatternUnit.GetMaxFreqSampleSpeed()）
+        cycles            : 繰り返す回数、負の値なら止めるまで繰り返す
+        """
+        if len(X_points) != len(Y_points):
+            raise ValueError("X_points and Y_points must have the same length")
+        count = len(X_points)
+        self.mre2.VectorPatternMemory.SetPattern(0, [float(v) for v in X_points])
+        self.mre2.VectorPatternMemory.SetPattern(count, [float(v) for v in Y_points])
+        for n, ch in enumerate(self.channels):
+            unit = ch.VectorPatternUnit
+            unit.SetUnit(optoMDC.UnitType.XY)
+            unit.SetStart(n*count)
+            unit.SetEnd((n + 1)*count)
+            unit.SetFreqSampleSpeed(sample_rate)
+            unit.SetCycles(cycles)
+            unit.SetAsInput()
+            ch.Manager.CheckSignalFlow()
+        self.mre2.set_value(self.__run_registers, [True, True])#X, Yを同時に開始する
+        self.waveform_running = True
+
+    def stopWaveform(self):
+        #再生を止め、SetXYで角度を指定する入力(StaticInput)に戻す
+        self.mre2.set_value(self.__run_registers, [False, False])
+        for ch in self.channels:
+            ch.StaticInput.SetAsInput()
+            ch.Manager.CheckSignalFlow()
+        self.waveform_running = False
+
+
+def circleTrajectory(radius=0.1, points=200, center=(0, 0)):
+    #円軌道（遅延確認用、X = radius*cos(2πn/points), Y = radius*sin(2πn/points)）
+    X_points = [center[0] + radius*math.cos(2*math.pi*n/points) for n in range(points)]
+    Y_points = [center[1] + radius*math.sin(2*math.pi*n/points) for n in range(points)]
+    return X_points, Y_points
+
+
+def gridTrajectory(X_range=(-0.1, 0.1), Y_range=(-0.1, 0.1), num=7, dwell=10):
+    #格子状の走査（行ごとに往復）、各点でdwell点分止まる
+    X_points, Y_points = [], []
+    for i in range(num):
+        X = X_range[0] + (X_range[1] - X_range[0])*i/(num - 1)
+        for j in range(num):
+            j = j if i % 2 == 0 else num - 1 - j
+            Y = Y_range[0] + (Y_range[1] - Y_range[0])*j/(num - 1)
+            X_points += [X]*dwell
+            Y_points += [Y]*dwell
+    return X_points, Y_points
+
+
+_drivers = {}
+
+def getDriver(mre2):
+    #ボードごとにMirrorDriverを1つ作って使い回す
+    if isinstance(mre2, simulation.SimulatedMirror):
+        return mre2
+    driver = _drivers.get(id(mre2))
+    if driver is None or driver.mre2 is not mre2:
+        driver = _drivers[id(mre2)] = MirrorDriver(mre2)
+    return driver
+
+
 def changeAngle(X, Y,mre2):
-    mre2.Mirror.Channel_0.StaticInput.SetXY(X) 
-    mre2.Mirror.Channel_1.StaticInput.SetXY(Y) 
+    getDriver(mre2).setXY(X, Y)#X, Yを1回の通信で書き込む
     #print(f"X={X}, Y={Y}")
 
     return
 
-def mirror_server(MirrorAngle_Queue, prepareMirror):
+def mirror_server(MirrorAngle_channel, prepareMirror=None):
+    #MirrorAngle_channel: mirrorChannel.MirrorCommandChannel、反映が追いつかない間にputされた古い角度は飛ばして最新の角度だけを反映する
+    #prepareMirror: ミラーを初期位置にセットしたらsetするEvent（processSupervisorから起動した場合はnotifyReadyで通知するため不要）
+    #MirrorAngle_channel.close()で終了する
+    instrumentation.configure("mirror")
     try:
         mre2 = setMirror()
         changeAngle(0,0,mre2)
-        prepareMirror.set()
     except Exception as e:
         print(f"Mirror Process Error:{e}")
-    while True:
-        X, Y = MirrorAngle_Queue.get()
+        raise   #接続できなければ起動失敗としてmainに伝える
+    if prepareMirror is not None:
+        prepareMirror.set()
+    processSupervisor.notifyReady()
+    while not MirrorAngle_channel.closed:
+        processSupervisor.heartbeat()
+        angle = MirrorAngle_channel.get(timeout=0.5)
+        if angle is None:
+            continue
+        X, Y = angle
         try:
-            changeAngle(X,Y,mre2)
+            with instrumentation.span("apply"):
+                changeAngle(X,Y,mre2)
         except:
             print("mirror angle error")
+            angle = None
+        MirrorAngle_channel.applied(angle)#反映した角度はシミュレーションのカメラが読む
 
 if __name__ == "__main__":
     X=0
@@ -98,7 +222,15 @@ if __name__ == "__main__":
     distance = (150,150)
     intervalX = 0.05/126
     intervalY = 0.05/126
+    isWaveformTest = False  #Trueで遅延確認用の円軌道（1周200点）をコントローラで再生する
     mre2 = setMirror()
+    if isWaveformTest:
+        driver = getDriver(mre2)
+        driver.playWaveform(*circleTrajectory(0.1, 200), sample_rate=500)
+        time.sleep(10)
+        driver.stopWaveform()
+        changeAngle(0,0,mre2)
+        raise SystemExit
     t1 = time.time()
     while((time.time()-t1)<10):
         X += distance[0]*intervalX
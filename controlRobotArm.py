@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
 import time
-from xarm.wrapper import XArmAPI
+try:
+    from xarm.wrapper import XArmAPI
+except ImportError:#xarmがない環境ではシミュレーションのロボットアーム(SYSTEM_SIMULATE=arm)のみ使える
+    XArmAPI = None
 import multiprocessing
 
+import simulation
+import instrumentation
+import processSupervisor
+
 class UseRobotArm:
     def __init__(self,cameraGrabingFinish, isArmMoving):
         self.arm = None
@@ -19,7 +26,10 @@ class UseRobotArm:
         # TODO：Do different processing according to the error code
 
     def connect(self):
-        self.arm = XArmAPI('192.168.1.214')
+        if simulation.isSimulated("arm"):
+            self.arm = simulation.SimulatedArm()
+        else:
+            self.arm = XArmAPI('192.168.1.214')
         self.arm.register_error_warn_changed_callback(self.hangle_err_warn_changed)
         time.sleep(0.5)
 
@@ -55,13 +65,18 @@ class UseRobotArm:
         
         #arm.set_position(x=300, y=0, z=200, roll=180, pitch=0, yaw=0, speed=100, wait=True)
         
-        self.isArmMoving.wait()#controlLDVからロボットを動かす指令が来るまで待機
+        #controlLDVからロボットを動かす指令が来るまで待機、その前にセッションが終了した場合は動かさない
+        while not self.isArmMoving.wait(0.1):
+            if self.cameraGrabingFinish.is_set():
+                return
 
         t_1 = time.time()
-        self.arm.set_position(x=self.x_2, y=-340, z=-500, roll=180, pitch=0, yaw=0, speed=85, wait=True)
+        with instrumentation.span("move"):
+            self.arm.set_position(x=self.x_2, y=-340, z=-500, roll=180, pitch=0, yaw=0, speed=85, wait=True)
         t_2 = time.time()
 
-        self.arm.set_position(x=self.x_1, y=-340, z=-500, roll=180, pitch=0, yaw=0, speed=100, wait=True)
+        with instrumentation.span("return"):
+            self.arm.set_position(x=self.x_1, y=-340, z=-500, roll=180, pitch=0, yaw=0, speed=100, wait=True)
 
         self.isArmMoving.clear()
 
@@ -77,7 +92,10 @@ class UseRobotArm:
         self.close()
 
 def run_robot_process(cameraGrabingFinish, isArmMoving):
+    instrumentation.configure("arm")
     useRobotArm = UseRobotArm(cameraGrabingFinish, isArmMoving)
+    useRobotArm.connect()#初期位置まで動かしてから準備完了を通知する
+    processSupervisor.notifyReady()
     useRobotArm.update()
 
 
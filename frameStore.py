@@ -0,0 +1,111 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+#撮影した画像(グレースケール、全フレーム同じ大きさ)を1つのファイルに無圧縮で連続して保存する
+#mp4への圧縮やPNGへの書き出しを行わないため撮影中でも書き込みが追いつき、再解析時はnp.memmapで読むためデコードも不要
+#
+#ファイル構成:
+#  name.frames : MAGIC(8byte) + JSONヘッダ(空白でHEADER_SIZEまで埋める) + フレーム(frame_count, height, width)
+#  name.index  : 各フレームの撮影時刻(float64, little endian)、フレームと同じ順
+#JSONヘッダにはshape, dtype, frame_count, fpsなどを保存する（frame_countはclose時に書き込む）
+
+MAGIC = b"FRAMES01"
+FRAMES_EXTENSION = ".frames"
+INDEX_EXTENSION = ".index"
+HEADER_SIZE = 4096
+
+
+def framesPath(name):
+    return name if name.endswith(FRAMES_EXTENSION) else name + FRAMES_EXTENSION
+
+def indexPath(name):
+    return framesPath(name)[:-len(FRAMES_EXTENSION)] + INDEX_EXTENSION
+
+
+class FrameStoreWriter:
+    def __init__(self, name, fps=None, **metadata):
+        """
+        name    : 保存先（拡張子なし、.framesと.indexを作る）
+        fps     : 撮影のフレームレート（メタデータとして保存）
+        metadata: JSONにできる任意の値（露光時間、ゲインなど）
+        """
+        self.name = name
+        self.path = framesPath(name)
+        self.header = {"version": 1, "fps": fps, "frame_count": 0}
+        self.header.update(metadata)
+        self.shape = None
+        self.frame_count = 0
+        self.__frames = open(self.path, "wb")
+        self.__index = open(indexPath(name), "wb")
+        self.__frames.write(b"\0" * HEADER_SIZE)#ヘッダはcloseで書き込む
+
+    def write(self, image, timestamp):
+        #カラー画像はグレースケールに変換して保存する
+        if len(image.shape) == 3 and image.shape[2] == 3:
+            image = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+        if self.shape is None:
+            self.shape = image.shape
+            self.dtype = image.dtype
+            self.header["shape"] = list(image.shape)
+            self.header["dtype"] = np.dtype(image.dtype).newbyteorder("<").str
+            self.__writeHeader()#途中で異常終了してもshapeはわかるようにしておく
+        elif image.shape != self.shape:
+            raise ValueError(f"frame shape {image.shape} differs from {self.shape}")
+        np.ascontiguousarray(image, dtype=self.header["dtype"]).tofile(self.__frames)
+        np.array([timestamp], dtype="<f8").tofile(self.__index)
+        self.frame_count += 1
+
+    def __writeHeader(self):
+        header_bytes = json.dumps(self.header, ensure_ascii=False).encode("utf-8")
+        if len(MAGIC) + len(header_bytes) > HEADER_SIZE:
+            raise ValueError("frame store header is too large")
+        position = self.__frames.tell()
+        self.__frames.seek(0)
+        self.__frames.write(MAGIC + header_bytes.ljust(HEADER_SIZE - len(MAGIC), b" "))
+        self.__frames.seek(position)
+
+    def close(self):
+        self.header["frame_count"] = self.frame_count
+        self.__writeHeader()
+        self.__frames.close()
+        self.__index.close()
+        return self.path
+
+
+class FrameStoreReader:
+    #フレームを(frame_count, height, width)の読み込み専用np.memmapとして扱う
+    def __init__(self, name):
+        self.path = framesPath(name)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a frame store")
+            self.header = json.loads(f.read(HEADER_SIZE - len(MAGIC)).decode("utf-8").rstrip(" \0"))
+        self.timestamps = np.fromfile(indexPath(name), dtype="<f8") if os.path.exists(indexPath(name)) else np.empty(0)
+        if "shape" not in self.header:#1フレームも書き込まれていない
+            self.frames = np.empty((0, 0, 0), dtype=np.uint8)
+            return
+        shape = tuple(self.header["shape"])
+        dtype = np.dtype(self.header["dtype"])
+        frame_count = self.header["frame_count"]
+        if frame_count == 0:#closeされずに終了した場合はファイルサイズから求める
+            frame_count = (os.path.getsize(self.path) - HEADER_SIZE) // (dtype.itemsize*int(np.prod(shape)))
+        self.frames = np.memmap(self.path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(frame_count,) + shape)
+
+    @property
+    def fps(self):
+        return self.header.get("fps")
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def iterFrames(self, start=0, stop=None, step=1):
+        #(フレーム番号, 撮影時刻, 画像)を順に返す、画像は読み込み専用のview（描画する場合はコピーすること）
+        for n in range(*slice(start, stop, step).indices(len(self))):
+            timestamp = self.timestamps[n] if n < self.timestamps.size else np.nan
+            yield n, timestamp, self.frames[n]
@@ -88,13 +88,13 @@ def HoughTransform(image):
 
     return image
 
-def changeScale(image):
-    scale = 0.5
+def changeScale(image, scale=0.5):
     height, width = image.shape[0],image.shape[1]
     resized_image = cv2.resize(image,(int(width*scale),int(height*scale)) )
     return resized_image
 
-def createTemplateCircleImage(radius=120):
+def createTemplateCircleImage(radius=120, scale=0.5):
+    #radius: 縮小前の円の半径[pixel]、scale: 撮影画像に掛けるchangeScaleの倍率と揃える
     
     height = int(radius*2)
     width = int(radius*2)
@@ -116,60 +116,81 @@ def createTemplateCircleImage(radius=120):
     #cv2.imwrite('C:/Users/yuto/Downloads'+'/'+'templateimage_new.png',image_template)
     #cv2.waitKey(0)
 
-    image_template = changeScale(image_template)
+    image_template = changeScale(image_template, scale)
 
     return image_template
 
-def TemplateMatching(image, image_template, isPlotMatchpoint=False):
-    to_templateimage_center_y, to_templateimage_center_x = int(image_template.shape[0]/2),int(image_template.shape[1]/2)
-
+def convertGray(image):
     #グレースケールに変換
     if len(image.shape) == 3 and image.shape[2] == 3:
-        image_gray = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
-    else:
-        image_gray = image
-
-    #平均化によるノイズ除去
-    #第一引数で指定したオブジェクトgrayscale_imgを輝度で平均化処理する。第二引数は平均化するピクセル数で、今回の場合は9,9は9x9ピクセルの計81ピクセル
-    #image_average = cv2.blur(image_gray,(9,9)) 
-    image_average = image_gray #平均化いらなくね？処理時間はあってもなくても変わらん
-
-    """
-    #二値化
-    _,image_binary = cv2.threshold(image_average,0,255,cv2.THRESH_BINARY|cv2.THRESH_OTSU)
-    cv2.imshow('image_binary',image_binary)
-    cv2.waitKey(0)
-    """
+        return cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+    return image
 
+def matchRegion(image_gray, image_template, x_start, y_start, x_end, y_end):
+    #image_grayの[y_start:y_end, x_start:x_end]の範囲でテンプレートマッチングを行い、(検出した中心(x,y), 相関係数の最大値)を返す
     #method = cv2.TM_CCORR_NORMED   #正規化相互相関(NCC:Normalized Cross-Correlation)
     method = cv2.TM_CCOEFF_NORMED  #正規化相関係数(ZNCC:Zero-mean Normalized Cross-Correlation)
     # NCCよりもZNCCの方が輝度値の変化に強い
-    
-    height, width = image.shape[0],image.shape[1]
+    image_ROI = image_gray[y_start:y_end,x_start:x_end] #関心領域：ROI(Region of Interest)
+    match_result = cv2.matchTemplate(image_ROI,image_template,method=method)
+    _, max_val, _, max_loc = cv2.minMaxLoc(match_result)
+    match_x, match_y = max_loc
+    match_center = (int(match_x+image_template.shape[1]//2)+x_start, int(match_y+image_template.shape[0]//2)+y_start)#検出した指先位置の中心(x,y)
+    return match_center, max_val
+
+def toPixel(point):
+    #サブピクセル精度の座標(float)を描画用の整数座標に変換する
+    return (int(round(point[0])), int(round(point[1])))
+
+def plotMatchpoint(image, match_center, image_template):
+    #マッチに関する座標やテンプレートイメージの重ね合わせ描画
+    #ここで指定する画像はカラー画像
+    match_center = toPixel(match_center)
+    cv2.circle(image, match_center, int(image_template.shape[1]/2), (0, 255, 0), 1) #緑の縁でテンプレートマッチングした位置を表示
+    cv2.circle(image, match_center, 2, (0, 255, 0), 2)      #緑の点でテンプレートマッチングした最大値の座標を表示
+
+
+class PreparedTemplate:
     """
-    ROI_x_start = 0#int(width*0.25)
-    ROI_x_end = width#int(width*0.75)
-    ROI_y_start = 0#int(height*0.25)
-    ROI_y_end = height#int(height*0.75)
+    書き込み禁止にしたグレースケールのテンプレート画像（getTemplateでキャッシュし、全てのmatcherで共有する）
     """
+    def __init__(self, image, dtype=np.uint8):
+        image = np.ascontiguousarray(convertGray(image), dtype=dtype)
+        image.setflags(write=False)
+        self.image = image
+        self.dtype = image.dtype
+        self.shape = image.shape
+        self.size = image.size
+
+_template_registry = {}
+
+def getTemplate(radius=120, scale=0.5, dtype=np.uint8):
+    #円のテンプレートを(radius, scale, dtype)ごとに一度だけ生成してキャッシュする、2回目以降は生成済みのものを返す
+    #戻り値のPreparedTemplate.imageは書き込み禁止（共有されるため）
+    key = (radius, scale, np.dtype(dtype).str)
+    template = _template_registry.get(key)
+    if template is None:
+        template = PreparedTemplate(createTemplateCircleImage(radius, scale), dtype)
+        _template_registry[key] = template
+    return template
+
+def templateImage(image_template):
+    #PreparedTemplateでも画像の配列でも受け取れるようにする
+    return image_template.image if isinstance(image_template, PreparedTemplate) else image_template
+
+def TemplateMatching(image, image_template, isPlotMatchpoint=False, margin_rate=0.12):
+    #画像全体（上下左右のmargin_rateの割合分を除く）でテンプレートマッチングを行う
+    #margin_rate: 注目領域を制限する、0で制限なし、全体のmargin_rateの割合分の上下左右領域を無視してマッチングする
+    image_template = templateImage(image_template)
+    image_gray = convertGray(image)
+    #平均化によるノイズ除去は処理時間はあってもなくても変わらないため行わない
 
-    margin_rate = 0.12#注目領域を制限する、0で制限なし、全体のmargin_rateの割合分の上下左右領域を無視してマッチングする
-    #margin_rate = 0
-
+    height, width = image.shape[0],image.shape[1]
     ROI_x_start = int(width*margin_rate)
     ROI_x_end = int(width*(1-margin_rate))
     ROI_y_start = int(height*margin_rate)
     ROI_y_end = int(height*(1-margin_rate))
-
-    image_ROI = image_average[ROI_y_start:ROI_y_end,ROI_x_start:ROI_x_end] #関心領域：ROI(Region of Interest)
-    match_result = cv2.matchTemplate(image_ROI,image_template,method=method)
-    match_point = np.argwhere(match_result == match_result.max())
-    #print("match_point",match_point)
-
-    match_y = match_point[0][0]
-    match_x = match_point[0][1]
-
-    match_center = (int(match_x+to_templateimage_center_x)+ROI_x_start, int(match_y+to_templateimage_center_y)+ROI_y_start)#検出した指先位置の中心(x,y)
+    match_center, _ = matchRegion(image_gray, image_template, ROI_x_start, ROI_y_start, ROI_x_end, ROI_y_end)
 
     """
     #テンプレートマッチングした最大値の位置ではきれいに指先中心に一致しなかったため処理を追加した
@@ -186,60 +207,243 @@ def TemplateMatching(image, image_template, isPlotMatchpoint=False):
     match = (int((match_center[0]+center[0])/2), int((match_center[1]+center[1])/2))
     """
 
-    #マッチに関する座標やテンプレートイメージの重ね合わせ描画
-    #ここで指定する画像はカラー画像
     if(isPlotMatchpoint):
-        cv2.circle(image, match_center, to_templateimage_center_x, (0, 255, 0), 1) #緑の縁でテンプレートマッチングした位置を表示
-        cv2.circle(image, match_center, 2, (0, 255, 0), 2)      #緑の点でテンプレートマッチングした最大値の座標を表示
-        #cv2.circle(image, center, 2, (255, 0, 0), 2)            #青い点でテンプレートマッチングした閾値以上の点の重心を表示
+        plotMatchpoint(image, match_center, image_template)
     
     return image, match_center
 
 
-def calculateCentor2FingerDistance(image, image_template, laser_point, isPlotMatchpoint=False):
-    image, match_center = TemplateMatching(image, image_template, isPlotMatchpoint)
+class TemplateTracker:
+    """
+    前回のマッチ位置を覚えておき、予測位置の周りの小さな窓だけでテンプレートマッチングを行う
+    指先は1フレーム(約2ms)の間に数ピクセルしか動かないため、画像全体を探索するより一桁以上速い
+    相関係数がmin_confidence未満（見失った、急に動いた）の場合は画像全体で探索し直す
 
-    #height, width = image.shape[0],image.shape[1]
+    TemplateMatchingと同じ呼び出し方(image, image_template, isPlotMatchpoint)ができるため、
+    calculateCentor2FingerDistanceのmatcherとして渡す
+    """
+    def __init__(self, image_template, search_margin=12, max_margin=64, min_confidence=0.5, margin_rate=0.12, fallback=None):
+        """
+        image_template: テンプレート画像（グレースケール）
+        search_margin : 予測位置の周りに探索する最小の幅[pixel]（テンプレートの端から）
+        max_margin    : 探索する幅の上限[pixel]、指先の速度に応じてsearch_marginからmax_marginの間で変える
+        min_confidence: 窓内の相関係数の最大値がこれ未満の場合は画像全体で探索する
+        margin_rate   : 画像全体で探索する時に無視する上下左右の割合（TemplateMatchingと同じ）
+        fallback      : 画像全体の探索に使うマッチャー（match(image_gray)を持つもの、PyramidMatcherなど）、Noneなら1段の全探索
+        """
+        self.image_template = templateImage(image_template)
+        self.fallback = fallback
+        self.search_margin = search_margin
+        self.max_margin = max_margin
+        self.min_confidence = min_confidence
+        self.margin_rate = margin_rate
+        self.reset()
+
+    def reset(self):
+        self.last_center = None
+        self.velocity = (0, 0)             #前フレームからの移動量[pixel/frame]
+        self.margin = self.search_margin
+        self.last_score = 0.0
+        self.local_searches = 0
+        self.full_searches = 0
+
+    def fullSearch(self, image_gray):
+        self.full_searches += 1
+        if self.fallback is not None:
+            match_center, score = self.fallback.match(image_gray)
+            return toPixel(match_center), score
+        height, width = image_gray.shape[0],image_gray.shape[1]
+        return matchRegion(image_gray, self.image_template,
+                           int(width*self.margin_rate), int(height*self.margin_rate),
+                           int(width*(1-self.margin_rate)), int(height*(1-self.margin_rate)))
+
+    def localSearch(self, image_gray, predicted):
+        #予測位置を中心に(テンプレート+2*margin)の窓で探索する、窓が画像全体の探索範囲からはみ出す部分は切り詰める
+        self.local_searches += 1
+        height, width = image_gray.shape[0],image_gray.shape[1]
+        template_h, template_w = self.image_template.shape[0],self.image_template.shape[1]
+        x_start = max(int(width*self.margin_rate), predicted[0] - template_w//2 - self.margin)
+        y_start = max(int(height*self.margin_rate), predicted[1] - template_h//2 - self.margin)
+        x_end = min(int(width*(1-self.margin_rate)), predicted[0] + (template_w - template_w//2) + self.margin)
+        y_end = min(int(height*(1-self.margin_rate)), predicted[1] + (template_h - template_h//2) + self.margin)
+        if x_end - x_start < template_w or y_end - y_start < template_h:
+            return None, 0.0
+        return matchRegion(image_gray, self.image_template, x_start, y_start, x_end, y_end)
+
+    def match(self, image_gray):
+        #(検出した中心(x,y), 相関係数)を返す
+        if self.last_center is None:
+            match_center, score = self.fullSearch(image_gray)
+        else:
+            predicted = (self.last_center[0] + self.velocity[0], self.last_center[1] + self.velocity[1])
+            match_center, score = self.localSearch(image_gray, predicted)
+            if score < self.min_confidence:
+                match_center, score = self.fullSearch(image_gray)
+
+        if self.last_center is not None:
+            self.velocity = (match_center[0] - self.last_center[0], match_center[1] - self.last_center[1])
+        #速く動いている時ほど探索する幅を広げる
+        speed = max(abs(self.velocity[0]), abs(self.velocity[1]))
+        self.margin = int(min(self.max_margin, self.search_margin + 2*speed))
+        self.last_center = match_center
+        self.last_score = score
+        return match_center, score
+
+    def __call__(self, image, image_template=None, isPlotMatchpoint=False):
+        #image_templateは呼び出し方をTemplateMatchingと揃えるためのもので、使わない（生成時のテンプレートを使う）
+        match_center, _ = self.match(convertGray(image))
+        if(isPlotMatchpoint):
+            plotMatchpoint(image, match_center, self.image_template)
+        return image, match_center
+
+
+def subpixelPeak(match_result, max_loc):
+    #相関係数の最大値とその左右（上下）の3点に放物線を当てはめ、頂点の位置をサブピクセル精度で求める
+    x, y = max_loc
+    offset = [0.0, 0.0]
+    for axis, (before, after) in enumerate((((y, x-1), (y, x+1)), ((y-1, x), (y+1, x)))):
+        if min(before) < 0 or after[0] >= match_result.shape[0] or after[1] >= match_result.shape[1]:
+            continue
+        left, center, right = match_result[before], match_result[y, x], match_result[after]
+        denominator = left - 2*center + right
+        if denominator < 0:
+            offset[axis] = 0.5*(left - right)/denominator
+    return x + offset[0], y + offset[1]
+
+
+class PyramidMatcher:
+    """
+    画像ピラミッドによる粗密探索
+    1/2**levelsに縮小した画像全体で大まかな位置を探し、1段ずつ解像度を上げながら前の段の位置の周り(±refine_margin)だけを探索する
+    全探索より速く、subpixel=Trueなら相関係数のピークに放物線を当てはめてサブピクセル精度の位置を返す
 
-    #print(f"laser_center is {laser_center}")
+    TemplateMatchingと同じ呼び出し方ができ、TemplateTrackerのfallbackにも使える
+    """
+    def __init__(self, image_template, levels=2, refine_margin=3, subpixel=True, margin_rate=0.12):
+        """
+        image_template: テンプレート画像（グレースケール、撮影画像と同じ縮尺）
+        levels        : 縮小の段数（2: 1/4、3: 1/8から探索する）
+        refine_margin : 1段細かくする時に探索する範囲[pixel]（その段の解像度で）
+        subpixel      : 最も細かい段でサブピクセル推定を行うか
+        margin_rate   : 画像全体で探索する時に無視する上下左右の割合（TemplateMatchingと同じ）
+        """
+        image_template = templateImage(image_template)
+        self.image_template = image_template
+        self.levels = levels
+        self.refine_margin = refine_margin
+        self.subpixel = subpixel
+        self.margin_rate = margin_rate
+        self.method = cv2.TM_CCOEFF_NORMED
+        self.templates = [image_template]#templates[level]が1/2**levelのテンプレート
+        for _ in range(levels):
+            self.templates.append(cv2.pyrDown(self.templates[-1]))
+
+    def __ROI(self, image):
+        height, width = image.shape[0],image.shape[1]
+        return (int(width*self.margin_rate), int(height*self.margin_rate),
+                int(width*(1-self.margin_rate)), int(height*(1-self.margin_rate)))
+
+    def __search(self, image, template, x_start, y_start, x_end, y_end):
+        match_result = cv2.matchTemplate(image[y_start:y_end,x_start:x_end], template, method=self.method)
+        _, max_val, _, max_loc = cv2.minMaxLoc(match_result)
+        return match_result, max_val, max_loc
+
+    def match(self, image_gray):
+        #(検出した中心(x,y), 相関係数)を返す、subpixel=Trueの場合の座標はfloat
+        pyramid = [image_gray]
+        for _ in range(self.levels):
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+
+        #最も粗い段で全体を探索
+        x_start, y_start, x_end, y_end = self.__ROI(pyramid[-1])
+        match_result, score, max_loc = self.__search(pyramid[-1], self.templates[-1], x_start, y_start, x_end, y_end)
+        top_left = (max_loc[0]+x_start, max_loc[1]+y_start)
+
+        #1段ずつ細かくして、前の段の位置の周りだけを探索
+        for level in range(self.levels-1, -1, -1):
+            image, template = pyramid[level], self.templates[level]
+            template_h, template_w = template.shape[0],template.shape[1]
+            roi = self.__ROI(image)
+            x_start = max(roi[0], top_left[0]*2 - self.refine_margin)
+            y_start = max(roi[1], top_left[1]*2 - self.refine_margin)
+            x_end = min(roi[2], top_left[0]*2 + template_w + self.refine_margin)
+            y_end = min(roi[3], top_left[1]*2 + template_h + self.refine_margin)
+            if x_end - x_start < template_w or y_end - y_start < template_h:
+                x_start, y_start, x_end, y_end = roi#探索範囲の端で窓が作れない場合はその段全体を探索する
+            match_result, score, max_loc = self.__search(image, template, x_start, y_start, x_end, y_end)
+            top_left = (max_loc[0]+x_start, max_loc[1]+y_start)
+
+        template_h, template_w = self.image_template.shape[0],self.image_template.shape[1]
+        if self.subpixel:
+            peak_x, peak_y = subpixelPeak(match_result, max_loc)
+            return (peak_x+x_start+template_w//2, peak_y+y_start+template_h//2), score
+        return (top_left[0]+template_w//2, top_left[1]+template_h//2), score
+
+    def __call__(self, image, image_template=None, isPlotMatchpoint=False):
+        match_center, _ = self.match(convertGray(image))
+        if(isPlotMatchpoint):
+            plotMatchpoint(image, match_center, self.image_template)
+        return image, match_center
+
+
+def createMatcher(method, image_template, **kwargs):
+    """
+    calculateCentor2FingerDistanceに渡すmatcherを作成する
+    method: "full"            画像全体を1段で探索（TemplateMatching、従来の方法）
+            "pyramid"         画像ピラミッドによる粗密探索（PyramidMatcher）
+            "tracker"         前回の位置の周りを探索し、見失ったら1段の全探索（TemplateTracker）
+            "pyramid_tracker" 前回の位置の周りを探索し、見失ったらピラミッドで探索
+    kwargs: 各クラスの引数
+    """
+    if method == "full":
+        return TemplateMatching
+    if method == "pyramid":
+        return PyramidMatcher(image_template, **kwargs)
+    if method == "tracker":
+        return TemplateTracker(image_template, **kwargs)
+    if method == "pyramid_tracker":
+        return TemplateTracker(image_template, fallback=PyramidMatcher(image_template), **kwargs)
+    raise ValueError(f"unknown matcher: {method}")
+
+
+def calculateCentor2FingerDistance(image, image_template, laser_point, isPlotMatchpoint=False, matcher=None):
+    #matcher: TemplateMatchingと同じ引数で呼び出せるマッチング関数（TemplateTracker、PyramidMatcherなど、createMatcherで作成する）
+    #         NoneならTemplateMatching
+    if matcher is None:
+        matcher = TemplateMatching
+    image, match_center = matcher(image, image_template, isPlotMatchpoint)
 
     distance = (match_center[0]-laser_point[0], match_center[1]-laser_point[1])
 
     if(isPlotMatchpoint):
         #cv2.line(image,match_center,laser_center,(255,255,255),2)
-        cv2.arrowedLine(image,laser_point,match_center,(255,255,255),2)
+        cv2.arrowedLine(image,laser_point,toPixel(match_center),(255,255,255),2)
         cv2.circle(image, laser_point, 3, (0, 0, 255), -2)            #cv2.circle(入力画像, centor, radius, color, thickness)
-        cv2.circle(image, match_center, 2, (255, 255, 255), -2)        #白い点で
+        cv2.circle(image, toPixel(match_center), 2, (255, 255, 255), -2)        #白い点で
 
     return image,distance
 
-def calculateLaserPoint(file_name):
-    image = cv2.imread(file_name, cv2.IMREAD_COLOR)
-    image_gray = cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
-
+def detectLaserPoint(image, scale=0.5, threshold=10, min_brightness=0, subpixel=False):
+    #画像中のレーザの照射位置（最も明るい点の周りで、最大輝度-threshold以上の画素の重心）をchangeScale後の座標で返す
+    #最大輝度がmin_brightness未満の場合（レーザが写っていない）はNone
+    #subpixel=Trueなら重心をfloatのまま返す
+    image_gray = convertGray(image)
     min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(image_gray)
-    """
-    _,image_binary = cv2.threshold(image_gray,0,255,cv2.THRESH_BINARY|cv2.THRESH_OTSU)
-    image_binary = changeScale(image_binary) 
-    
-    y_indices, x_indices = np.where(image_binary == 255)
-    """
-    image_gray = changeScale(image_gray) 
-    
-    y_indices, x_indices = np.where(image_gray >= max_val-10)
+    if max_val < min_brightness:
+        return None
+    image_gray = changeScale(image_gray, scale)
+    y_indices, x_indices = np.where(image_gray >= max_val-threshold)
+    if x_indices.size == 0:#縮小で最大輝度の点が平均化されて消えた場合
+        return None
     center_x = np.mean(x_indices)
     center_y = np.mean(y_indices)
-    center = (int(center_x), int(center_y))
-    
-    #cv2.circle(image, max_loc, 2, (0, 255, 0), 2)#ここで指定する画像はカラー画像
-    #cv2.imshow('image',image)
-    #cv2.waitKey(0)
-
-    #cv2.circle(image, center, 2, (0, 0, 255), 2)
-    #cv2.imshow('image',image)
-    #cv2.waitKey(0)
+    if subpixel:
+        return (float(center_x), float(center_y))
+    return (int(center_x), int(center_y))
 
-    #print(f"laser_point is {max_loc}")
+def calculateLaserPoint(file_name):
+    image = cv2.imread(file_name, cv2.IMREAD_COLOR)
+    center = detectLaserPoint(image)
     print(f"center is {center}")
     return center
 
@@ -261,7 +465,7 @@ if __name__ == "__main__":
     image = changeScale(image)
 
     radius = 120    
-    image_template = createTemplateCircleImage(radius)
+    image_template = getTemplate(radius)
 
     image,distance = calculateCentor2FingerDistance(image,  image_template, laser_point, isPlotMatchpoint=True)
 
@@ -0,0 +1,247 @@
+import os
+import glob
+import json
+import threading
+import collections
+import multiprocessing
+from multiprocessing import util
+
+import numpy as np
+
+import sessionClock
+
+#全プロセス（カメラ、ミラー、LDV、ロボットアーム、GUI、メイン）の処理時間を1つの時系列にまとめるための計測
+#各プロセスは区間(span)、カウンタ(counter)、時点(instant)を自プロセスのリングバッファに記録し、
+#別スレッドが一定間隔でファイル(SYSTEM_TRACEのディレクトリ/プロセス名_pid.events)に追記する
+#（terminateで終了させられたプロセスでも直前のflushまでは残る）
+#collectで全プロセスのファイルを読み、Chromeのトレース形式(chrome://tracing、Perfetto)のJSONにまとめる
+#
+#環境変数SYSTEM_TRACEに保存先のディレクトリを指定した時だけ有効（子プロセスにも引き継がれる）
+#無効の時、spanは何もしない共通のオブジェクトを返し、counter/instantはすぐ戻るため、計測を残したままでも処理時間はほぼ変わらない
+#
+#時刻はsessionClock.now_ns()（全プロセスで共通の時計、SessionIndexの記録とそのまま突き合わせられる）
+#
+#使い方:
+#  instrumentation.configure("camera")        #プロセスの最初で1回
+#  with instrumentation.span("match"):
+#      ...
+#  instrumentation.counter("queue", n)
+#  instrumentation.collect()                  #メインプロセスで最後に、trace.jsonを作る
+
+TRACE_ENV = "SYSTEM_TRACE"
+FLUSH_INTERVAL_S = 1.0
+RING_CAPACITY = 2**18       #flushの間に記録できるイベント数、超えた分は古いものから捨てる
+
+_SPAN, _COUNTER, _INSTANT = 0, 1, 2
+_EVENT_DTYPE = np.dtype([("t_ns", "<i8"), ("duration_ns", "<i8"), ("value", "<f8"),
+                         ("name", "<i4"), ("thread", "<i4"), ("kind", "u1")])
+
+_enabled = False
+_pid = None
+_directory = None
+_process_name = None
+_events = collections.deque(maxlen=RING_CAPACITY)  #(時刻, 長さ, 値, 名前, スレッド, 種類)
+_recorded = 0
+_flushed = 0
+_names = {}
+_threads = {}
+_flush_lock = threading.Lock()
+_flush_thread = None
+_stop = threading.Event()
+
+
+def enabled():
+    return _enabled
+
+
+def configure(process_name=None, directory=None):
+    """
+    このプロセスの計測を開始する（directoryもSYSTEM_TRACEもなければ何もしない）
+    process_name: トレースに表示するプロセス名（Noneならmultiprocessingのプロセス名）
+    directory   : 保存先、Noneなら環境変数SYSTEM_TRACE
+    """
+    global _enabled, _pid, _directory, _process_name, _flush_thread, _recorded, _flushed
+    directory = directory or os.environ.get(TRACE_ENV)
+    if not directory:
+        return False
+    if _enabled and _pid == os.getpid():#既に設定済み（同じプロセス内でワーカーの初期化を呼んだ場合など）
+        return True
+    if _pid != os.getpid():#forkで親プロセスの記録と(動いていない)flushスレッドを引き継いだ場合は初めからにする
+        _pid = os.getpid()
+        _events.clear()
+        _names.clear()
+        _threads.clear()
+        _recorded = _flushed = 0
+        _flush_thread = None
+    os.makedirs(directory, exist_ok=True)
+    os.environ[TRACE_ENV] = directory   #これから起動する子プロセスも同じディレクトリに記録する
+    _directory = directory
+    _process_name = process_name or multiprocessing.current_process().name
+    _enabled = True
+    if _flush_thread is None:
+        _stop.clear()
+        _flush_thread = threading.Thread(target=_flushLoop, name="trace-flush", daemon=True)
+        _flush_thread.start()
+        #atexitは子プロセスの終了時に呼ばれないため、multiprocessingの終了処理に登録する（メインプロセスでも呼ばれる）
+        util.Finalize(None, shutdown, exitpriority=100)
+    return True
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = sessionClock.now_ns()
+        return self
+
+    def __exit__(self, *exc):
+        global _recorded
+        end = sessionClock.now_ns()
+        _events.append((self.start, end - self.start, 0.0, self.name, threading.get_ident(), _SPAN))
+        _recorded += 1
+        return False
+
+
+def span(name):
+    #with span(name): の区間の時間を記録する
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def complete(name, start_s, duration_s):
+    #time.perf_counter()（sessionClock.now()）で測った区間を記録する（StageTimerなど、既に時間を測っている所から呼ぶ）
+    global _recorded
+    if not _enabled:
+        return
+    _events.append((int(start_s*1e9), int(duration_s*1e9), 0.0, name, threading.get_ident(), _SPAN))
+    _recorded += 1
+
+
+def counter(name, value):
+    #時刻ごとの値（キューの長さ、フレーム数など）
+    global _recorded
+    if not _enabled:
+        return
+    _events.append((sessionClock.now_ns(), 0, float(value), name, threading.get_ident(), _COUNTER))
+    _recorded += 1
+
+
+def instant(name):
+    #一時点の出来事（ボタンの操作、終了の合図など）
+    global _recorded
+    if not _enabled:
+        return
+    _events.append((sessionClock.now_ns(), 0, 0.0, name, threading.get_ident(), _INSTANT))
+    _recorded += 1
+
+
+def _basePath():
+    return os.path.join(_directory, f"{_process_name}_{os.getpid()}")
+
+
+def flush():
+    #リングバッファのイベントをファイルに追記する
+    global _flushed
+    if _directory is None:
+        return
+    with _flush_lock:
+        rows = []
+        while True:
+            try:
+                t_ns, duration_ns, value, name, thread, kind = _events.popleft()
+            except IndexError:
+                break
+            name_id = _names.setdefault(name, len(_names))
+            thread_id = _threads.setdefault(thread, len(_threads))
+            rows.append((t_ns, duration_ns, value, name_id, thread_id, kind))
+        if rows:
+            with open(_basePath() + ".events", "ab") as f:
+                np.array(rows, dtype=_EVENT_DTYPE).tofile(f)
+        _flushed += len(rows)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        info = {"process": _process_name, "pid": os.getpid(),
+                "names": sorted(_names, key=_names.get),
+                "threads": [thread_names.get(ident, str(ident)) for ident in sorted(_threads, key=_threads.get)],
+                "recorded": _recorded, "dropped": _recorded - _flushed - len(_events)}
+        with open(_basePath() + ".json", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+
+
+def _flushLoop():
+    while not _stop.wait(FLUSH_INTERVAL_S):
+        try:
+            flush()
+        except Exception as e:
+            print(f"trace flush error: {e}")
+
+
+def shutdown():
+    #計測を止めて残りを書き出す（プロセスの終了時にも呼ばれる）
+    global _enabled, _flush_thread
+    _stop.set()
+    if _flush_thread is not None and _flush_thread is not threading.current_thread():
+        _flush_thread.join()
+    _flush_thread = None
+    flush()
+    _enabled = False
+
+
+def collect(directory=None, output=None):
+    """
+    directory内の全プロセスの記録をChromeのトレース形式のJSONにまとめる
+    output: 保存先、Noneならdirectory/trace.json
+    戻り値: 保存先（記録がなければNone）
+    """
+    directory = directory or _directory or os.environ.get(TRACE_ENV)
+    if not directory:
+        return None
+    if _enabled:
+        flush()
+    output = output or os.path.join(directory, "trace.json")
+    processes = []
+    for info_path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        events_path = info_path[:-len(".json")] + ".events"
+        if not os.path.exists(events_path):
+            continue
+        with open(info_path, encoding="utf-8") as f:
+            info = json.load(f)
+        processes.append((info, np.fromfile(events_path, dtype=_EVENT_DTYPE)))
+    if not processes:
+        return None
+    t0 = min(int(events["t_ns"].min()) for _, events in processes if events.size)
+    trace = []
+    for info, events in processes:
+        pid = info["pid"]
+        trace.append({"ph": "M", "name": "process_name", "pid": pid, "args": {"name": info["process"]}})
+        for tid, thread_name in enumerate(info["threads"]):
+            trace.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+        if info.get("dropped"):
+            print(f"{info['process']}: {info['dropped']} trace events dropped (ring buffer full)")
+        names = info["names"]
+        for t_ns, duration_ns, value, name, thread, kind in events.tolist():
+            event = {"name": names[name], "pid": pid, "tid": thread, "ts": (t_ns - t0)/1000}
+            if kind == _SPAN:
+                event.update(ph="X", dur=duration_ns/1000)
+            elif kind == _COUNTER:
+                event.update(ph="C", args={"value": value})
+            else:
+                event.update(ph="i", s="t")
+            trace.append(event)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    print(f"trace: {sum(events.size for _, events in processes)} events from {len(processes)} processes -> {output}")
+    return output
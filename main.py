@@ -5,18 +5,18 @@ import controlCamera
 import controlLDV
 import sharedFlag
 import controlGUI
-import signalProcessing
 import controlMirror
 import controlRobotArm
+import captureStore
+import postProcessing
+import mirrorChannel
+import simulation
+import instrumentation
+import sessionClock
+import processSupervisor
 
 import sys
 import datetime
-import numpy as np
-from scipy import integrate
-
-import matplotlib.pyplot as plt
-
-import time
 
 #import threading
 import multiprocessing
@@ -38,7 +38,10 @@ def run():
     rootDir = 'C:/Users/yuto/Documents/system_python'
     laserImage = 'Image__2025-11-13__16-05-34.png'
 
-    laser_point = imageProcessing.calculateLaserPoint(rootDir+'/'+laserImage)
+    if simulation.isSimulated("camera"):
+        laser_point = simulation.laserPoint()#シミュレーションのカメラでは画像の中心
+    else:
+        laser_point = imageProcessing.calculateLaserPoint(rootDir+'/'+laserImage)
 
     input('start')
     
@@ -78,110 +81,100 @@ def run_endless():
     new_bandwidth="100 kHz" #[bandwidth_selection] Available items: 100 kHz, 50 kHz, 25 kHz, 10 kHz, 5 kHz, 1 kHz
     new_range="200 mm/s"    #[range_selection]     Available items: 2 m/s, 1 m/s, 500mm/s, 200 mm/s, 100 mm/s, 50 mm/s, 20 mm/s, 10 mm/s
     isPlotMatchpoint=False
+    isContinuousLDV=False   #Trueでリングバッファを止めずに隙間なく計測する（計測間のデッドタイムなし）
     rootDir = 'C:/Users/yuto/Documents/system_python'
     laserImage = 'Image__2026-04-27__14-10-10.png'
-    laser_point = imageProcessing.calculateLaserPoint(rootDir+'/'+laserImage)
-
-
-    startLDV = multiprocessing.Event()           #LDVの計測を開始させるフラグ、カメラ追従が起動したらsetする
-    cameraGrabingFinish = multiprocessing.Event()#カメラの連続撮影が終了したかどうかのフラグ
-    prepareMirror = multiprocessing.Event()      #ミラーが追従開始位置にセットされたかどうかのフラグ
+    if simulation.isSimulated("camera"):
+        laser_point = simulation.laserPoint()#シミュレーションのカメラでは画像の中心
+    else:
+        laser_point = imageProcessing.calculateLaserPoint(rootDir+'/'+laserImage)
+    instrumentation.configure("main")#SYSTEM_TRACEを設定した場合のみ、全プロセスの処理時間を記録する
+    #フレーム・ミラーへの指令・LDVの計測に付ける共通の時計の起点（子プロセスを起動する前に設定する）
+    #各プロセスの索引はsession_dirに保存され、sessionClock.SessionIndex.loadSession(session_dir)で時刻により突き合わせられる
+    session_dir = rootDir + '/data/session/' + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    sessionClock.startSession(session_dir)
+
+
+    startLDV = multiprocessing.Event()           #LDVの計測を開始させるフラグ、カメラの撮影が始まったらsetする
+    cameraGrabingFinish = multiprocessing.Event()#セッションの終了の合図（GUIの終了ボタン、カメラの時間切れ、supervisorの終了処理でset）
     isArmMoving = multiprocessing.Event()        #ロボットアームが動いている間はsetするフラグ、ロボットが動いていない時はclearする
 
     prepareLaserPosition = multiprocessing.Queue(maxsize=1)#開始前にGUIで設定したミラーの角度（レーザの位置）を共有するためのqueue
 
-    MirrorAngle_queue = multiprocessing.Queue(maxsize=1)
-    lastdata_queue = multiprocessing.Queue(maxsize=1)#共有のQueueを作成、できるならshared_memoryの方がよい
+    MirrorAngle_channel = mirrorChannel.MirrorCommandChannel()#ミラーの目標角度、最新の値だけを保持し、反映されなかった古い角度は捨てる
+    #LDVの計測データは計測ごとにshared_memory上のスロットへ書き込まれ、メインプロセスはコピーなしで読む
+    capture_slot_count = int(timelimit_s/(sample_count*dt)) + 2 #1回の計測はsample_count*dt秒以上かかるため、これで全計測分を保持できる
+    capture_store = captureStore.SharedCaptureStore(capture_slot_count, sample_count)
+
+    dataAquisition = controlLDV.UseLDV(cameraGrabingFinish,sample_count,new_bandwidth,new_range,capture_store,isArmMoving,continuous=isContinuousLDV,startFlag=startLDV)
+    buttonWindow = controlGUI.ButtonWindow(MirrorAngle_channel,prepareLaserPosition,cameraGrabingFinish)
+
+    #ミラー・ロボットアーム・LDVは互いに依存しないため同時に接続・設定し、GUIとカメラはミラーの準備完了後に起動する
+    #（GUIの操作とカメラの指令をミラーに反映するため。ミラーに接続するのはミラーのプロセスだけ）
+    #LDVは接続と設定を済ませて待機し、カメラの撮影開始(startLDV)で計測を始める
+    #セッションはカメラの終了（終了ボタン、時間切れ）かGUIの終了で終わり、終了処理は
+    #  cameraGrabingFinishをset → GUI、カメラ(録画の書き出しを待つ) → LDV → ロボットアーム → ミラー(最後の(0,0)を反映してから)
+    #の順に行い、時間内に終わらないプロセスはterminateする
+    specs = [
+        processSupervisor.ProcessSpec("mirror", controlMirror.mirror_server, (MirrorAngle_channel,),
+                                      notifies_ready=True, ready_timeout_s=15, heartbeat_timeout_s=5,
+                                      stop=MirrorAngle_channel.close, stop_timeout_s=2, stop_order=3),
+        processSupervisor.ProcessSpec("arm", controlRobotArm.run_robot_process, (cameraGrabingFinish, isArmMoving),
+                                      notifies_ready=True, ready_timeout_s=60, stop_timeout_s=60, stop_order=2,
+                                      required=False),#アームが止まっても追従とLDVの計測は続ける
+        processSupervisor.ProcessSpec("ldv", dataAquisition.animate,
+                                      notifies_ready=True, ready_timeout_s=60, stop_timeout_s=30, stop_order=1),
+        processSupervisor.ProcessSpec("gui", buttonWindow.run, after=("mirror",),
+                                      required=False, ends_session=True, stop_timeout_s=0, stop_order=0),
+        processSupervisor.ProcessSpec("camera", controlCamera.getCameraImage_endless,
+                                      (MirrorAngle_channel,prepareLaserPosition,startLDV, cameraGrabingFinish, laser_point,timeout_ms,timelimit_s,isPlotMatchpoint),
+                                      after=("mirror",), ends_session=True, stop_timeout_s=120, stop_order=0),
+    ]
+    supervisor = processSupervisor.ProcessSupervisor(specs, shutdown=cameraGrabingFinish.set)
 
     try:
-        dataAquisition = controlLDV.UseLDV(cameraGrabingFinish,sample_count,new_bandwidth,new_range,lastdata_queue,isArmMoving)
-        dataAquisition_process=multiprocessing.Process(target=dataAquisition.animate, args=())
-
-        useRobotArm_process = multiprocessing.Process(target=controlRobotArm.run_robot_process, args= (cameraGrabingFinish, isArmMoving))
-
-        buttonWindow = controlGUI.ButtonWindow(MirrorAngle_queue,prepareLaserPosition,cameraGrabingFinish)
-        button_process = multiprocessing.Process(target=buttonWindow.run,args=())
-        
-        controlMirror_process = multiprocessing.Process(target=controlMirror.mirror_server,args=(MirrorAngle_queue, prepareMirror))
-
-        controlCamera_process = multiprocessing.Process(target=controlCamera.getCameraImage_endless, args=(MirrorAngle_queue,prepareLaserPosition,startLDV, cameraGrabingFinish, laser_point,timeout_ms,timelimit_s,isPlotMatchpoint))
-        
-        #buttonの子プロセスでミラーの初期位置を設定しようとしていたが、
-        # 2つの子プロセスで同時にミラー（ハードウェア）に接続しようとするとエラーが発生し、片方を初期設定後に切断できなかったため、
-        # メインプロセスから2つのプロセス（カメラとGUI）を実行するのではなく、GUIを子プロセスではなく、カメラプロセス内でimportして
-        # カメラプロセス（頻繁に高速でミラー制御を行う方のプロセス）内でGUI（ボタン）を表示するclassを実行するように変更した
-        useRobotArm_process.start()
-        controlMirror_process.start()
-        prepareMirror.wait()#ミラーの接続が確立されるまで待機
-
-        button_process.start()
-        
-        controlCamera_process.start()
-
-        #現状：計測を開始する合図はカメラが起動する直前である。カメラ起動前にGUIが表示される
-        #GUIによってカメラ起動（計測開始:startLDV.set()）する前に「終了」すると、
-        # この下の「startLDV.wait()」は永遠にset()されないEventを待機し続けるため、終了操作を行えない
-
-        startLDV.wait()#カメラが起動するまで待機
-        
-        dataAquisition_process.start()
-        
-        cameraGrabingFinish.wait()
-        print("cameraGrabingFinishFlag is set")
-
-        #下のQueueを受け取る部分もデータがあること前提であるため、
-        # 計測開始前に終了するなどのデータがないことを想定した動作が必要
-        acquired_data = lastdata_queue.get()#データを受け取るまで次の行に進まない
+        aborted = None
+        try:
+            with supervisor:
+                supervisor.start()
+                supervisor.wait()
+        except processSupervisor.SupervisorError as e:
+            #途中で終わったセッションでも、共有メモリに書き込み済みの計測は保存・解析する
+            aborted = e
+            print(f"session aborted: {e} (saving the captures acquired so far)")
+        finally:
+            supervisor.report()
+            MirrorAngle_channel.report()
+
+        #計測が1回もなくても(0, sample_count)の配列になるため、以下の処理はそのまま動く
+        acquired_data = capture_store.captures()#共有メモリのview（コピーなし）
+        session = sessionClock.SessionIndex.loadSession(session_dir)
+        print("session index: " + ", ".join(f"{stream} {session.count(stream)}" for stream in session.streams()))
         num_data_chunk = acquired_data.shape[0]
         num_one_data = acquired_data.shape[1]
         print(f"num_data_chunck = {num_data_chunk}")
         print(f"num_one_data = {num_one_data}")
-
-        #print(x)
-        #print(y)
-
-        button_process.terminate()
-        button_process.join()
-        controlMirror_process.terminate()
-        controlMirror_process.join()
-        useRobotArm_process.terminate()
-        useRobotArm_process.join()
-        while controlCamera_process.is_alive():
-            print("creating video")
-            time.sleep(1)
-        controlCamera_process.join()
-
-        while dataAquisition_process.is_alive():
-            print("creating queue")
-            time.sleep(1)
-        dataAquisition_process.join()#メインプロセスに終わったことを通知する（メインプロセスに合流する）
         
         rootDir = 'C:/Users/yuto/Documents/system_python/data/LDVdata'
         now = datetime.datetime.now()
         name = now.strftime("%Y%m%d_%H%M")
-        x = np.linspace(0,dt*sample_count,sample_count)
-        chunk=1
-        for chunk_data in acquired_data:
-            file_name = rootDir + '/' + name + f'_{chunk}'
-            file_name_velocity = rootDir + '/' + name + '_velocity' +f'_{chunk}'
-            y = chunk_data
-            displacement_list = integrate.cumulative_trapezoid(y, dx=dt,initial=0 )
-            np.savetxt(file_name+'.txt', displacement_list,fmt='%s')
-            np.savetxt(file_name_velocity+'.txt',y,fmt='%s')
-            fig= plt.figure()
-            plt.xlabel('time [s]')
-            plt.ylabel('Displacement [m]')
-            plt.xlim(0,sample_count*dt+0.01)
-            #plt.ylim(-0.0007,0.0007)
-            #plt.tight_layout()
-            plt.plot(x,y)
-            plt.savefig(file_name+'.png')
-            window_length = 2**15
-            signalProcessing.STFT(sample_count, dt, file_name, 2**14)
-            signalProcessing.fftplt_indiv(file_name, sample_count, dt)
-            signalProcessing.compute_welch_psd_and_plot(file_name, 1/dt, window_length, overlap_samples=None)
-            #signalProcessing.velocity_average(file_name_velocity, sample_count, dt)
-            chunk += 1
+        #保存と解析は計測データごとに別プロセスで並列に行う（共有メモリから直接読み、ファイルは読み直さない）
+        tasks = []
+        for chunk, sequence in enumerate(capture_store.available(), start=1):
+            meta = capture_store.read_meta(sequence)
+            header = {"bandwidth": new_bandwidth, "range": new_range, "chunk_index": chunk,
+                      "t_start": meta["t_start"], "t_end": meta["t_end"],
+                      "session": session_dir, "sequence": sequence,#索引のldvの記録(sequence)から各サンプルの時刻が分かる
+                      "aborted": None if aborted is None else str(aborted)}
+            tasks.append(postProcessing.ChunkTask(sequence, chunk,
+                                                  rootDir + '/' + name + f'_{chunk}',
+                                                  rootDir + '/' + name + '_velocity' + f'_{chunk}',
+                                                  header))
+        window_length = 2**15
+        with instrumentation.span("postprocess"):
+            postProcessing.process_captures(capture_store, tasks, dt, window_length, stft_window=2**14)
+        instrumentation.collect()#全プロセスの記録をSYSTEM_TRACE/trace.jsonにまとめる
+        #signalProcessing.velocity_average(file_name_velocity, sample_count, dt)
         
         """
         fig= plt.figure()
@@ -192,23 +185,13 @@ def run_endless():
         plt.plot(x,y)
         plt.show()
         """
-        sys.exit(0)
+        sys.exit(0 if aborted is None else 1)
         
     except KeyboardInterrupt:
-        
-        #すべての子プロセスを強制終了
-
-        dataAquisition_process.terminate()
-        dataAquisition_process.join()
-        #button_process.terminate()
-        #button_process.join()
+        #子プロセスはsupervisorの終了処理で止まっている
         sys.exit(0)
-
-        #process_queueから最新のデータを取り出す処理（またはいくつかのデータを順に取り出してappendでlistにまとめる処理）をここにかく
-    except Exception as e:
-        if dataAquisition_process and dataAquisition_process.is_alive():
-            dataAquisition_process.terminate()
-            dataAquisition_process.join()
+    finally:
+        capture_store.unlink()#共有メモリの削除（プロセス終了時に解放される）
 
 if __name__ == "__main__":
     #print("Hello world")
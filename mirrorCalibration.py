@@ -0,0 +1,181 @@
+import time
+
+import cv2
+import numpy as np
+
+import imageProcessing
+
+#カメラ画像の画素とミラー角度の対応の較正
+#ミラーを格子状の角度に動かしてレーザの照射位置をカメラで検出し、「画素 → その画素にレーザを当てるミラー角度」の写像を当てはめる
+#写像は画像の全画素について前計算した表(PixelMirrorMap)として保存し、追従中は表を引くだけで目標角度が求まる
+#（1画素あたりの角度を一定とした intervalX = 0.01/126 の比例制御より少ないフレーム数で目標に到達する）
+#
+#対応する光学系: カメラが固定されていてミラーを介さずに対象を撮影し、ミラーを動かすと画像内でレーザの照射位置が動く配置
+#カメラがミラー越しに撮影する配置（レーザ位置laser_pointが画像内で動かず、X -= distance*intervalの比例制御が前提とする配置、
+#simulation.SimulatedCameraもこの配置）では較正中も照射位置が動かないため較正できない。fitは検出位置の広がりが足りない場合や
+#当てはめが悪条件の場合にValueErrorを送出する
+
+DEFAULT_FILE = 'C:/Users/yuto/Documents/system_python/mirror_calibration.npz'
+MIN_SPREAD_PX = 20.0     #検出した画素の各軸の広がり（最大-最小）の下限（changeScale後の画素）
+MAX_CONDITION = 1e6      #正規化した画素で作った当てはめの行列の条件数の上限
+
+
+def sweepGrid(setAngle, grabImage, X_range=(-0.1, 0.1), Y_range=(-0.1, 0.1), num=7, settle_s=0.05,
+              scale=0.5, min_brightness=50):
+    """
+    ミラーを格子状の角度に順に動かし、各角度でのレーザの照射位置を検出する
+    setAngle : setAngle(X, Y)、ミラーを動かす関数
+    grabImage: grabImage() -> 画像、カメラの画像を1枚取得する関数
+    X_range, Y_range: 角度の範囲、num: 各軸の点数
+    settle_s : ミラーを動かしてから撮影するまでの待ち時間
+    戻り値: (検出した画素(n, 2), ミラー角度(n, 2))、レーザを検出できなかった点は含まない
+    """
+    pixels = []
+    angles = []
+    for i, X in enumerate(np.linspace(X_range[0], X_range[1], num)):
+        Y_values = np.linspace(Y_range[0], Y_range[1], num)
+        if i % 2 == 1:
+            Y_values = Y_values[::-1]#往復して走査し、ミラーの移動量を小さくする
+        for Y in Y_values:
+            setAngle(X, Y)
+            time.sleep(settle_s)
+            point = imageProcessing.detectLaserPoint(grabImage(), scale, min_brightness=min_brightness, subpixel=True)
+            if point is None:
+                print(f"laser not found at X={X:.4f}, Y={Y:.4f}")
+                continue
+            pixels.append(point)
+            angles.append((X, Y))
+    return np.array(pixels, dtype=np.float64), np.array(angles, dtype=np.float64)
+
+
+def polynomialTerms(pixels, degree):
+    #(1, u, v, u^2, uv, v^2, ...)、u, vは画素
+    u, v = pixels[:, 0], pixels[:, 1]
+    return np.stack([u**(d-k) * v**k for d in range(degree+1) for k in range(d+1)], axis=1)
+
+
+def checkConditioning(pixels, degree, min_spread_px=MIN_SPREAD_PX, max_condition=MAX_CONDITION):
+    #検出した画素が画像内で十分に広がっていない（照射位置が動いていない、一直線上にしかない）場合はValueError
+    #条件数は画素を平均0、標準偏差1に正規化してから求める（画素の大きさによる悪条件は含めない）
+    spread = pixels.max(axis=0) - pixels.min(axis=0)
+    if np.any(spread < min_spread_px):
+        raise ValueError(f"detected laser points spread only {spread[0]:.1f} x {spread[1]:.1f} px "
+                         f"(at least {min_spread_px} px is required); the laser point does not move in the image, "
+                         f"calibration needs a fixed camera that does not look through the mirror")
+    normalized = (pixels - pixels.mean(axis=0)) / pixels.std(axis=0)
+    condition = np.linalg.cond(polynomialTerms(normalized, degree))
+    if not condition <= max_condition:
+        raise ValueError(f"ill-conditioned calibration (condition number {condition:.3e} > {max_condition:.0e}); "
+                         f"the detected laser points are degenerate")
+    return condition
+
+
+class PixelMirrorMap:
+    """
+    画素(x, y) → ミラー角度(X, Y) の表（changeScale後の画像の大きさ）
+    fitで当てはめた写像を全画素について前計算しておき、lookupでは表を引く（画素の間は双線形補間）
+    lookupの角度は較正で走査した角度の範囲(angle_range)に制限する（走査範囲の外へ外挿しない）
+    """
+    def __init__(self, table, angle_range, method="", coefficients=None, rms_error=np.nan, condition=np.nan):
+        self.table = np.asarray(table, dtype=np.float64)   #(height, width, 2)
+        self.angle_range = np.asarray(angle_range, dtype=np.float64)   #((X_min, Y_min), (X_max, Y_max))
+        self.method = method
+        self.coefficients = coefficients
+        self.rms_error = rms_error
+        self.condition = condition
+
+    @classmethod
+    def fit(cls, pixels, angles, image_shape, method="poly", degree=2):
+        """
+        pixels     : 検出した画素(n, 2)
+        angles     : そのときのミラー角度(n, 2)
+        image_shape: 表を作る画像の大きさ(height, width)
+        method     : "poly"（degree次の多項式、最小二乗）または "homography"（射影変換）
+        検出した画素の広がりが足りない、または悪条件の場合はValueError（checkConditioningを参照）
+        """
+        pixels = np.asarray(pixels, dtype=np.float64)
+        angles = np.asarray(angles, dtype=np.float64)
+        if len(pixels) < 4:
+            raise ValueError(f"{len(pixels)} points are not enough for calibration")
+        condition = checkConditioning(pixels, degree if method == "poly" else 1)
+        height, width = image_shape[0], image_shape[1]
+        grid_y, grid_x = np.mgrid[0:height, 0:width]
+        grid = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1).astype(np.float64)
+        if method == "poly":
+            if len(pixels) < (degree+1)*(degree+2)//2:
+                raise ValueError(f"{len(pixels)} points are not enough for a degree {degree} polynomial")
+            coefficients, *_ = np.linalg.lstsq(polynomialTerms(pixels, degree), angles, rcond=None)
+            fitted = polynomialTerms(pixels, degree) @ coefficients
+            table = polynomialTerms(grid, degree) @ coefficients
+        elif method == "homography":
+            coefficients, _ = cv2.findHomography(pixels, angles, 0)
+            fitted = cv2.perspectiveTransform(pixels[None], coefficients)[0]
+            table = cv2.perspectiveTransform(grid[None], coefficients)[0]
+        else:
+            raise ValueError(f"unknown method: {method}")
+        rms_error = float(np.sqrt(np.mean(np.sum((fitted - angles)**2, axis=1))))
+        angle_range = np.stack([angles.min(axis=0), angles.max(axis=0)])
+        return cls(table.reshape(height, width, 2), angle_range, method, coefficients, rms_error, condition)
+
+    def lookup(self, point):
+        #画素point(x, y)（float可）に対応するミラー角度(X, Y)、画像の外は端の値、角度は走査した範囲に制限する
+        height, width = self.table.shape[0], self.table.shape[1]
+        x = min(max(float(point[0]), 0.0), width - 1.0)
+        y = min(max(float(point[1]), 0.0), height - 1.0)
+        x0, y0 = int(x), int(y)
+        x1, y1 = min(x0 + 1, width - 1), min(y0 + 1, height - 1)
+        fx, fy = x - x0, y - y0
+        top = self.table[y0, x0]*(1-fx) + self.table[y0, x1]*fx
+        bottom = self.table[y1, x0]*(1-fx) + self.table[y1, x1]*fx
+        X, Y = np.clip(top*(1-fy) + bottom*fy, self.angle_range[0], self.angle_range[1])
+        return float(X), float(Y)
+
+    def save(self, file_name=DEFAULT_FILE):
+        np.savez(file_name, table=self.table, angle_range=self.angle_range, method=self.method,
+                 rms_error=self.rms_error, condition=self.condition, coefficients=np.asarray(self.coefficients if self.coefficients is not None else []))
+        return file_name
+
+    @classmethod
+    def load(cls, file_name=DEFAULT_FILE):
+        data = np.load(file_name)
+        if "angle_range" not in data:
+            raise ValueError(f"{file_name} has no angle range (saved by an older version), run the calibration again")
+        return cls(data["table"], data["angle_range"], str(data["method"]), data["coefficients"],
+                   float(data["rms_error"]), float(data["condition"]))
+
+
+def runCalibration(file_name=DEFAULT_FILE, method="poly", num=7, X_range=(-0.1, 0.1), Y_range=(-0.1, 0.1)):
+    #カメラとミラーに接続して較正し、表を保存する（追従と同じ露光・ゲイン・縮尺で撮影する）
+    from pypylon import pylon
+    import controlMirror
+
+    camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
+    camera.Open()
+    camera.ExposureTime.SetValue(1.5*1000)
+    camera.Gain.SetValue(18.0)
+    mre2 = controlMirror.setMirror()
+
+    def grabImage():
+        grab = camera.GrabOne(1000)
+        try:
+            return grab.GetArray()
+        finally:
+            grab.Release()
+
+    try:
+        pixels, angles = sweepGrid(lambda X, Y: controlMirror.changeAngle(X, Y, mre2), grabImage,
+                                   X_range, Y_range, num)
+        image_shape = imageProcessing.changeScale(grabImage()).shape
+    finally:
+        controlMirror.changeAngle(0, 0, mre2)
+        camera.Close()
+
+    pixel_map = PixelMirrorMap.fit(pixels, angles, image_shape, method)
+    print(f"{len(pixels)} points, {method} fit, rms error {pixel_map.rms_error:.3e}, condition number {pixel_map.condition:.3e}")
+    pixel_map.save(file_name)
+    print(f"saved {file_name}")
+    return pixel_map
+
+
+if __name__ == "__main__":
+    runCalibration()
@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+import multiprocessing
+
+#カメラ・GUIのプロセスからミラーのプロセスへ目標角度(X, Y)を送るための、最新の値だけを保持する共有メモリ
+#multiprocessing.Queueでは、ミラーの反映が追いつかない時に古い角度が溜まり、ミラーは最新の目標ではなく過去の角度を順に再生していた
+#ここでは書き込むたびに前の値を上書きし、ミラーのプロセスは常に最新の角度だけを反映する（読まれずに上書きされた指令は数えておく）
+#
+#seqlock（書き込み側のプロセスごとのスロット）:
+#  書き込み側のプロセスは最初のputで自分専用のスロットを登録し、以降はそのスロットだけに書く
+#  （プロセス間のロックは使わない。同じプロセスの複数のスレッドからのputはプロセス内のロックで順に書く）
+#  書き込み側はsequenceを奇数にし、値を書き、sequenceを偶数に戻す
+#  読み込み側は全スロットを読み、読む前後のsequenceが同じ偶数で前回より新しいスロットのうち、書き込み時刻が最新の値を使う
+#  sequenceが奇数のスロット（書き込み中、または書き込み中に強制終了されたプロセス）は待たずに読み飛ばすため、
+#  書き込み側のプロセスが途中で終了しても他のプロセスのputとミラーの読み込みは止まらない
+#
+#共有メモリの配置(float64):
+#  command  : スロットごとに sequence, X, Y, 書き込み時刻（MAX_PRODUCERS個）
+#  producers: 各スロットを登録したプロセスのpid（0は未使用）
+#  applied  : sequence, X, Y（ミラーのプロセスが最後に反映し終えた角度、書き込みはミラーのプロセスだけ）
+#  stats    : 反映回数, 上書き回数, 遅延の合計, 遅延の最大, 遅延のヒストグラム(LATENCY_BINS)（書き込みはミラーのプロセスだけ）
+#時刻はtime.perf_counter()（Windowsではプロセス間で共通の時計）、遅延はput→ミラーに反映し終わるまで
+
+_SEQUENCE, _X, _Y, _T_PUT = range(4)
+_SLOT_LEN = 4
+_APPLIED, _COALESCED, _LATENCY_SUM, _LATENCY_MAX = range(4)
+LATENCY_BIN_S = 0.0001  #ヒストグラムの幅 0.1 ms
+LATENCY_BINS = 200      #20 ms以上は最後のビンに入れる
+_STATS_LEN = 4 + LATENCY_BINS
+MAX_PRODUCERS = 8       #putするプロセス数の上限（カメラ、GUI、メインなど）
+REGISTER_TIMEOUT_S = 1.0    #スロットの登録でロックを待つ時間の上限
+
+
+class MirrorCommandChannel:
+    #書き込み(put)は複数のプロセスから、読み込み(get)はミラーのプロセス1つだけから行う
+    def __init__(self):
+        self.__command = multiprocessing.RawArray('d', _SLOT_LEN*MAX_PRODUCERS)
+        self.__producers = multiprocessing.RawArray('q', MAX_PRODUCERS)
+        self.__applied = multiprocessing.RawArray('d', 3)
+        self.__stats = multiprocessing.RawArray('d', _STATS_LEN)
+        self.__register_lock = multiprocessing.Lock()  #スロットの登録だけに使う（putでは使わない）
+        self.__updated = multiprocessing.Event()
+        self.__closed = multiprocessing.Event()
+        self.__last_sequences = [0]*MAX_PRODUCERS  #読み込み側が最後に読んだ各スロットのsequence（ミラーのプロセス内だけで使う）
+        self.__slot = None          #このプロセスが書き込むスロット
+        self.__slot_pid = None      #__slotを登録したプロセス（子プロセスに渡された場合は登録し直す）
+        self.__slot_lock = None     #このプロセスのスレッド間のロック（__registerで作る）
+        self.__t_put = None
+
+    def __register(self):
+        pid = os.getpid()
+        if not self.__register_lock.acquire(timeout=REGISTER_TIMEOUT_S):
+            raise RuntimeError("could not register a mirror command producer")
+        try:
+            producers = self.__producers
+            for slot in range(MAX_PRODUCERS):
+                if producers[slot] in (0, pid):
+                    producers[slot] = pid
+                    break
+            else:
+                raise RuntimeError(f"more than {MAX_PRODUCERS} processes put mirror commands")
+        finally:
+            self.__register_lock.release()
+        self.__slot = slot
+        self.__slot_lock = threading.Lock()
+        self.__slot_pid = pid
+
+    def __getstate__(self):
+        #threading.Lockは送れないため、子プロセスでは最初のputで登録し直す
+        state = self.__dict__.copy()
+        state["_MirrorCommandChannel__slot_lock"] = None
+        state["_MirrorCommandChannel__slot_pid"] = None
+        return state
+
+    def put(self, angle, block=True, timeout=None):
+        #angle: (X, Y)、前の値が反映される前でも上書きする（待たない）
+        #block, timeoutはmultiprocessing.Queue.putと同じ呼び方をするためのもので、使わない
+        X, Y = angle
+        if self.__slot_pid != os.getpid():
+            self.__register()
+        command = self.__command
+        base = self.__slot*_SLOT_LEN
+        with self.__slot_lock:
+            command[base + _SEQUENCE] += 1     #奇数: 書き込み中
+            command[base + _X] = X
+            command[base + _Y] = Y
+            command[base + _T_PUT] = time.perf_counter()
+            command[base + _SEQUENCE] += 1     #偶数: 書き込み完了
+        self.__updated.set()
+
+    def __read(self, slot):
+        #スロットの(sequence, X, Y, 書き込み時刻)、書き込み中（sequenceが奇数）ならNone
+        command = self.__command
+        base = slot*_SLOT_LEN
+        while True:
+            sequence = command[base + _SEQUENCE]
+            if sequence % 2 == 1:
+                return None
+            X, Y, t_put = command[base + _X], command[base + _Y], command[base + _T_PUT]
+            if command[base + _SEQUENCE] == sequence:
+                return int(sequence), X, Y, t_put
+
+    def __hasNew(self):
+        #前回のget以降に書き込みを終えたスロットがあるか（書き込み中のスロットは書き終えた時にsetされるので含めない）
+        for slot in range(MAX_PRODUCERS):
+            value = self.__read(slot)
+            if value is not None and value[0] > self.__last_sequences[slot]:
+                return True
+        return False
+
+    def get(self, timeout=None):
+        #前回のget以降にputされた最新の角度(X, Y)を返す、timeoutまでに新しい値がない場合やclose後はNone
+        while not self.__closed.is_set():
+            newest = None
+            received = 0
+            for slot in range(MAX_PRODUCERS):
+                value = self.__read(slot)
+                if value is None or value[0] <= self.__last_sequences[slot]:
+                    continue
+                sequence, X, Y, t_put = value
+                received += (sequence - self.__last_sequences[slot])//2
+                self.__last_sequences[slot] = sequence
+                if newest is None or t_put > newest[2]:
+                    newest = (X, Y, t_put)
+            if newest is not None:
+                self.__stats[_COALESCED] += received - 1
+                self.__t_put = newest[2]
+                return newest[0], newest[1]
+            #clearの後にputされた場合はsetされ直すため、新しい値を見逃さない
+            self.__updated.clear()
+            if self.__hasNew():
+                continue
+            if not self.__updated.wait(timeout):
+                return None
+        return None
+
+    def applied(self, angle=None):
+        #getで受け取った角度をミラーに反映し終えた時に呼ぶ（putからの遅延を記録する）
+        #angle: 反映した角度(X, Y)、appliedAngleで他のプロセスから読める（反映に失敗した場合はNoneで前の値のまま）
+        if angle is not None:
+            applied = self.__applied
+            applied[0] += 1             #奇数: 書き込み中
+            applied[1], applied[2] = angle
+            applied[0] += 1             #偶数: 書き込み完了
+        if self.__t_put is None:
+            return
+        latency = time.perf_counter() - self.__t_put
+        self.__t_put = None
+        stats = self.__stats
+        stats[_APPLIED] += 1
+        stats[_LATENCY_SUM] += latency
+        stats[_LATENCY_MAX] = max(stats[_LATENCY_MAX], latency)
+        stats[4 + min(int(latency/LATENCY_BIN_S), LATENCY_BINS - 1)] += 1
+
+    def appliedAngle(self):
+        #ミラーのプロセスが最後に反映し終えた角度(X, Y)、まだ反映していなければ(0, 0)
+        applied = self.__applied
+        while True:
+            sequence = applied[0]
+            if sequence % 2 == 1:
+                time.sleep(0)
+                continue
+            X, Y = applied[1], applied[2]
+            if applied[0] == sequence:
+                return X, Y
+
+    def close(self):
+        #待機しているgetを終了させる
+        self.__closed.set()
+        self.__updated.set()
+
+    @property
+    def closed(self):
+        return self.__closed.is_set()
+
+    def summary(self):
+        #{put, applied, coalesced, latency_mean, latency_p50, latency_p95, latency_max}、時間の単位はms
+        #どのプロセスからでも読める（ミラーのプロセスの終了後でも値は残る）
+        stats = list(self.__stats)
+        put_count = sum(int(self.__command[slot*_SLOT_LEN + _SEQUENCE])//2 for slot in range(MAX_PRODUCERS))
+        applied = int(stats[_APPLIED])
+        result = {"put": put_count, "applied": applied, "coalesced": int(stats[_COALESCED])}
+        if applied == 0:
+            return result
+        histogram = stats[4:]
+        def percentile(q):
+            count = 0
+            for n, c in enumerate(histogram):
+                count += c
+                if count >= q*applied:
+                    return (n + 1)*LATENCY_BIN_S*1000
+            return stats[_LATENCY_MAX]*1000
+        result.update({"latency_mean": stats[_LATENCY_SUM]/applied*1000,
+                       "latency_p50": percentile(0.5),
+                       "latency_p95": percentile(0.95),
+                       "latency_max": stats[_LATENCY_MAX]*1000})
+        return result
+
+    def report(self):
+        stats = self.summary()
+        print(f"mirror channel: {stats['put']} put / {stats['applied']} applied ({stats['coalesced']} coalesced)")
+        if stats["applied"] > 0:
+            print(f"  command to apply: mean {stats['latency_mean']:.3f} ms  p50 <{stats['latency_p50']:.1f} ms  "
+                  f"p95 <{stats['latency_p95']:.1f} ms  max {stats['latency_max']:.3f} ms")
@@ -0,0 +1,126 @@
+import os
+import time
+import contextlib
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy import integrate
+
+import captureFile
+import instrumentation
+import signalAnalysis
+import signalPlot
+
+#計測終了後の解析（保存、スペクトログラム、FFT、Welch法）を計測データごとに別プロセスで並列に行う
+#計測データはshared_memory(captureStore)から直接読み、途中でファイルを読み直さない
+#各ワーカーはプロセス起動時に一度だけ共有メモリへattachする
+
+STAGES = ("integrate", "save", "plot_signal", "stft", "spectrum", "welch")
+
+_store = None #ワーカープロセスでattachしたSharedCaptureStore
+
+
+@dataclass
+class ChunkTask:
+    sequence: int        #captureStoreのsequence番号
+    chunk: int           #ファイル名に付ける番号(1から)
+    file_name: str       #変位の保存先（拡張子なし）
+    file_name_velocity: str
+    header: dict = field(default_factory=dict) #.ldvのヘッダに追加する値
+
+@dataclass
+class ChunkResult:
+    chunk: int
+    file_name: str
+    timings: dict        #処理段階ごとの時間[s]
+    band_powers: dict    #Welch法のパワーの周波数帯ごとの合計
+    pid: int
+
+
+@contextlib.contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+        instrumentation.complete(stage, start, timings[stage])
+
+
+def _init_worker(capture_store):
+    #ProcessPoolExecutorのinitializer、capture_storeは名前だけがpickleされてここでattachされる
+    global _store
+    _store = capture_store
+    instrumentation.configure("postprocess")
+
+
+def process_chunk(task, dt, window_length=2**15, stft_window=2**14):
+    #1回分の計測データ(速度)を変位に変換して保存し、図を作成する
+    timings = {}
+    velocity = _store.read(task.sequence)
+    sample_count = velocity.size
+
+    with _timed(timings, "integrate"):
+        displacement = integrate.cumulative_trapezoid(velocity, dx=dt, initial=0)
+    with _timed(timings, "save"):
+        #バイナリ形式(.ldv)で保存、テキストが必要な場合はcaptureFile.export_textで変換する
+        captureFile.write_capture(task.file_name, displacement, dt, quantity="displacement", unit="m", **task.header)
+        captureFile.write_capture(task.file_name_velocity, velocity, dt, quantity="velocity", unit="m/s", **task.header)
+    with _timed(timings, "plot_signal"):
+        t = np.linspace(0, dt*sample_count, sample_count)
+        fig = signalPlot.plot_time_series(t, velocity, 'Displacement [m]')
+        fig.axes[0].set_xlim(0, sample_count*dt+0.01)
+        fig.savefig(task.file_name+'.png')
+    with _timed(timings, "stft"):
+        spec = signalAnalysis.stft(displacement, dt, stft_window)
+        signalPlot.plot_spectrogram(spec, task.file_name+'_displacement_spectrogram_50-600.png')
+    with _timed(timings, "spectrum"):
+        spectrum = signalAnalysis.spectrum(displacement, dt)
+        signalPlot.plot_time_series(spectrum.time, spectrum.signal, 'Pos [μm]', task.file_name+'_Displacement_元データ.png')
+        signalPlot.plot_spectrum(spectrum, task.file_name+f'_frequency{spectrum.freq[0]}-600.png')
+    with _timed(timings, "welch"):
+        psd = signalAnalysis.welch(displacement, 1/dt, window_length)
+        signalPlot.plot_welch(psd, task.file_name+'_welch_ps.png')
+
+    band_powers = signalAnalysis.band_powers(psd).as_dict()
+    return ChunkResult(task.chunk, task.file_name, timings, band_powers, os.getpid())
+
+
+def process_captures(capture_store, tasks, dt, window_length=2**15, stft_window=2**14, max_workers=None):
+    """
+    capture_store: 計測データを保持しているSharedCaptureStore（処理が終わるまでunlinkしないこと）
+    tasks        : ChunkTaskのリスト
+    max_workers  : プロセス数（None: CPUのコア数、1: メインプロセスで順に処理する）
+    戻り値: chunk順のChunkResultのリスト
+    """
+    start = time.perf_counter()
+    results = []
+    if max_workers == 1 or len(tasks) <= 1:
+        _init_worker(capture_store)
+        for task in tasks:
+            results.append(process_chunk(task, dt, window_length, stft_window))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(capture_store,)) as executor:
+            futures = {executor.submit(process_chunk, task, dt, window_length, stft_window): task for task in tasks}
+            for future in as_completed(futures):
+                result = future.result()
+                print(f"chunk {result.chunk} done ({sum(result.timings.values()):.2f} s, pid {result.pid})")
+                results.append(result)
+    results.sort(key=lambda result: result.chunk)
+    report_timings(results, time.perf_counter() - start)
+    return results
+
+
+def report_timings(results, wall_time):
+    #処理段階ごとの合計・平均・最大時間と、並列化による短縮率を表示する
+    if not results:
+        print(f"post-processing: no captures ({wall_time:.2f} s)")
+        return
+    print(f"post-processing: {len(results)} chunks in {wall_time:.2f} s")
+    total = 0.0
+    for stage in STAGES:
+        times = np.array([result.timings.get(stage, 0.0) for result in results])
+        total += times.sum()
+        print(f"  {stage:<12} total {times.sum():7.2f} s  mean {times.mean():6.3f} s  max {times.max():6.3f} s")
+    print(f"  serial time {total:.2f} s -> x{total/max(wall_time, 1e-9):.1f} speed-up")
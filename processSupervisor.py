@@ -0,0 +1,369 @@
+import time
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import connection
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+#セッションの子プロセス（ミラー、ロボットアーム、LDV、GUI、カメラ）の起動・監視・終了をまとめて行う
+#各プロセスはProcessSpecで宣言し、ProcessSupervisorが
+#  起動  : afterに書いたプロセスの準備完了を待ってから起動する（依存のないプロセスは同時に起動する）
+#  準備  : 子プロセスがnotifyReady()を呼んだら準備完了、ready_timeout_sを過ぎたら起動失敗
+#  監視  : heartbeat()がheartbeat_timeout_sより長く途切れたら応答なし、異常終了と同じに扱う
+#  終了  : stop_orderの小さい順に、stop()で終了を促してstop_timeout_sまで待ち、終わらなければterminateする
+#子プロセスからの通知はプロセスごとのPipeで受け取り、Pipeとプロセスの終了(sentinel)をconnection.waitでまとめて待つ
+#（is_alive()を一定間隔で調べるループやEventの待機はない）
+#
+#使い方:
+#  supervisor = ProcessSupervisor([ProcessSpec("mirror", controlMirror.mirror_server, (channel,), notifies_ready=True), ...],
+#                                 shutdown=finishFlag.set)
+#  with supervisor:
+#      supervisor.start()      #全プロセスの準備完了まで
+#      supervisor.wait()       #セッションの終了（ends_sessionのプロセスの終了、異常終了）まで
+#  supervisor.report()
+
+WAITING, STARTING, READY, DONE, FAILED, STOPPED = "waiting", "starting", "ready", "done", "failed", "stopped"
+HEARTBEAT = "heartbeat"
+HEARTBEAT_INTERVAL_S = 0.5  #子プロセスからheartbeatを送る最短の間隔
+
+
+class SupervisorError(RuntimeError):
+    pass
+
+
+@dataclass
+class ProcessSpec:
+    name: str
+    target: Callable
+    args: tuple = ()
+    after: tuple = ()                           #起動する前に準備完了を待つプロセスの名前
+    notifies_ready: bool = False                #Trueならtargetの中でnotifyReady()を呼ぶまで準備完了としない（Falseなら起動した時点で準備完了）
+    ready_timeout_s: Optional[float] = 10.0     #notifyReadyを待つ時間（Noneなら制限なし）
+    heartbeat_timeout_s: Optional[float] = None #heartbeatの途切れを許す時間（Noneなら監視しない）
+    stop: Optional[Callable] = None             #終了を促す関数（親プロセスで呼ぶ、チャネルのcloseなど）
+    stop_timeout_s: float = 5.0                 #終了を待つ時間、過ぎたらterminateする
+    stop_order: int = 0                         #小さい順に終了させる
+    required: bool = True                       #異常終了したらセッションを止めてSupervisorErrorにする
+    ends_session: bool = False                  #このプロセスが終了したらセッションを終える
+
+
+#---子プロセス側
+
+_connection = None
+_connection_lock = threading.Lock()
+_last_heartbeat = 0.0
+
+
+def _send(message):
+    if _connection is None:
+        return
+    with _connection_lock:
+        try:
+            _connection.send(message)
+        except (OSError, EOFError):#親プロセスが先に終了した場合
+            pass
+
+
+def supervised():
+    #ProcessSupervisorから起動されたプロセスかどうか
+    return _connection is not None
+
+
+def notifyReady():
+    #準備完了を通知する（ProcessSupervisorから起動されていなければ何もしない）
+    _send((READY, None))
+
+
+def heartbeat():
+    #動いていることを通知する、ループの中で毎回呼んでよい（HEARTBEAT_INTERVAL_Sより短い間隔の呼び出しは送らない）
+    global _last_heartbeat
+    if _connection is None:
+        return
+    now = time.monotonic()
+    if now - _last_heartbeat >= HEARTBEAT_INTERVAL_S:
+        _last_heartbeat = now
+        _send((HEARTBEAT, None))
+
+
+def _bootstrap(target, args, sender):
+    global _connection
+    _connection = sender
+    try:
+        target(*args)
+    except SystemExit as e:
+        _send((DONE, None) if e.code in (0, None) else (FAILED, f"SystemExit: {e.code}"))
+        raise
+    except BaseException:
+        _send((FAILED, traceback.format_exc()))
+        raise
+    _send((DONE, None))
+
+
+#---親プロセス側
+
+class _Child:
+    def __init__(self, spec):
+        self.spec = spec
+        self.state = WAITING
+        self.process = None
+        self.receiver = None
+        self.t_start = None
+        self.t_ready = None
+        self.t_heartbeat = None
+        self.error = None
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def finished(self):
+        return self.state in (DONE, FAILED, STOPPED)
+
+
+class ProcessSupervisor:
+    """
+    specs   : ProcessSpecのリスト
+    shutdown: 終了処理の最初に1回呼ぶ関数（セッション終了のフラグのsetなど、全プロセスに終了を促す）
+    """
+    def __init__(self, specs, shutdown=None):
+        self.__children = {}
+        for spec in specs:
+            if spec.name in self.__children:
+                raise ValueError(f"duplicate process name: {spec.name}")
+            self.__children[spec.name] = _Child(spec)
+        for spec in specs:
+            for name in spec.after:
+                if name not in self.__children:
+                    raise ValueError(f"{spec.name}: unknown process in after: {name}")
+        self.shutdown = shutdown
+        self.reason = None
+        self.__t0 = None
+        self.__stopping = False
+        self.__stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def __getitem__(self, name):
+        return self.__children[name].process
+
+    def state(self, name):
+        return self.__children[name].state
+
+    def __launch(self, child):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        child.process = multiprocessing.Process(target=_bootstrap, args=(child.spec.target, child.spec.args, sender),
+                                                name=child.spec.name)
+        child.process.start()
+        sender.close()  #子プロセスが終了した時にrecvがEOFになるよう、親プロセス側の送信口は閉じる
+        child.receiver = receiver
+        child.t_start = child.t_heartbeat = time.monotonic()
+        if child.spec.notifies_ready:
+            child.state = STARTING
+        else:
+            child.state = READY
+            child.t_ready = child.t_start
+
+    def __fail(self, child, error):
+        if child.finished():
+            return
+        child.state = FAILED
+        child.error = error
+        print(f"process {child.spec.name} failed: {error}")
+
+    def __receive(self, child):
+        try:
+            while child.receiver.poll():
+                message, detail = child.receiver.recv()
+                child.t_heartbeat = time.monotonic()
+                if message == READY and child.state == STARTING:
+                    child.state = READY
+                    child.t_ready = child.t_heartbeat
+                elif message == FAILED:
+                    self.__fail(child, detail.strip().splitlines()[-1])#トレースバックは子プロセスが表示する
+                elif message == DONE and not child.finished():
+                    child.state = DONE
+        except (EOFError, OSError):#子プロセスが終了した
+            child.receiver.close()
+            child.receiver = None
+
+    def __exited(self, child):
+        #プロセスの終了(sentinel)を受け取った時、終了前に送られた通知を先に読む
+        if child.receiver is not None:
+            self.__receive(child)
+        child.process.join()
+        if child.finished():
+            return
+        if self.__stopping and child.process.exitcode != 0:
+            child.state = STOPPED   #終了処理でterminateした
+        elif child.process.exitcode == 0:
+            if child.state == STARTING:
+                self.__fail(child, "exited before it was ready")
+            else:
+                child.state = DONE
+        else:
+            self.__fail(child, f"exit code {child.process.exitcode}")
+
+    def __checkDeadlines(self, now):
+        for child in self.__children.values():
+            spec = child.spec
+            if child.state == STARTING and spec.ready_timeout_s is not None and now - child.t_start > spec.ready_timeout_s:
+                self.__fail(child, f"not ready within {spec.ready_timeout_s} s")
+            elif child.state == READY and spec.heartbeat_timeout_s is not None and now - child.t_heartbeat > spec.heartbeat_timeout_s:
+                self.__fail(child, f"no heartbeat for {spec.heartbeat_timeout_s} s")
+
+    def __nextDeadline(self):
+        deadlines = []
+        for child in self.__children.values():
+            spec = child.spec
+            if child.state == STARTING and spec.ready_timeout_s is not None:
+                deadlines.append(child.t_start + spec.ready_timeout_s)
+            elif child.state == READY and spec.heartbeat_timeout_s is not None:
+                deadlines.append(child.t_heartbeat + spec.heartbeat_timeout_s)
+        return min(deadlines) if deadlines else None
+
+    def __pump(self, deadline=None):
+        #子プロセスからの通知かプロセスの終了、またはdeadline(time.monotonic())まで待って状態を更新する
+        waitables = {}
+        for child in self.__children.values():
+            if child.receiver is not None:
+                waitables[child.receiver] = child
+            if child.process is not None and child.process.exitcode is None:
+                waitables[child.process.sentinel] = child
+        next_deadline = None if self.__stopping else self.__nextDeadline()
+        if deadline is None or (next_deadline is not None and next_deadline < deadline):
+            deadline = next_deadline
+        if not waitables:
+            return
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        for ready in connection.wait(list(waitables), timeout):
+            child = waitables[ready]
+            if ready is child.receiver:
+                self.__receive(child)
+        for child in set(waitables.values()):#終了したプロセス（通知を読んだ後に処理する）
+            if child.process.exitcode is not None and not child.finished():
+                self.__exited(child)
+        if not self.__stopping:
+            self.__checkDeadlines(time.monotonic())
+
+    def __failures(self):
+        return [child for child in self.__children.values() if child.state == FAILED and child.spec.required]
+
+    def start(self):
+        """
+        依存関係(after)の順に子プロセスを起動し、全プロセスの準備完了まで待つ（依存のないプロセスは並行に起動・準備する）
+        必須(required)のプロセスが準備中に異常終了した、または準備が時間内に終わらない場合は、全プロセスを止めてSupervisorError
+        """
+        self.__t0 = time.monotonic()
+        while True:
+            for child in self.__children.values():
+                if child.state == WAITING and not self.__stopping and \
+                        all(self.__children[name].state in (READY, DONE) for name in child.spec.after):
+                    self.__launch(child)
+            failures = self.__failures()
+            if failures:
+                self.reason = f"{failures[0].spec.name} failed during startup: {failures[0].error}"
+                self.stop()
+                raise SupervisorError(self.reason)
+            if self.__sessionEnded():
+                return
+            children = list(self.__children.values())
+            if all(child.state in (READY, DONE, FAILED, STOPPED) for child in children):
+                print(f"all processes ready in {time.monotonic() - self.__t0:.2f} s")
+                return
+            if not any(child.state == STARTING for child in children):
+                #準備中のプロセスがなく、起動できないプロセスが残っている（afterの依存が循環している、または依存先が異常終了した）
+                waiting = [child.spec.name for child in children if child.state == WAITING]
+                self.reason = f"cannot start {waiting}"
+                self.stop()
+                raise SupervisorError(self.reason)
+            self.__pump()
+
+    def __sessionEnded(self):
+        for child in self.__children.values():
+            if child.spec.ends_session and child.finished():
+                self.reason = self.reason or f"{child.spec.name} {child.state}"
+                return True
+        if all(child.finished() for child in self.__children.values()):
+            self.reason = self.reason or "all processes finished"
+            return True
+        return False
+
+    def wait(self, timeout=None):
+        """
+        セッションが終わるまで待つ（ends_sessionのプロセスの終了、全プロセスの終了）
+        必須(required)のプロセスが異常終了・応答なしになった場合は、全プロセスを止めてSupervisorError
+        戻り値: 終了の理由（timeoutまでに終わらなければNone）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            failures = self.__failures()
+            if failures:
+                self.reason = f"{failures[0].spec.name} failed: {failures[0].error}"
+                self.stop()
+                raise SupervisorError(self.reason)
+            if self.__sessionEnded():
+                return self.reason
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            self.__pump(deadline)
+
+    def stop(self):
+        """
+        shutdownを呼んだ後、stop_orderの小さい順に各プロセスのstopを呼び、stop_timeout_sまで終了を待つ
+        待っても終わらないプロセスはterminateする（終了処理が子プロセスの待機で止まることはない）
+        """
+        if self.__stopped:
+            return
+        self.__stopping = True
+        if self.shutdown is not None:
+            try:
+                self.shutdown()
+            except Exception as e:
+                print(f"shutdown error: {e}")
+        for order in sorted({child.spec.stop_order for child in self.__children.values()}):
+            group = [child for child in self.__children.values()
+                     if child.spec.stop_order == order and child.process is not None]
+            deadlines = {}
+            for child in group:
+                if child.alive() and child.spec.stop is not None:
+                    try:
+                        child.spec.stop()
+                    except Exception as e:
+                        print(f"process {child.spec.name} stop error: {e}")
+                deadlines[child.spec.name] = time.monotonic() + child.spec.stop_timeout_s
+            while True:
+                alive = [child for child in group if child.process.exitcode is None]
+                if not alive:
+                    break
+                now = time.monotonic()
+                for child in alive:
+                    if now >= deadlines[child.spec.name]:
+                        if child.spec.stop_timeout_s > 0:
+                            print(f"process {child.spec.name} did not stop within {child.spec.stop_timeout_s} s, terminating")
+                        child.process.terminate()
+                        child.process.join()
+                if any(child.process.exitcode is None for child in alive):
+                    self.__pump(min(deadlines[child.spec.name] for child in alive if child.process.exitcode is None))
+            for child in group:
+                if not child.finished():
+                    self.__exited(child)
+        self.__stopped = True
+
+    def report(self):
+        #各プロセスの状態、準備完了までの時間、終了コード
+        for child in self.__children.values():
+            line = f"{child.spec.name:8s} {child.state:8s}"
+            if child.t_ready is not None and self.__t0 is not None:
+                line += f" ready at {child.t_ready - self.__t0:.2f} s"
+            if child.process is not None and child.process.exitcode is not None:
+                line += f" exit code {child.process.exitcode}"
+            if child.error:
+                line += f" ({child.error})"
+            print(line)
+        if self.reason:
+            print(f"session ended: {self.reason}")
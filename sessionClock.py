@@ -0,0 +1,291 @@
+import os
+import glob
+import time
+import collections
+
+import numpy as np
+
+#全プロセス（カメラ、ミラー、LDV、メイン）で共通の時計と、時刻で引けるセッションの索引
+#撮影したフレーム、ミラーへの指令、LDVの計測データに同じ時計の時刻を付けておき、
+#解析ではSessionIndexで「ある速度のサンプルを計測した時の指先の位置（追従の状態）」を時刻の二分探索(O(log n))で求める
+#
+#時計はtime.perf_counter_ns()（Windowsではプロセス間で共通の時計、instrumentationやmirrorChannelと同じ）
+#セッションの起点(startSession)は環境変数で子プロセスに引き継ぐ（索引には時計の値をそのまま保存し、起点も一緒に保存する）
+#デバイスの時刻（カメラのタイムスタンプ、LDVのサンプル番号）はClockMappingでこの時計に換算する
+#
+#使い方:
+#  sessionClock.startSession(directory)              #メインプロセスで子プロセスを起動する前に1回
+#  index = sessionClock.sessionIndex("camera")       #各プロセスで
+#  index.append("frames", sessionClock.now_ns(), distance_x=..., distance_y=...)
+#  sessionClock.saveIndex()                          #プロセスの最後に
+#  index = sessionClock.SessionIndex.loadSession(directory)   #解析で全プロセスの索引をまとめて読む
+#  frame = index.at("frames", index.sampleTimes("ldv", 0))    #LDVの各サンプルの時点での最新のフレーム
+
+SESSION_EPOCH_ENV = "SYSTEM_SESSION_EPOCH_NS"
+SESSION_WALL_ENV = "SYSTEM_SESSION_WALL"
+SESSION_DIR_ENV = "SYSTEM_SESSION_DIR"
+INDEX_SUFFIX = ".index.npz"
+
+
+def now_ns():
+    return time.perf_counter_ns()
+
+
+def now():
+    #[s]、time.perf_counter()と同じ時計（StageTimer、録画のタイムスタンプなど）
+    return time.perf_counter()
+
+
+def startSession(directory=None):
+    """
+    セッションの起点を今にする（これから起動する子プロセスにも引き継がれる）
+    directory: 各プロセスの索引の保存先、Noneなら保存しない
+    戻り値: 起点の時刻[ns]
+    """
+    epoch_ns = now_ns()
+    os.environ[SESSION_EPOCH_ENV] = str(epoch_ns)
+    os.environ[SESSION_WALL_ENV] = repr(time.time())
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        os.environ[SESSION_DIR_ENV] = directory
+    return epoch_ns
+
+
+def sessionEpoch():
+    #セッションの起点[ns]、startSessionの前は0（時計の値そのまま）
+    return int(os.environ.get(SESSION_EPOCH_ENV, 0))
+
+
+def sessionDirectory():
+    return os.environ.get(SESSION_DIR_ENV)
+
+
+def sessionTime(t_ns=None):
+    #時計の値[ns] → セッションの起点からの時間[s]
+    return ((now_ns() if t_ns is None else t_ns) - sessionEpoch())/1e9
+
+
+def wallTime(t_ns):
+    #時計の値[ns] → time.time()の時刻（ファイルのヘッダなど、人が読む時刻に使う）
+    if SESSION_WALL_ENV not in os.environ:
+        return time.time() - (now_ns() - t_ns)/1e9
+    return float(os.environ[SESSION_WALL_ENV]) + (t_ns - sessionEpoch())/1e9
+
+
+class ClockMapping:
+    """
+    デバイスの時刻（カメラのタイムスタンプ、LDVのサンプル番号など） → 時計の値[ns]
+    (デバイスの時刻, 受け取った時の時計の値)の組をaddし、直近window組に直線を当てはめる（傾きはデバイスの時計の進み方の違い）
+    受け取るまでの遅れは常に正でばらつくため、切片は遅れが最も小さい組（下側の包絡線）に合わせる
+    ns_per_tick: デバイスの時刻1あたりの時間[ns]の公称値（組が1つの時や傾きを求められない時に使う）
+    refit_every: 傾きを当てはめ直す間隔（組の数）、間の組では切片だけを更新する
+    """
+    def __init__(self, ns_per_tick=1.0, window=256, refit_every=64):
+        self.ns_per_tick = ns_per_tick
+        self.refit_every = refit_every
+        self.__pairs = collections.deque(maxlen=window)
+        self.__origin = None    #(デバイスの時刻, 時計の値)、桁落ちを避けるためこの組からの差で計算する
+        self.__slope = float(ns_per_tick)
+        self.__intercept = None
+        self.__added = 0
+
+    @classmethod
+    def fromPairs(cls, pairs, ns_per_tick=1.0):
+        #(デバイスの時刻, 時計の値)の組の列にまとめて当てはめる（LDVの1回の計測のチャンクごとの時刻など）
+        pairs = list(pairs)
+        mapping = cls(ns_per_tick, window=max(len(pairs), 1), refit_every=max(len(pairs), 1))
+        for device_time, host_ns in pairs:
+            mapping.add(device_time, host_ns)
+        return mapping
+
+    def __len__(self):
+        return len(self.__pairs)
+
+    def add(self, device_time, host_ns):
+        if self.__origin is None:
+            self.__origin = (device_time, host_ns)
+        d = float(device_time - self.__origin[0])
+        h = float(host_ns - self.__origin[1])
+        self.__pairs.append((d, h))
+        self.__added += 1
+        if self.__added % self.refit_every == 0:
+            self.__refit()
+        elif self.__intercept is None or h - self.__slope*d < self.__intercept:
+            self.__intercept = h - self.__slope*d
+
+    def __refit(self):
+        pairs = np.array(self.__pairs)
+        d, h = pairs[:, 0], pairs[:, 1]
+        if d.max() > d.min():
+            self.__slope = float(np.polyfit(d, h, 1)[0])
+        self.__intercept = float(np.min(h - self.__slope*d))
+
+    @property
+    def ns_per_tick_fitted(self):
+        return self.__slope
+
+    def toHost(self, device_time):
+        #デバイスの時刻（配列可） → 時計の値[ns]
+        if self.__origin is None:
+            raise ValueError("no clock pairs added")
+        if isinstance(device_time, np.ndarray):
+            d = (device_time - self.__origin[0]).astype(np.float64)
+            return self.__origin[1] + np.rint(self.__intercept + self.__slope*d).astype(np.int64)
+        return self.__origin[1] + int(round(self.__intercept + self.__slope*float(device_time - self.__origin[0])))
+
+
+class SessionIndex:
+    """
+    時刻順に追加される記録の列(stream)の集まり（"frames", "commands", "ldv"など）
+    appendは行をリストに追加するだけなので、追従のループの中で呼べる
+    at, joinは時刻の列を二分探索する（np.searchsorted、1件あたりO(log n)）
+    """
+    def __init__(self):
+        self.__fields = {}  #stream → 列名(先頭は"t_ns")
+        self.__rows = {}    #stream → [行]
+        self.__arrays = {}  #stream → {列名: 配列}（arraysで作り、appendで破棄する）
+
+    def append(self, stream, t_ns, **values):
+        #t_ns: 時計の値[ns]、values: 数値の列（streamごとに最初のappendと同じ列名）
+        rows = self.__rows.get(stream)
+        if rows is None:
+            self.__fields[stream] = ("t_ns",) + tuple(values)
+            rows = self.__rows[stream] = []
+        rows.append((t_ns,) + tuple(values.values()))
+        self.__arrays.pop(stream, None)
+
+    def streams(self):
+        return list(self.__fields)
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.__rows.values())
+
+    def count(self, stream):
+        return len(self.__rows.get(stream, ()))
+
+    def arrays(self, stream):
+        #{列名: 配列}、t_nsの順に並べ替えたもの
+        arrays = self.__arrays.get(stream)
+        if arrays is None:
+            fields = self.__fields[stream]
+            rows = self.__rows[stream]
+            table = np.array(rows, dtype=np.float64).reshape(len(rows), len(fields))
+            t_ns = np.array([row[0] for row in rows], dtype=np.int64)#float64ではnsの桁が落ちるため別に作る
+            order = np.argsort(t_ns, kind="stable")
+            arrays = {"t_ns": t_ns[order]}
+            for n, field in enumerate(fields[1:], start=1):
+                arrays[field] = table[order, n]
+            self.__arrays[stream] = arrays
+        return arrays
+
+    def at(self, stream, t_ns, tolerance_ns=None):
+        """
+        時刻t_ns（配列可）の時点でのstreamの最新の記録の番号（arrays(stream)の行）
+        それより前に記録がない場合、tolerance_nsより古い記録しかない場合は-1
+        """
+        times = self.arrays(stream)["t_ns"]
+        index = np.searchsorted(times, t_ns, side="right") - 1
+        if tolerance_ns is not None:
+            stale = np.asarray(t_ns) - times[np.maximum(index, 0)] > tolerance_ns
+            index = np.where(stale, -1, index)
+        return index
+
+    def nearest(self, stream, t_ns):
+        #時刻t_ns（配列可）に最も近いstreamの記録の番号
+        times = self.arrays(stream)["t_ns"]
+        right = np.clip(np.searchsorted(times, t_ns), 1, max(times.size - 1, 1))
+        left = right - 1
+        if times.size < 2:
+            return np.zeros_like(right)
+        return np.where(np.abs(times[left] - t_ns) <= np.abs(times[right] - t_ns), left, right)
+
+    def join(self, left, right, tolerance_ns=None):
+        """
+        leftの各記録に、その時点でのrightの最新の記録を付ける
+        戻り値: {left の列, right の列（"right名.列名"）}、対応する記録がない行はnan（t_nsは-1）
+        """
+        left_arrays = self.arrays(left)
+        right_arrays = self.arrays(right)
+        index = self.at(right, left_arrays["t_ns"], tolerance_ns)
+        valid = index >= 0
+        joined = dict(left_arrays)
+        for field, values in right_arrays.items():
+            if field == "t_ns":
+                joined[f"{right}.t_ns"] = np.where(valid, values[np.maximum(index, 0)], -1)
+            else:
+                joined[f"{right}.{field}"] = np.where(valid, values[np.maximum(index, 0)], np.nan)
+        return joined
+
+    def sampleTimes(self, stream, row):
+        #streamのrow番目の記録が表すサンプル列（列"sample_count"と"ns_per_sample"を持つ記録、LDVの計測など）の各サンプルの時刻[ns]
+        arrays = self.arrays(stream)
+        count = int(arrays["sample_count"][row])
+        return arrays["t_ns"][row] + np.rint(np.arange(count)*arrays["ns_per_sample"][row]).astype(np.int64)
+
+    def save(self, file_name):
+        #streamごとの列を"stream/列名"としてnpzに保存する
+        data = {"epoch_ns": np.int64(sessionEpoch())}
+        for stream in self.__fields:
+            for field, values in self.arrays(stream).items():
+                data[f"{stream}/{field}"] = values
+        np.savez(file_name, **data)
+        return file_name
+
+    def extend(self, file_name):
+        #saveしたnpzの記録を追加する
+        data = np.load(file_name)
+        columns = collections.defaultdict(dict)
+        for key in data.files:
+            if "/" in key:
+                stream, field = key.split("/", 1)
+                columns[stream][field] = data[key]
+        for stream, arrays in columns.items():
+            fields = ["t_ns"] + [field for field in arrays if field != "t_ns"]
+            if stream in self.__fields and tuple(fields) != self.__fields[stream]:
+                raise ValueError(f"{file_name}: columns of {stream} differ: {fields} != {list(self.__fields[stream])}")
+            self.__fields[stream] = tuple(fields)
+            rows = self.__rows.setdefault(stream, [])
+            rows.extend(zip(arrays["t_ns"].tolist(), *(arrays[field].tolist() for field in fields[1:])))
+            self.__arrays.pop(stream, None)
+
+    @classmethod
+    def load(cls, *file_names):
+        index = cls()
+        for file_name in file_names:
+            index.extend(file_name)
+        return index
+
+    @classmethod
+    def loadSession(cls, directory=None):
+        #directory（Noneなら環境変数のセッションのディレクトリ）の全プロセスの索引をまとめて読む
+        directory = directory or sessionDirectory()
+        return cls.load(*sorted(glob.glob(os.path.join(directory, "*" + INDEX_SUFFIX))))
+
+
+_index = None
+_index_name = None
+_index_pid = None
+
+
+def sessionIndex(process_name="main"):
+    #このプロセスのSessionIndex（プロセスごとに1つ）
+    global _index, _index_name, _index_pid
+    if _index is None or _index_pid != os.getpid():#forkで親プロセスの記録を引き継いだ場合は初めからにする
+        _index = SessionIndex()
+        _index_name = process_name
+        _index_pid = os.getpid()
+    return _index
+
+
+def saveIndex(directory=None):
+    """
+    このプロセスのSessionIndexをdirectory/プロセス名_pid.index.npzに保存する
+    directory: Noneならセッションのディレクトリ（startSessionで指定しなかった場合は保存しない）
+    戻り値: 保存先（保存しなかった場合はNone）
+    """
+    directory = directory or sessionDirectory()
+    if _index is None or _index_pid != os.getpid() or not directory or len(_index) == 0:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return _index.save(os.path.join(directory, f"{_index_name}_{os.getpid()}{INDEX_SUFFIX}"))
+
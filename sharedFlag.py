@@ -1,5 +1,8 @@
 import cv2
-import winsound
+try:
+    import winsound
+except ImportError:#Windows以外
+    winsound = None
 import time
 
 DataAcquiring = False
@@ -0,0 +1,289 @@
+import os
+import functools
+from dataclasses import dataclass, field
+
+import numpy as np
+import scipy.signal
+
+import captureFile
+
+#LDVデータの解析（計算のみ）
+#matplotlibを使わず、結果を型付きのオブジェクト(dataclass)で返す。図の作成はsignalPlot、
+#ファイルを読んで解析して図を保存する従来の関数はsignalProcessingにある
+#大量の計測データをまとめて処理する時はこのモジュールだけを使えば、図を作らずにNumPyの速度で計算できる
+
+M_TO_UM = 10**6        #mからμmへの変換
+HIGHPASS_CUTOFF = 50   #変位データに掛けるハイパスフィルタのカットオフ周波数[Hz]
+LOWPASS_CUTOFF = 50    #速度データに掛けるローパスフィルタのカットオフ周波数[Hz]
+FILTER_ORDER = 4       #フィルタの次数
+
+#パワーを比較する周波数帯[Hz]、[下限, 上限)
+DEFAULT_BANDS = ((50, 100), (100, 200), (200, 400), (400, 600), (600, 1000))
+
+
+def load_signal(file_name):
+    #拡張子なしのfile_nameから計測データを読み込む
+    #バイナリ形式(file_name.ldv)があればnp.memmapで読み、なければ従来のテキスト形式(file_name.txt)をloadtxtで読む
+    if os.path.exists(captureFile.capture_path(file_name)):
+        data, _ = captureFile.read_capture(file_name)
+        return data
+    return np.loadtxt(file_name+'.txt')
+
+
+def to_db(power):
+    #パワースペクトルをdBスケールに変換 (0の対数を避けるため微小値1e-18を加算)
+    return 10 * np.log10(power + 1e-18)
+
+
+#---フィルタ
+def butter_highpass_fillter(x, N, Wn, fs):
+    #N = フィルタ次数
+    #Wn = カットオフ周波数
+    #fs = サンプリング周波数
+    #xが(計測数, サンプル数)の場合は各計測に一括でフィルタを掛ける
+    sos = scipy.signal.butter(N, Wn, "highpass", False, "sos", fs)
+    return scipy.signal.sosfiltfilt(sos, x, axis=-1, padtype='odd', padlen=None)
+
+def butter_lowpass_fillter(x, N, Wn, fs):
+    sos = scipy.signal.butter(N, Wn, "lowpass", False, "sos", fs)
+    return scipy.signal.sosfiltfilt(sos, x, axis=-1, padtype='odd', padlen=None)
+
+def preprocess_displacement(displacement, sampling_rate):
+    #変位[m]をμmに変換し、低周波のドリフトをハイパスフィルタで除去する（各解析の共通の前処理）
+    return butter_highpass_fillter(np.asarray(displacement) * M_TO_UM, FILTER_ORDER, HIGHPASS_CUTOFF, sampling_rate)
+#フィルタ---
+
+
+#---周波数応答補正
+#周波数応答補正の較正表 [周波数[Hz], γ]、補正ゲインは r**γ(f)
+#gamma_table.csvがあればそちらを読み込む（load_gamma_tableで別の表に差し替えも可能）
+DEFAULT_GAMMA_TABLE = np.array([[20 , 1.30],
+                                [50 , 1.24],
+                                [100, 1.10],
+                                [200, 1.08],
+                                [250, 1.10],
+                                [300, 1.20],
+                                [500, 1.11],
+                                [1000,1.27]])
+GAMMA_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gamma_table.csv')
+gamma_table = DEFAULT_GAMMA_TABLE
+
+def load_gamma_table(file_name=GAMMA_TABLE_FILE):
+    #「周波数,γ」の2列のcsv（#から始まる行はコメント）を較正表として読み込み、キャッシュ済みの補正ゲインを破棄する
+    global gamma_table
+    table = np.loadtxt(file_name, delimiter=',', comments='#', ndmin=2)
+    gamma_table = table[np.argsort(table[:, 0])]
+    _correction_gain.cache_clear()
+    return gamma_table
+
+def gamma_curve(freq, table=None):
+    #周波数の配列に対するγをnp.interpで一括計算する
+    #較正表の範囲外（最小周波数未満、最大周波数以上、負の周波数）は0（補正なし: r**0 = 1）
+    if table is None:
+        table = gamma_table
+    freq = np.asarray(freq, dtype=np.float64)
+    values = np.interp(freq, table[:, 0], table[:, 1])
+    return np.where((freq >= table[0, 0]) & (freq < table[-1, 0]), values, 0.0)
+
+def gamma(freq):
+    #スカラー版（従来の関数と同じ呼び出し方）
+    return float(gamma_curve(freq))
+
+@functools.lru_cache(maxsize=16)
+def _correction_gain(sample_count, dt, r):
+    #rfftの各ビンに掛ける補正ゲイン r**γ(f)、(sample_count, dt, r)ごとに一度だけ計算してキャッシュする
+    f = np.fft.rfftfreq(sample_count, dt)
+    gain = r ** gamma_curve(f)
+    gain[0] = 0 #直流成分を除去
+    gain.setflags(write=False)
+    return gain
+
+if os.path.exists(GAMMA_TABLE_FILE):
+    load_gamma_table(GAMMA_TABLE_FILE)
+
+def correct(x_um, r, sample_count, dt):
+    #μm単位の変位x_umに周波数応答補正を掛ける、rはmm
+    X = np.fft.rfft(x_um, n=sample_count, axis=-1)
+    X *= _correction_gain(sample_count, dt, r)
+    return np.fft.irfft(X, n=sample_count, axis=-1)
+#周波数応答補正---
+
+
+#---スペクトル計算エンジン
+#1つまたは複数の計測データ（同じ長さ）の全フレームをsliding_window_viewでコピーせずに2次元(3次元)のviewとして切り出し、
+#フレーム方向に一括でrfftする。STFT、Welch法、group_comparisonはこの結果を使う
+
+def frame_signals(signals, window_length, hop_size, num_frames=None):
+    #signals: (サンプル数,) または (計測数, サンプル数)
+    #戻り値: (計測数, フレーム数, window_length) のview（窓長より短い信号はゼロ埋めして1フレームとする）
+    signals = np.atleast_2d(np.asarray(signals))
+    if hop_size <= 0:
+        raise ValueError("Hop size must be positive. window_length must be greater than overlap_samples.")
+    if signals.shape[-1] < window_length:
+        padded = np.zeros(signals.shape[:-1] + (window_length,), dtype=signals.dtype)
+        padded[..., :signals.shape[-1]] = signals
+        signals = padded
+    frames = np.lib.stride_tricks.sliding_window_view(signals, window_length, axis=-1)[..., ::hop_size, :]
+    if num_frames is not None:
+        frames = frames[..., :num_frames, :]
+    return frames
+
+def batch_rfft(signals, window_length, overlap_samples=None, num_frames=None):
+    #全計測・全フレームにハニング窓をかけて一括でrfftする
+    #戻り値: (計測数, フレーム数, window_length//2+1) の複素スペクトル
+    if overlap_samples is None:
+        overlap_samples = window_length // 2
+    frames = frame_signals(signals, window_length, window_length - overlap_samples, num_frames)
+    win = np.hanning(window_length)
+    return np.fft.rfft(frames * win, n=window_length, axis=-1)
+
+def welch_psd(signals, sampling_rate, window_length, overlap_samples=None, num_frames=None):
+    #Welch法：各フレームのパワースペクトル（ピリオドグラム）を周波数ビンごとに平均する
+    #戻り値: (周波数軸, (計測数, ビン数)のパワースペクトル)
+    S = batch_rfft(signals, window_length, overlap_samples, num_frames)
+    averaged_psd = np.mean(np.abs(S)**2, axis=-2)
+    freq_axis = np.fft.rfftfreq(window_length, 1/sampling_rate)
+    return freq_axis, averaged_psd
+
+def spectrogram(signals, dt, window_length, noverlap=None, num_frames=None):
+    #戻り値: (周波数軸, 各フレームの中心時刻, (計測数, ビン数, フレーム数)の複素スペクトル)
+    if noverlap is None:
+        noverlap = window_length // 2
+    S = batch_rfft(signals, window_length, noverlap, num_frames)
+    frame_start_indices = np.arange(S.shape[-2]) * (window_length - noverlap)
+    frame_times = (frame_start_indices + window_length / 2) * dt
+    freq_axis = np.fft.rfftfreq(window_length, dt)
+    return freq_axis, frame_times, np.swapaxes(S, -1, -2)
+#スペクトル計算エンジン---
+
+
+#---解析結果
+@dataclass
+class Spectrum:
+    freq: np.ndarray     #周波数軸[Hz] (rfft)
+    power: np.ndarray    #パワースペクトル[μm^2]、直流成分は0
+    signal: np.ndarray   #解析した時間波形[μm]（フィルタ前）
+    dt: float
+
+    @property
+    def time(self):
+        return np.arange(self.signal.shape[-1]) * self.dt
+
+@dataclass
+class WelchPSD:
+    freq: np.ndarray     #周波数軸[Hz]
+    power: np.ndarray    #平均パワースペクトル、(ビン数,) または (計測数, ビン数)
+    signal: np.ndarray   #解析した時間波形[μm]（ハイパスフィルタ後）
+    sampling_rate: float
+    window_length: int
+    overlap_samples: int
+    num_frames: int
+
+    @property
+    def power_db(self):
+        return to_db(self.power)
+
+    @property
+    def time(self):
+        return np.arange(self.signal.shape[-1]) / self.sampling_rate
+
+@dataclass
+class Spectrogram:
+    freq: np.ndarray         #周波数軸[Hz]
+    times: np.ndarray        #各フレームの中心時刻[s]
+    power: np.ndarray        #(ビン数, フレーム数)のパワー（複数の計測をまとめて渡した場合は(計測数, ビン数, フレーム数)）、直流成分は0
+    welch_power: np.ndarray  #全フレームの平均パワー（直流成分を含む）、(ビン数,)または(計測数, ビン数)
+    signal: np.ndarray       #解析した時間波形[μm]（ハイパスフィルタ後）
+    dt: float
+
+    @property
+    def power_db(self):
+        return to_db(self.power)
+
+    @property
+    def welch_power_db(self):
+        return to_db(self.welch_power)
+
+    @property
+    def time(self):
+        return np.arange(self.signal.shape[-1]) * self.dt
+
+@dataclass
+class BandPowers:
+    bands: tuple         #((下限, 上限), ...)[Hz]
+    power: np.ndarray    #各周波数帯のパワーの合計、(帯数,) または (計測数, 帯数)
+
+    @property
+    def power_db(self):
+        return to_db(self.power)
+
+    def as_dict(self):
+        return {f"{lo}-{hi}Hz": p for (lo, hi), p in zip(self.bands, np.asarray(self.power).T.tolist())}
+
+@dataclass
+class VelocityAverage:
+    mean: float                      #速度の平均[m/s]
+    filtered_mean: float             #ローパスフィルタ後の速度の平均[m/s]
+    velocity: np.ndarray = field(repr=False)
+    filtered_velocity: np.ndarray = field(repr=False)
+    dt: float = 0.0
+#解析結果---
+
+
+#---解析
+def spectrum(displacement, dt):
+    #計測データ全体のパワースペクトル（フィルタ後の波形をFFT）
+    #displacement: 変位[m]
+    signal = np.asarray(displacement) * M_TO_UM
+    filtered = butter_highpass_fillter(signal, FILTER_ORDER, HIGHPASS_CUTOFF, 1/dt)
+    power = np.abs(np.fft.rfft(filtered, axis=-1))**2
+    power[..., 0] = 0
+    freq = np.fft.rfftfreq(signal.shape[-1], dt)
+    return Spectrum(freq, power, signal, dt)
+
+def welch(displacement, sampling_rate, window_length, overlap_samples=None):
+    #Welch法のパワースペクトル
+    #displacement: 変位[m]、(サンプル数,) または 同じ長さの計測を並べた(計測数, サンプル数)
+    if overlap_samples is None:
+        overlap_samples = window_length // 2
+    hop_size = window_length - overlap_samples
+    if hop_size <= 0:
+        raise ValueError("Hop size must be positive. window_length must be greater than overlap_samples.")
+    signal = preprocess_displacement(displacement, sampling_rate)
+    #信号長が窓長より短い場合はゼロパディングした1フレームとして扱う
+    num_frames = max(1, (signal.shape[-1] - window_length) // hop_size + 1)
+    freq, power = welch_psd(signal, sampling_rate, window_length, overlap_samples, num_frames)
+    if signal.ndim == 1:
+        power = power[0]
+    return WelchPSD(freq, power, signal, sampling_rate, window_length, overlap_samples, num_frames)
+
+def stft(displacement, dt, Lf, noverlap=None):
+    #短時間フーリエ変換（スペクトログラム）
+    #Lf = 切り出す窓の長さ
+    if noverlap is None:
+        noverlap = Lf//2
+    signal = preprocess_displacement(displacement, 1/dt)
+    l = signal.shape[-1]
+    Nf = int(np.ceil((l-noverlap)/(Lf-noverlap)))-1
+    freq, times, S = spectrogram(signal, dt, Lf, noverlap, num_frames=Nf)
+    power = np.abs(S)**2
+    if signal.ndim == 1:
+        power = power[0]
+    welch_power = np.mean(power, axis=-1)
+    power[..., 0, :] = 0
+    return Spectrogram(freq, times, power, welch_power, signal, dt)
+
+def band_powers(psd, bands=DEFAULT_BANDS):
+    #WelchPSD(またはSpectrum)の周波数帯ごとのパワーの合計、周波数帯は[下限, 上限)
+    power = np.atleast_2d(psd.power)
+    result = np.stack([power[:, (psd.freq >= lo) & (psd.freq < hi)].sum(axis=-1) for lo, hi in bands], axis=-1)
+    if np.ndim(psd.power) == 1:
+        result = result[0]
+    return BandPowers(tuple(bands), result)
+
+def velocity_average(velocity, dt):
+    #速度の平均と、ローパスフィルタ後の速度の平均
+    velocity = np.asarray(velocity)
+    filtered = butter_lowpass_fillter(velocity, FILTER_ORDER, LOWPASS_CUTOFF, 1/dt)
+    return VelocityAverage(float(np.mean(velocity)), float(np.mean(filtered)), velocity, filtered, dt)
+#解析---
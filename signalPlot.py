@@ -0,0 +1,144 @@
+import numpy as np
+import matplotlib as mpl
+import matplotlib.patheffects as path_effects
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+#signalAnalysisの解析結果の図を作成する
+#pyplotを使わずFigureを直接作りAggで描画するため、GUI(TkAgg)がなくても、別プロセスからでも使える
+#pyplotの図と違い、参照がなくなれば図は破棄される（plt.figure()を大量に作ってメモリが増えることがない）
+#各関数はFigureを返し、pathを指定した場合は保存もする
+
+#論文用の図の設定（STFT、Welch法の図で共通、font.sizeは図ごとに指定する）
+PAPER_STYLE = {'xtick.direction': 'in',
+               'xtick.top': True,
+               'xtick.major.size': 6,
+               'xtick.minor.size': 3,
+               'xtick.minor.visible': True,
+               'ytick.direction': 'in',
+               'ytick.right': True,
+               'ytick.major.size': 6,
+               'ytick.minor.size': 3,
+               'ytick.minor.visible': True,
+               'font.family': 'Arial',
+               'agg.path.chunksize': 10000,       #チャンクサイズを増やす
+               'path.simplify_threshold': 0.12}   #パス簡略化の閾値を増やす
+
+
+def new_figure(figsize=None, dpi=None):
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+def _style(font_size=None):
+    style = dict(PAPER_STYLE)
+    if font_size is not None:
+        style['font.size'] = font_size
+    return mpl.rc_context(style)
+
+def _save(fig, path):
+    if path is not None:
+        fig.savefig(path)
+    return fig
+
+
+def plot_time_series(t, y, ylabel, path=None, title=None):
+    fig = new_figure()
+    ax = fig.add_subplot()
+    ax.set_xlabel('time [s]')
+    ax.set_ylabel(ylabel)
+    if title is not None:
+        ax.set_title(title)
+    if y is not None:
+        ax.plot(t, y)
+    return _save(fig, path)
+
+def plot_spectrum(spectrum, path=None, freq_max=600):
+    #Spectrumのパワースペクトル（ナイキスト周波数未満）
+    N = spectrum.signal.shape[-1]
+    freq_min = spectrum.freq[0]
+    fig = new_figure()
+    ax = fig.add_subplot()
+    ax.set_xlabel('Freq [Hz]')
+    ax.set_xlim(freq_min, freq_max)
+    ax.set_ylabel('Power spectol [μm^2]')
+    ax.plot(spectrum.freq[0:int(N/2)], spectrum.power[0:int(N/2)])
+    return _save(fig, path)
+
+def plot_spectrogram(spec, path=None, freq_bottum=50, freq_upper=600, vmin=15, vmax=90, ylim=(-15, 15)):
+    #上段に時間波形、下段にスペクトログラム[dB]
+    with _style(font_size=30):
+        fig = new_figure(figsize=(16, 9), dpi=150)
+
+        # プロット枠 (axes) の設定
+        ax1 = fig.add_axes([0.15, 0.62, 0.70, 0.35])
+        ax_sp1 = fig.add_axes([0.15, 0.12, 0.70, 0.35])
+        cb_sp1 = fig.add_axes([0.87, 0.12, 0.02, 0.35])
+
+        duration = spec.dt * spec.signal.shape[-1]
+        # 元データのプロット
+        ax1.set_xlim(0.0, duration)
+        ax1.set_xlabel('time [s]')
+        ax1.tick_params(labelbottom=True, labelsize=20)
+        ax1.set_ylabel('Pos [μm]')
+        ax1.set_ylim(*ylim)#10μm、bensmaiaに合わせた
+        ax1.plot(spec.time, spec.signal, c='black')
+
+        # スペクトログラムのプロット
+        ax_sp1.set_xlim(0.0, duration)
+        ax_sp1.set_xlabel('time [s]')
+        ax_sp1.tick_params(labelbottom=True, labelsize=20)
+        ax_sp1.set_ylim(freq_bottum, freq_upper)
+        ax_sp1.set_ylabel('Freq [Hz]')
+
+        norm = mpl.colors.Normalize(vmin, vmax)
+        cmap = mpl.cm.jet
+        ax_sp1.contourf(spec.times, spec.freq, spec.power_db,
+                        norm=norm,
+                        levels=512,
+                        cmap=cmap)
+        ax_sp1.text(0.99, 0.97, "spectrogram", color='white', ha='right', va='top',
+                    path_effects=[path_effects.Stroke(linewidth=2, foreground='black'),
+                                  path_effects.Normal()],
+                    transform=ax_sp1.transAxes)
+        mpl.colorbar.ColorbarBase(cb_sp1, cmap=cmap,
+                                  norm=norm,
+                                  orientation="vertical",
+                                  label='PS [dB]')
+        return _save(fig, path)
+
+def plot_welch(psd, path=None, freq_min_plot=50, freq_max_plot=600, ylim=(40, 100)):
+    #上段に時間波形、下段にWelch法のパワースペクトル[dB]
+    with _style(font_size=20):
+        fig = new_figure(figsize=(16, 12), dpi=150)
+        num_samples = psd.signal.shape[-1]
+
+        # --- 元データのプロット (上段) ---
+        ax1 = fig.add_axes([0.1, 0.60, 0.8, 0.35]) # プロット領域の座標 [left, bottom, width, height]
+        ax1.set_xlim(0.0, num_samples/psd.sampling_rate) # 時間軸の表示範囲を信号全体に設定
+        ax1.set_xlabel('Time [s]')
+        ax1.tick_params(labelbottom=True, labelsize=16)
+        ax1.set_ylim(-15,15)
+        ax1.set_ylabel('Pos [μm]')
+        ax1.plot(psd.time, psd.signal, c='black')
+        ax1.set_title("Time-Domain Displacement Signal")
+
+        # --- Welch PSDのプロット (下段) ---
+        ax_psd = fig.add_axes([0.1, 0.10, 0.8, 0.40])
+        # 論文の記述「frequency components below 50 Hz are ignored」に合わせて、プロット開始点を50Hzに設定
+        ax_psd.set_xlim(freq_min_plot, freq_max_plot)
+        ax_psd.set_xlabel('Freq [Hz]')
+        ax_psd.tick_params(labelbottom=True, labelsize=16)
+        ax_psd.set_ylim(*ylim)
+        ax_psd.set_ylabel('Power Spectral [dB]')
+        ax_psd.set_title("Power Spectral (Welch's Method)")
+        ax_psd.plot(psd.freq, psd.power_db, c='blue')
+        return _save(fig, path)
+
+def plot_velocity_average(average, path=None, filtered_path=None):
+    #速度の平均をタイトルにした図（速度波形自体は描かない、従来のvelocity_averageと同じ）
+    t = np.arange(average.velocity.shape[-1]) * average.dt
+    fig = plot_time_series(t, None, 'Vel [m/s]', path, title=f"velocity_average: {average.mean} [m/s]")
+    filtered_fig = plot_time_series(t, None, 'filtered_Vel [m/s]', filtered_path,
+                                    title=f"filtered_velocity_average: {average.filtered_mean} [m/s]")
+    return fig, filtered_fig
@@ -0,0 +1,392 @@
+import os
+import time
+import math
+import collections
+
+import cv2
+import numpy as np
+
+#実機(カメラ、ミラー、LDV、ロボットアーム)の代わりに使うシミュレーション
+#実機と同じ呼び方のクラスを用意し、環境変数SYSTEM_SIMULATEで選んだ機器だけを置き換える
+#（子プロセスにも環境変数は引き継がれるため、main.run_endlessの全プロセスで同じ設定になる）
+#
+#  SYSTEM_SIMULATE=all                 : すべてシミュレーション
+#  SYSTEM_SIMULATE=camera,mirror       : カメラとミラーだけシミュレーション（LDVとロボットアームは実機）
+#  未設定                              : すべて実機
+#
+#  camera : SimulatedCamera、移動する白い円（指先）を描いた画像を露光時間から決まるフレームレートで返す（pylon.InstantCameraの代わり）
+#  mirror : SimulatedMirror、指令された角度を時刻と共に記録し、1回の書き込みに設定した時間だけかかる（optoMDCのボードの代わり）
+#  ldv    : SimulatedDataAcquisition、218.75 kHzの速度データを実時間で生成する（polytecのDataAcquisitionの代わり）
+#  arm    : SimulatedArm、移動距離/速度の時間だけ待つ（XArmAPIの代わり）
+
+SIMULATE_ENV = "SYSTEM_SIMULATE"
+DEVICES = ("camera", "mirror", "ldv", "arm")
+
+
+def simulatedDevices():
+    value = os.environ.get(SIMULATE_ENV, "").strip().lower()
+    if value in ("", "0", "none"):
+        return set()
+    if value in ("1", "all"):
+        return set(DEVICES)
+    devices = {device.strip() for device in value.split(",") if device.strip()}
+    unknown = devices - set(DEVICES)
+    if unknown:
+        raise ValueError(f"{SIMULATE_ENV}: unknown devices {sorted(unknown)}, choose from {DEVICES}")
+    return devices
+
+def isSimulated(device):
+    return device in simulatedDevices()
+
+def enableSimulation(*devices):
+    #このプロセスと、これから起動する子プロセスで使う機器を設定する（引数なしならすべて）
+    os.environ[SIMULATE_ENV] = ",".join(devices) if devices else "all"
+
+
+def _waitUntil(deadline):
+    #time.sleepの分解能（Windowsでは数ms）より短い待ち時間は空回りで待つ
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > 0.002:
+            time.sleep(remaining - 0.001)
+
+
+#---カメラ
+
+IMAGE_SHAPE = (1080, 1440)  #(height, width)、撮影画像（縮小前）の大きさ
+
+def laserPoint(scale=0.5, shape=IMAGE_SHAPE):
+    #シミュレーションのレーザの照射位置（画像の中心、changeScale後の座標）
+    return (int(shape[1]*scale/2), int(shape[0]*scale/2))
+
+
+class SyntheticFrameSource:
+    """
+    黒背景に白い円（テンプレートと同じ形の指先）を描いた画像を時刻から生成する
+    motion : "linear" なら左から右へspeed_px_sで動き、右端を越えたら左端に戻る（createRealVelocityの動画と同じ動き）
+             "circle" なら画像の中心の周りを半径amplitude、周期periodで回る
+    """
+    def __init__(self, shape=IMAGE_SHAPE, radius=100, motion="linear", speed_px_s=400.0, amplitude=200.0, period=2.0, noise=0):
+        if motion not in ("linear", "circle"):
+            raise ValueError(f"unknown motion: {motion}")
+        self.shape = shape
+        self.radius = radius
+        self.motion = motion
+        self.speed_px_s = speed_px_s
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.__rng = np.random.default_rng(0)
+
+    def position(self, t):
+        #時刻t[s]の円の中心(x, y)[pixel]
+        height, width = self.shape
+        if self.motion == "linear":
+            return (self.speed_px_s*t) % width, height/2
+        phase = 2*math.pi*t/self.period
+        return width/2 + self.amplitude*math.cos(phase), height/2 + self.amplitude*math.sin(phase)
+
+    def render(self, t, offset=(0.0, 0.0)):
+        #offset: ミラーの角度による画像上の移動[pixel]
+        x, y = self.position(t)
+        image = np.zeros(self.shape, dtype=np.uint8)
+        cv2.circle(image, (int(round(x + offset[0])), int(round(y + offset[1]))), self.radius, 255, thickness=-1)
+        if self.noise > 0:
+            image = cv2.add(image, self.__rng.integers(0, self.noise, self.shape, dtype=np.uint8))
+        return image
+
+
+class _Parameter:
+    #pylonのパラメータ(camera.ExposureTimeなど)と同じ呼び方
+    def __init__(self, value):
+        self.value = value
+
+    def SetValue(self, value):
+        self.value = value
+
+    def GetValue(self):
+        return self.value
+
+
+class _GrabResult:
+    #TimeStamp: カメラのタイムスタンプ[ns]（撮影開始からの露光終了の時刻、実機と同じくホストの時計とは起点が違う）
+    def __init__(self, image, timestamp=0):
+        self.__image = image
+        self.TimeStamp = timestamp
+
+    def IsValid(self):
+        return self.__image is not None
+
+    def GrabSucceeded(self):
+        return self.__image is not None
+
+    def GetArray(self):
+        return self.__image
+
+    def Release(self):
+        self.__image = None
+
+
+class SimulatedCamera:
+    """
+    pylon.InstantCameraの代わり（controlCameraで使うメソッドのみ）
+    フレームレートは露光時間から決める(1/(露光時間+readout_ms))。撮影が遅れている時は最新の画像だけを返す（GrabStrategy_LatestImageOnly）
+    angle_source    : angle_source() -> 現在のミラー角度(X, Y)、指定した場合は角度に応じて画像上の円を動かす（追従の閉ループ）
+    pixels_per_angle: ミラー角度1あたりの画像上の移動[pixel]（縮小前）
+    """
+    def __init__(self, source=None, readout_ms=0.4, angle_source=None, pixels_per_angle=(0.0, 0.0)):
+        self.source = SyntheticFrameSource() if source is None else source
+        self.readout_ms = readout_ms
+        self.angle_source = angle_source
+        self.pixels_per_angle = pixels_per_angle
+        self.ExposureTime = _Parameter(1500.0)  #[us]
+        self.Gain = _Parameter(0.0)
+        self.frames = 0
+        self.__open = False
+        self.__t0 = None
+        self.__next = 0
+
+    def Attach(self, device=None):
+        pass
+
+    def Open(self):
+        self.__open = True
+
+    def IsOpen(self):
+        return self.__open
+
+    def Close(self):
+        self.StopGrabbing()
+        self.__open = False
+
+    @property
+    def fps(self):
+        return 1000/(self.ExposureTime.GetValue()/1000 + self.readout_ms)
+
+    def StartGrabbing(self, strategy=None):
+        self.__t0 = time.perf_counter()
+        self.__next = 0
+
+    def IsGrabbing(self):
+        return self.__t0 is not None
+
+    def StopGrabbing(self):
+        self.__t0 = None
+
+    def __render(self, t):
+        offset = (0.0, 0.0)
+        if self.angle_source is not None:
+            X, Y = self.angle_source()
+            offset = (X*self.pixels_per_angle[0], Y*self.pixels_per_angle[1])
+        self.frames += 1
+        return self.source.render(t, offset)
+
+    def RetrieveResult(self, timeout_ms, timeout_handling=None):
+        #次のフレームの露光が終わるまで待つ、timeout_ms以内に終わらない場合はNone
+        if self.__t0 is None:
+            raise RuntimeError("camera is not grabbing")
+        fps = self.fps
+        now = time.perf_counter()
+        index = max(self.__next, int((now - self.__t0)*fps))#遅れている時は古いフレームを飛ばす
+        t_frame = self.__t0 + (index + 1)/fps
+        if t_frame - now > timeout_ms/1000:
+            _waitUntil(now + timeout_ms/1000)
+            return None
+        _waitUntil(t_frame)
+        self.__next = index + 1
+        return _GrabResult(self.__render(t_frame - self.__t0), int((t_frame - self.__t0)*1e9))
+
+    def GrabOne(self, timeout_ms):
+        return _GrabResult(self.__render(time.perf_counter()))
+
+
+#---ミラー
+
+class SimulatedMirror:
+    """
+    optoMDCのボード(setMirror()の戻り値)とMirrorDriverの代わり
+    setXYは1回の書き込みにlatency_sかかり、指令された角度を(時刻, X, Y)としてsetpointsに記録する（直近max_records個）
+    """
+    def __init__(self, latency_s=0.0005, max_records=100000):
+        self.latency_s = latency_s
+        self.setpoints = collections.deque(maxlen=max_records)
+        self.X = 0.0
+        self.Y = 0.0
+        self.waveform = None        #(X_points, Y_points, sample_rate, cycles, 開始時刻)
+        self.waveform_running = False
+
+    def setXY(self, X, Y):
+        if self.latency_s > 0:
+            _waitUntil(time.perf_counter() + self.latency_s)
+        self.X, self.Y = X, Y
+        self.setpoints.append((time.perf_counter(), X, Y))
+
+    def playWaveform(self, X_points, Y_points, sample_rate, cycles=-1):
+        if len(X_points) != len(Y_points):
+            raise ValueError("X_points and Y_points must have the same length")
+        self.waveform = (list(X_points), list(Y_points), sample_rate, cycles, time.perf_counter())
+        self.waveform_running = True
+
+    def stopWaveform(self):
+        self.X, self.Y = self.currentXY()
+        self.waveform_running = False
+
+    def currentXY(self):
+        #現在の角度（波形の再生中は再生している点）
+        if not self.waveform_running:
+            return self.X, self.Y
+        X_points, Y_points, sample_rate, cycles, t_start = self.waveform
+        index = int((time.perf_counter() - t_start)*sample_rate)
+        if 0 <= cycles and index >= cycles*len(X_points):
+            index = len(X_points) - 1
+        return X_points[index % len(X_points)], Y_points[index % len(Y_points)]
+
+
+#---LDV
+
+LDV_SAMPLE_RATE = 218750    #[Hz]
+
+def toneSignal(tones=((120.0, 1e-3), (1000.0, 1e-4)), noise=1e-5, seed=0):
+    #signal(n, sample_rate) -> 速度[m/s]、(周波数[Hz], 振幅[m/s])の正弦波の和と白色雑音
+    rng = np.random.default_rng(seed)
+    def signal(n, sample_rate):
+        t = n / sample_rate
+        velocity = rng.normal(0.0, noise, n.size) if noise > 0 else np.zeros(n.size)
+        for frequency, amplitude in tones:
+            velocity += amplitude*np.sin(2*np.pi*frequency*t)
+        return velocity
+    return signal
+
+
+class SimulatedDataAcquisition:
+    """
+    polytecのDataAcquisitionの代わり（AcquisitionEngine、ContinuousAcquisitionが使うメソッドのみ）
+    start_data_acquisitionからの経過時間の分だけサンプルが溜まり、read_dataはその数が揃うまで待つ
+    読み出しがbuffer_samples以上遅れた場合は、実機でバッファが溢れた時と同じくデータ有効性(DataValidity)を0にする
+    """
+    def __init__(self, velocity_range=0.2, signal=None, sample_rate=LDV_SAMPLE_RATE, buffer_samples=2**22):
+        """
+        velocity_range: 速度のレンジ[m/s]（int32の最大値がこの速度になる）
+        signal        : signal(サンプル番号の配列, sample_rate) -> 速度[m/s]、NoneならtoneSignal()
+        """
+        self.velocity_range = velocity_range
+        self.signal = toneSignal() if signal is None else signal
+        self.sample_rate = sample_rate
+        self.buffer_samples = buffer_samples
+        self.max_value = 2**31 - 1
+        self.__t0 = None
+        self.__position = 0         #読み出したサンプル数
+        self.__velocity = np.empty(0, dtype=np.int32)
+        self.__validity = np.empty(0, dtype=np.int32)
+
+    @property
+    def scale_factor(self):
+        return self.velocity_range / self.max_value
+
+    def channel_max_value(self, channel_type):
+        return self.max_value
+
+    def base_sample_rate_in_hz(self):
+        return self.sample_rate
+
+    def start_data_acquisition(self):
+        self.__t0 = time.perf_counter()
+        self.__position = 0
+
+    def stop_data_acquisition(self):
+        self.__t0 = None
+
+    def available_samples(self):
+        if self.__t0 is None:
+            return 0
+        return int((time.perf_counter() - self.__t0)*self.sample_rate) - self.__position
+
+    def read_data(self, base_sample_count, timeout_ms):
+        if self.__t0 is None:
+            raise RuntimeError("data acquisition is not started")
+        end = self.__position + base_sample_count
+        t_ready = self.__t0 + end/self.sample_rate
+        if t_ready - time.perf_counter() > timeout_ms/1000:
+            raise TimeoutError(f"{base_sample_count} samples are not available in {timeout_ms} ms")
+        _waitUntil(t_ready)
+        n = np.arange(self.__position, end)
+        counts = np.clip(np.round(self.signal(n, self.sample_rate)/self.scale_factor), -self.max_value, self.max_value)
+        self.__velocity = counts.astype(np.int32)
+        valid = self.available_samples() < self.buffer_samples
+        self.__validity = np.full(base_sample_count, 1 if valid else 0, dtype=np.int32)
+        self.__position = end
+
+    def __chunk(self, channel_type):
+        from polytec.io.channel_type import ChannelType
+        return self.__validity if channel_type == ChannelType.DataValidity else self.__velocity
+
+    def extracted_sample_count(self, channel_type, channel_id):
+        return self.__chunk(channel_type).size
+
+    def get_int32_data_into(self, channel_type, channel_id, buffer, sample_count):
+        buffer[:sample_count] = self.__chunk(channel_type)[:sample_count]
+        return buffer[:sample_count]
+
+    def get_int32_data(self, channel_type, channel_id, sample_count):
+        return self.__chunk(channel_type)[:sample_count].copy()
+
+
+def connectDevice(sample_count, velocity_range=0.2, signal=None, base_samples_chunk_size=250):
+    #acquire_streaming.connect_deviceと同じ戻り値(device_communication, data_acquisition, block_size, limited_active_channels, base_samples_chunk_size)
+    from polytec.io.channel_type import ChannelType
+    data_acquisition = SimulatedDataAcquisition(velocity_range, signal)
+    limited_active_channels = [
+        {"Type": ChannelType.DataValidity, "ID": 0, "ScaleFactor": 1/data_acquisition.max_value, "Unit": "bool",
+         "Samples": None, "Overrange": None},
+        {"Type": ChannelType.Velocity, "ID": 0, "ScaleFactor": data_acquisition.scale_factor, "Unit": "m/s",
+         "Samples": None, "Overrange": None}]
+    return None, data_acquisition, sample_count, limited_active_channels, base_samples_chunk_size
+
+
+def parseVelocityRange(new_range):
+    #"200 mm/s"、"2 m/s"などのレンジの文字列を[m/s]にする
+    value, unit = new_range.replace("mm/s", " mm/s").split()[:2]
+    return float(value) * (1e-3 if unit == "mm/s" else 1.0)
+
+
+#---ロボットアーム
+
+class SimulatedArm:
+    #XArmAPIの代わり（controlRobotArmで使うメソッドのみ）、set_position(wait=True)は移動距離/速度の時間だけ待つ
+    def __init__(self, *args, **kwargs):
+        self.warn_code = 0
+        self.error_code = 0
+        self.position = [0.0, 0.0, 0.0]
+
+    def register_error_warn_changed_callback(self, callback):
+        pass
+
+    def clean_warn(self):
+        self.warn_code = 0
+
+    def clean_error(self):
+        self.error_code = 0
+
+    def motion_enable(self, enable=True):
+        pass
+
+    def set_mode(self, mode):
+        pass
+
+    def set_state(self, state):
+        pass
+
+    def set_position(self, x=None, y=None, z=None, roll=None, pitch=None, yaw=None, speed=100, wait=False, **kwargs):
+        target = [self.position[0] if x is None else x, self.position[1] if y is None else y, self.position[2] if z is None else z]
+        if wait:
+            time.sleep(math.dist(self.position, target)/speed)
+        self.position = target
+        return 0
+
+    def move_gohome(self, wait=False):
+        return self.set_position(0.0, 0.0, 0.0, speed=100, wait=wait)
+
+    def disconnect(self):
+        pass
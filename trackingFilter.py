@@ -0,0 +1,152 @@
+import numpy as np
+
+#指先の位置（ミラー角度に換算した目標位置）の推定と、遅延を見込んだ予測
+#カメラで撮影してからミラーが動くまでの遅延の間にも指先は動くため、測定した位置をそのまま目標にすると遅れて追従する
+#フィルタで速度を推定し、「指令がミラーに届く時刻」の位置を予測して目標にする
+#
+#フィルタは画素単位で計算する（ミラー角度/1画素あたりの角度）。測定ノイズなどのパラメータは画素で指定する
+
+class AlphaBetaFilter:
+    #等速モデルのα-βフィルタ、alpha: 位置の補正の強さ、beta: 速度の補正の強さ
+    def __init__(self, alpha=0.5, beta=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.reset()
+
+    def reset(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.t = None
+
+    def update(self, z, t):
+        #z: 測定した位置(x, y)、t: 測定した時刻[s]
+        z = np.asarray(z, dtype=np.float64)
+        if self.position is None:
+            self.position, self.t = z, t
+            return self.position
+        dt = t - self.t
+        if dt <= 0:
+            return self.position
+        predicted = self.position + self.velocity*dt
+        residual = z - predicted
+        self.position = predicted + self.alpha*residual
+        self.velocity = self.velocity + (self.beta/dt)*residual
+        self.t = t
+        return self.position
+
+    def predict(self, t):
+        #時刻tの位置を予測する
+        return self.position + self.velocity*(t - self.t)
+
+
+class KalmanFilter:
+    #等速モデルのカルマンフィルタ（x, yを独立に同じモデルで推定する）
+    def __init__(self, measurement_noise=1.0, process_noise=1e5):
+        """
+        measurement_noise: 測定位置の分散[pixel^2]（テンプレートマッチングの誤差）
+        process_noise    : 加速度のスペクトル密度[pixel^2/s^3]、大きいほど速度の変化に速く追従する
+        """
+        self.measurement_noise = measurement_noise
+        self.process_noise = process_noise
+        self.reset()
+
+    def reset(self):
+        self.state = None               #(2軸, [位置, 速度])
+        self.P = np.diag([self.measurement_noise, 1e6])#共分散（x, yで共通）
+        self.t = None
+
+    def update(self, z, t):
+        z = np.asarray(z, dtype=np.float64)
+        if self.state is None:
+            self.state = np.stack([z, np.zeros(2)], axis=1)
+            self.t = t
+            return self.state[:, 0]
+        dt = t - self.t
+        if dt <= 0:
+            return self.state[:, 0]
+        #予測
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.process_noise*np.array([[dt**3/3, dt**2/2], [dt**2/2, dt]])
+        self.state = self.state @ F.T
+        self.P = F @ self.P @ F.T + Q
+        #更新（観測は位置のみ）
+        S = self.P[0, 0] + self.measurement_noise
+        K = self.P[:, 0] / S
+        residual = z - self.state[:, 0]
+        self.state = self.state + residual[:, None]*K[None, :]
+        self.P = self.P - np.outer(K, self.P[0, :])
+        self.t = t
+        return self.state[:, 0]
+
+    @property
+    def position(self):
+        return self.state[:, 0]
+
+    @property
+    def velocity(self):
+        return self.state[:, 1]
+
+    def predict(self, t):
+        return self.state[:, 0] + self.state[:, 1]*(t - self.t)
+
+
+def createFilter(method, **kwargs):
+    #method: "none"（フィルタなし、従来の比例制御と同じ）、"alphabeta"、"kalman"
+    if method == "none":
+        return None
+    if method == "alphabeta":
+        return AlphaBetaFilter(**kwargs)
+    if method == "kalman":
+        return KalmanFilter(**kwargs)
+    raise ValueError(f"unknown filter: {method}")
+
+
+class TrackingController:
+    """
+    レーザ位置から指先までの距離(画素)を受け取り、次のミラー角度を返す
+    目標角度 z = 現在の角度 - 距離*interval をフィルタで推定し、遅延後の目標を予測して
+    X += gain*(予測した目標 - X) とする
+    filter=None, gain=0.5の場合は従来の X -= distance*interval/10*5 と同じ
+
+    pixel_map(mirrorCalibration.PixelMirrorMap)を指定した場合は、指先の画素位置(laser_point + 距離)をフィルタで推定し、
+    予測した画素を較正表でミラー角度に変換して目標とする（1画素あたりの角度を一定と仮定しない、gain=1で1回で到達する）
+    """
+    def __init__(self, X, Y, intervalX, intervalY, filter=None, gain=0.5, extra_latency_s=0.0, pixel_map=None, laser_point=None):
+        """
+        X, Y           : 現在のミラー角度
+        intervalX, Y   : 1画素あたりのミラー角度
+        filter         : AlphaBetaFilter、KalmanFilter、またはNone
+        gain           : 目標への1回あたりの移動の割合(0~1)
+        extra_latency_s: 測定した遅延に加える時間（ミラーのプロセスが指令を反映するまでの時間など）
+        pixel_map      : 画素→ミラー角度の較正表、Noneならintervalによる比例制御
+        laser_point    : pixel_mapを使う場合のレーザの照射位置（画素）
+        """
+        if pixel_map is not None and laser_point is None:
+            raise ValueError("laser_point is required with pixel_map")
+        self.pixel_map = pixel_map
+        self.laser_point = laser_point
+        self.X = X
+        self.Y = Y
+        self.intervalX = intervalX
+        self.intervalY = intervalY
+        self.filter = filter
+        self.gain = gain
+        self.extra_latency_s = extra_latency_s
+
+    def update(self, distance, t, latency_s=0.0):
+        #distance: レーザ位置から指先までの距離(x, y)[pixel]、t: 撮影時刻[s]、latency_s: 撮影から指令が届くまでの時間
+        if self.pixel_map is not None:
+            finger = np.array([self.laser_point[0] + distance[0], self.laser_point[1] + distance[1]])#指先の画素位置
+            if self.filter is not None:
+                self.filter.update(finger, t)
+                finger = self.filter.predict(t + latency_s + self.extra_latency_s)
+            target_X, target_Y = self.pixel_map.lookup(finger)
+        else:
+            target = np.array([self.X/self.intervalX - distance[0], self.Y/self.intervalY - distance[1]])#画素単位の目標
+            if self.filter is not None:
+                self.filter.update(target, t)
+                target = self.filter.predict(t + latency_s + self.extra_latency_s)
+            target_X, target_Y = target[0]*self.intervalX, target[1]*self.intervalY
+        self.X += self.gain*(target_X - self.X)
+        self.Y += self.gain*(target_Y - self.Y)
+        return self.X, self.Y
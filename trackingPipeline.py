@@ -0,0 +1,226 @@
+import threading
+import time
+import collections
+
+import numpy as np
+
+import instrumentation
+
+#カメラの撮影 → テンプレートマッチング → ミラーへの指令 を別々のスレッドで並行に行う
+#各段の間は1つだけ値を保持するLatestSlotで受け渡す。後段が遅れている時は古い値を上書きするため、
+#キューに溜まった古い画像を処理して遅延が増えることがなく、前段が後段を待つこともない
+#
+#  grabスレッド ──LatestSlot(画像)──> matchスレッド ──LatestSlot(指令)──> actuateスレッド
+
+
+class LatestSlot:
+    #最新の値を1つだけ保持する受け渡し場所（上書きされた値は捨てられる）
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__value = None
+        self.__sequence = 0     #putされた回数
+        self.__taken = 0        #getで取り出した値のsequence
+        self.__closed = False
+        self.overwritten = 0    #取り出される前に上書きされた回数
+
+    def put(self, value):
+        with self.__condition:
+            if self.__sequence > self.__taken:
+                self.overwritten += 1
+            self.__value = value
+            self.__sequence += 1
+            self.__condition.notify_all()
+
+    def get(self, timeout=None):
+        #前回のget以降にputされた最新の値を返す、timeoutまでに新しい値がない場合やclose後はNone
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__sequence > self.__taken or self.__closed, timeout):
+                return None
+            if self.__sequence == self.__taken:
+                return None
+            self.__taken = self.__sequence
+            value, self.__value = self.__value, None
+            return value
+
+    def close(self):
+        #待機しているgetを終了させる
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+class StageTimer:
+    #処理段階ごとの処理時間を直近max_samples回分保持し、統計を返す（複数スレッドから記録できる）
+    def __init__(self, max_samples=10000):
+        self.__lock = threading.Lock()
+        self.__samples = collections.defaultdict(lambda: collections.deque(maxlen=max_samples))
+        self.__counts = collections.Counter()
+
+    def record(self, stage, seconds, start=None):
+        #start: 区間の開始時刻(time.perf_counter())、指定した場合はinstrumentationのトレースにも記録する
+        if start is not None:
+            instrumentation.complete(stage, start, seconds)
+        with self.__lock:
+            self.__samples[stage].append(seconds)
+            self.__counts[stage] += 1
+
+    def measure(self, stage):
+        return _Measure(self, stage)
+
+    def recentMean(self, stage, count=100, default=0.0):
+        #直近count回の平均[s]（記録がなければdefault）
+        with self.__lock:
+            samples = self.__samples.get(stage)
+            if not samples:
+                return default
+            recent = list(samples)[-count:] if len(samples) > count else list(samples)
+        return sum(recent)/len(recent)
+
+    def samples(self, stage):
+        with self.__lock:
+            return np.array(self.__samples[stage])
+
+    def summary(self):
+        #{段階: {count, mean, p50, p95, max}}、時間の単位はms
+        with self.__lock:
+            stages = {stage: (np.array(samples), self.__counts[stage]) for stage, samples in self.__samples.items()}
+        result = {}
+        for stage, (samples, count) in stages.items():
+            if samples.size == 0:
+                continue
+            samples = samples * 1000
+            result[stage] = {"count": count,
+                             "mean": float(samples.mean()),
+                             "p50": float(np.percentile(samples, 50)),
+                             "p95": float(np.percentile(samples, 95)),
+                             "max": float(samples.max())}
+        return result
+
+    def report(self):
+        for stage, stats in self.summary().items():
+            print(f"  {stage:<10} n={stats['count']:<7} mean {stats['mean']:7.3f} ms  p50 {stats['p50']:7.3f} ms  "
+                  f"p95 {stats['p95']:7.3f} ms  max {stats['max']:7.3f} ms")
+
+
+class _Measure:
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.stage, time.perf_counter() - self.start, self.start)
+        return False
+
+
+class TrackingPipeline:
+    """
+    grab    : grab() -> 画像 または None（タイムアウトなど画像がない時）
+              (画像, 撮影時刻) を返した場合はその時刻を撮影時刻とする（カメラのタイムスタンプを換算した時刻など、time.perf_counter()と同じ時計[s]）
+    match   : match(画像, 撮影時刻) -> (指令 または None（指令を送らない時）, 処理済みの画像)
+              重い処理（変換、マッチング、制御則）はここで行う。処理済みの画像は縮小・描画したものなど、recordに渡す画像
+    actuate : actuate(指令)、ミラーへの送信
+    record  : record(処理済みの画像, 撮影時刻)、matchが返した画像を渡す（録画など、Noneなら何もしない）
+
+    各段の時間はtimer(StageTimer)に記録する
+      grab: 画像の取得待ちを含む1フレームの時間、match: matchの処理時間、actuate: actuateの処理時間
+      latency: 撮影時刻（grabが時刻を返さない場合は画像を取得した時刻）から、その画像に基づく指令の送信が終わるまでの時間
+    """
+    def __init__(self, grab, match, actuate, record=None, timer=None):
+        self.grab = grab
+        self.match = match
+        self.actuate = actuate
+        self.record = record
+        self.timer = StageTimer() if timer is None else timer
+        self.frames = LatestSlot()
+        self.commands = LatestSlot()
+        self.error = None
+        self.grabbed = 0
+        self.matched = 0
+        self.actuated = 0
+        self.__stop = threading.Event()
+        self.__threads = []
+
+    def start(self):
+        self.error = None
+        self.__stop.clear()
+        self.frames = LatestSlot()
+        self.commands = LatestSlot()
+        self.__threads = [threading.Thread(target=self.__run, args=(self.__grabLoop,), name="tracking-grab", daemon=True),
+                          threading.Thread(target=self.__run, args=(self.__matchLoop,), name="tracking-match", daemon=True),
+                          threading.Thread(target=self.__run, args=(self.__actuateLoop,), name="tracking-actuate", daemon=True)]
+        for thread in self.__threads:
+            thread.start()
+
+    def __run(self, loop):
+        #いずれかのスレッドで例外が起きたら全体を止める（例外はstopで呼び出し元に投げる）
+        try:
+            loop()
+        except Exception as e:
+            print(f"{threading.current_thread().name} error: {e}")
+            if self.error is None:
+                self.error = e
+            self.__stop.set()
+            self.frames.close()
+            self.commands.close()
+
+    def __grabLoop(self):
+        while not self.__stop.is_set():
+            start = time.perf_counter()
+            image = self.grab()
+            if image is None:
+                continue
+            t_grab = time.perf_counter()
+            self.timer.record("grab", t_grab - start, start)
+            if isinstance(image, tuple):
+                image, t_grab = image
+            self.grabbed += 1
+            self.frames.put((image, t_grab))
+
+    def __matchLoop(self):
+        while not self.__stop.is_set():
+            item = self.frames.get(timeout=0.1)
+            if item is None:
+                continue
+            image, t_grab = item
+            with self.timer.measure("match"):
+                command, image = self.match(image, t_grab)
+            self.matched += 1
+            if command is not None:
+                self.commands.put((command, t_grab))
+            if self.record is not None:
+                self.record(image, t_grab)
+
+    def __actuateLoop(self):
+        while not self.__stop.is_set():
+            item = self.commands.get(timeout=0.1)
+            if item is None:
+                continue
+            command, t_grab = item
+            with self.timer.measure("actuate"):
+                self.actuate(command)
+            self.actuated += 1
+            self.timer.record("latency", time.perf_counter() - t_grab, t_grab)
+
+    def is_running(self):
+        return self.error is None and any(thread.is_alive() for thread in self.__threads)
+
+    def stop(self):
+        #全スレッドを止めて終了を待つ、スレッドで例外が起きていた場合はここで投げる
+        self.__stop.set()
+        self.frames.close()
+        self.commands.close()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        if self.error is not None:
+            raise self.error
+
+    def report(self, elapsed_s):
+        print(f"tracking pipeline: {self.grabbed} grabbed / {self.matched} matched / {self.actuated} actuated "
+              f"in {elapsed_s:.2f} s ({self.grabbed/max(elapsed_s, 1e-9):.1f} fps)")
+        print(f"  dropped frames: {self.frames.overwritten}, coalesced commands: {self.commands.overwritten}")
+        self.timer.report()
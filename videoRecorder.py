@@ -0,0 +1,129 @@
+import time
+import queue
+import threading
+
+import cv2
+
+import frameStore
+
+#撮影中の画像を別スレッドで逐次ファイルに書き込む録画
+#以前は全フレームをimage_listに溜めて撮影後にcreateVideoで動画にしていたため、50秒(約25000フレーム)の撮影でメモリを大量に使い、
+#撮影後の動画作成にも時間がかかっていた。ここでは上限のあるキューを介して書き込むため、撮影時間によらずメモリ使用量は一定
+#
+#書き込みが追いつかない時の方針(policy)
+#  "drop"     : キューが一杯ならそのフレームを捨てる（撮影側は待たない）
+#  "decimate" : キューが埋まってきたら間引き率を2倍にし(1/2, 1/4, ...)、空いてきたら戻す（撮影側は待たない）
+#  "block"    : キューが空くまで撮影側が待つ（全フレームを残すが、撮影・追従が遅れる）
+#保存形式(mode)
+#  "mp4" : cv2.VideoWriter(mp4v)で圧縮して保存
+#  "raw" : frameStoreに無圧縮のグレースケール画像と撮影時刻を保存（エンコードしないため速い、ファイルは大きい）
+#          FrameStoreReaderでnp.memmapとして読み、そのまま再解析できる
+
+POLICIES = ("drop", "decimate", "block")
+MODES = ("mp4", "raw")
+
+
+class VideoRecorder:
+    def __init__(self, videoName, fps, mode="mp4", policy="drop", queue_size=256, **metadata):
+        """
+        videoName : 保存先（拡張子なし、mp4なら.mp4、rawなら.frames/.indexを付ける）
+        fps       : 動画のフレームレート
+        mode      : "mp4" または "raw"
+        policy    : "drop"、"decimate"、"block"
+        queue_size: 書き込み待ちのフレームを保持する数の上限
+        metadata  : rawのヘッダに保存する値（撮影画像に掛けた縮小率scaleなど）
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.videoName = videoName
+        self.fps = fps
+        self.mode = mode
+        self.policy = policy
+        self.metadata = metadata
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.decimation = 1     #decimateで何フレームに1回書き込むか
+        self.received = 0       #writeに渡されたフレーム数
+        self.written = 0        #書き込んだフレーム数
+        self.dropped = 0        #キューが一杯で捨てたフレーム数
+        self.decimated = 0      #間引いたフレーム数
+        self.error = None
+        self.__writer = None
+        self.__thread = threading.Thread(target=self.__run, name="video-recorder", daemon=True)
+        self.__thread.start()
+
+    @property
+    def path(self):
+        return self.videoName + ('.mp4' if self.mode == "mp4" else frameStore.FRAMES_EXTENSION)
+
+    def write(self, image, timestamp=None):
+        #撮影側から呼ぶ、書き込み待ちに入れた場合True、捨てた・間引いた場合False
+        #timestamp: 撮影時刻（rawで保存する、Noneなら呼び出した時刻）
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        index = self.received
+        self.received += 1
+        if self.policy == "decimate":
+            fill = self.queue.qsize() / self.queue.maxsize
+            if fill > 0.75:
+                self.decimation = min(self.decimation*2, 64)
+            elif fill < 0.25 and self.decimation > 1:
+                self.decimation //= 2
+            if index % self.decimation != 0:
+                self.decimated += 1
+                return False
+        if self.policy == "block":
+            self.queue.put((image, timestamp))
+            return True
+        try:
+            self.queue.put_nowait((image, timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def __open(self, image):
+        if self.mode == "mp4":
+            height, width = image.shape[0], image.shape[1]
+            self.__writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height), isColor=True)
+        else:
+            self.__writer = frameStore.FrameStoreWriter(self.videoName, self.fps, **self.metadata)
+
+    def __run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                image, timestamp = item
+                if self.__writer is None:
+                    self.__open(image)
+                if self.mode == "mp4":
+                    if len(image.shape) == 2:
+                        image = cv2.cvtColor(image,cv2.COLOR_GRAY2BGR)
+                    self.__writer.write(image)
+                else:
+                    self.__writer.write(image, timestamp)
+                self.written += 1
+        except Exception as e:
+            print(f"video recorder error: {e}")
+            self.error = e
+            #撮影側がblockで止まらないように残りを捨てる
+            while self.queue.get() is not None:
+                pass
+
+    def close(self):
+        #残りのフレームを書き終えてからファイルを閉じる
+        self.queue.put(None)
+        self.__thread.join()
+        if self.__writer is not None:
+            if self.mode == "mp4":
+                self.__writer.release()
+            else:
+                self.__writer.close()
+        print(f"video recorder: {self.written} written / {self.received} received "
+              f"({self.dropped} dropped, {self.decimated} decimated) -> {self.path}")
+        if self.error is not None:
+            raise self.error
+        return self.path